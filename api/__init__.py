@@ -9,13 +9,15 @@
 # from, out of or in connection with the software or the use or
 # other dealings in the software.
 
-from flask import Flask
-from .accounts import accounts_bp
+from flask import Flask, Response
+from .accounts import create_accounts_blueprint
 from .blockchain import create_blockchain_blueprint
 from .contracts import create_contracts_blueprint
 from .fts import create_fts_blueprint
 from .nfts import create_nfts_blueprint
+from .rpc import create_rpc_blueprint
 from .transactions import create_transactions_blueprint
+from metrics import metrics
 import logging
 
 def create_app(blockchain, miner):
@@ -25,12 +27,18 @@ def create_app(blockchain, miner):
     logging.basicConfig(level=logging.INFO)
 
     # Registering the Blueprints with the blockchain instance
-    app.register_blueprint(accounts_bp, url_prefix='/accounts')
+    app.register_blueprint(create_accounts_blueprint(blockchain), url_prefix='/accounts')
     app.register_blueprint(create_blockchain_blueprint(blockchain, miner), url_prefix='/blockchain')
     app.register_blueprint(create_contracts_blueprint(blockchain), url_prefix='/contracts')
     app.register_blueprint(create_fts_blueprint(blockchain), url_prefix='/fts')
     app.register_blueprint(create_nfts_blueprint(blockchain), url_prefix='/nfts')
     app.register_blueprint(create_transactions_blueprint(blockchain), url_prefix='/transactions')
+    app.register_blueprint(create_rpc_blueprint(blockchain), url_prefix='/rpc')
+
+    # Prometheus scrape endpoint
+    @app.route('/metrics')
+    def prometheus_metrics():
+        return Response(metrics.exposition(), mimetype='text/plain; version=0.0.4')
 
     # Global error handlers (Optional)
     @app.errorhandler(404)
@@ -8,107 +8,133 @@
 # other dealings in the software.
 
 from flask import Blueprint, request, jsonify
+from .pagination import list_response, page_args
 from wallet import Wallet
-from state import BlockchainState
-from database import BlockchainDatabase  # Import the database
 
-accounts_bp = Blueprint('accounts', __name__)
+WALLET_NAME_LENGTH = 8  # Wallet files are named after the first 8 characters of the address
 
-# Initialize the Wallet, Database, and BlockchainState instances
-wallet = Wallet()
-db = BlockchainDatabase()  # Create the database instance
-blockchain_state = BlockchainState(db)  # Pass the database instance to BlockchainState
+def create_accounts_blueprint(blockchain):
+    accounts_bp = Blueprint('accounts', __name__)
 
-# Create Account
-@accounts_bp.route('/create', methods=['POST'])
-def create_account():
-    data = request.get_json()
-    password = data.get('password')
-    if not password:
-        return jsonify({'error': 'Password is required'}), 400
+    # Balances come from the node's own state and database rather than a
+    # second database instance opened by the API.
+    wallet = Wallet()
+    blockchain_state = blockchain.state
 
-    try:
-        new_wallet = wallet.create_wallet(password)
-        return jsonify({
-            'address': new_wallet['public_key'],
-            'private_key': new_wallet['private_key']
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-# Get Account Balance
-@accounts_bp.route('/balance/<address>', methods=['GET'])
-def get_balance(address):
-    balance = blockchain_state.get_balance(address)
-    return jsonify({
-        'address': address,
-        'balance': balance
-    })
+    # Create Account
+    @accounts_bp.route('/create', methods=['POST'])
+    def create_account():
+        data = request.get_json()
+        password = data.get('password')
+        if not password:
+            return jsonify({'error': 'Password is required'}), 400
 
-# List All Accounts
-@accounts_bp.route('/list', methods=['GET'])
-def list_accounts():
-    accounts_with_balances = []
-    account_filenames = wallet.list_wallets()
-
-    for filename in account_filenames:
         try:
-            wallet_data = wallet.load_wallet(filename)
-            public_key = wallet_data['public_key']
-            balance = blockchain_state.get_balance(public_key)
-            accounts_with_balances.append({
-                'address': public_key,
-                'balance': balance
+            new_wallet = wallet.create_wallet(password)
+            return jsonify({
+                'address': new_wallet['public_key'],
+                'private_key': new_wallet['private_key']
             })
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
-    return jsonify(accounts_with_balances)
-
-# Import Account
-@accounts_bp.route('/import', methods=['POST'])
-def import_account():
-    data = request.get_json()
-    private_key = data.get('private_key')
-    if not private_key:
-        return jsonify({'error': 'Private key is required'}), 400
-    public_key = wallet.get_public_key(private_key)
-    wallet_data = {
-        'public_key': public_key,
-        'private_key': private_key
-    }
-    wallet.save_wallet(wallet_data)
-    return jsonify({
-        'address': public_key
-    })
-
-# Export Account
-@accounts_bp.route('/export/<address>', methods=['GET'])
-def export_account(address):
-    try:
-        wallet_data = wallet.load_wallet(address)
-        return jsonify({
-            'address': wallet_data['public_key'],
-            'private_key': wallet_data['private_key']
-        })
-    except FileNotFoundError:
-        return jsonify({'error': 'Account not found'}), 404
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    # Get Account Balance
+    @accounts_bp.route('/balance/<address>', methods=['GET'])
+    def get_balance(address):
+        at = request.args.get('at')
+        if at is None:
+            balance = blockchain_state.get_balance(address)
+            return jsonify({
+                'address': address,
+                'balance': balance
+            })
 
-# Get Account Ownership
-@accounts_bp.route('/ownership/<address>', methods=['GET'])
-def check_ownership(address):
-    try:
-        wallet_data = wallet.load_wallet(address)
+        # Historical balance, read from the per-block balance deltas
+        try:
+            height = int(at)
+        except ValueError:
+            return jsonify({'error': 'Block height must be an integer'}), 400
+        if height < 0:
+            return jsonify({'error': 'Block height must not be negative'}), 400
+        if height > len(blockchain.chain):
+            return jsonify({'error': 'Block not found'}), 404
         return jsonify({
             'address': address,
-            'is_owned': True
+            'balance': blockchain.db.get_balance_at(address, height),
+            'at': height
         })
-    except FileNotFoundError:
+
+    # List All Accounts, ordered by address (?after=<address>&limit=, or format=ndjson to stream)
+    @accounts_bp.route('/list', methods=['GET'])
+    def list_accounts():
+        try:
+            after, limit = page_args(str, '')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Wallet files are named by address prefix, so pages are cut over the
+        # file names and only the wallets on the page are opened. Private keys
+        # stay encrypted; only the stored address is read.
+        def accounts():
+            for name in sorted(wallet.list_wallets()):
+                if name > after[:WALLET_NAME_LENGTH]:
+                    address = wallet.get_wallet_address(name)
+                    yield {
+                        'address': address,
+                        'balance': blockchain_state.get_balance(address)
+                    }
+
+        try:
+            return list_response(accounts(), 'accounts', limit, lambda account: account['address'])
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    # Import Account
+    @accounts_bp.route('/import', methods=['POST'])
+    def import_account():
+        data = request.get_json()
+        private_key = data.get('private_key')
+        if not private_key:
+            return jsonify({'error': 'Private key is required'}), 400
+        public_key = wallet.get_public_key(private_key)
+        wallet_data = {
+            'public_key': public_key,
+            'private_key': private_key
+        }
+        wallet.save_wallet(wallet_data)
         return jsonify({
-            'address': address,
-            'is_owned': False
+            'address': public_key
         })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+
+    # Export Account
+    @accounts_bp.route('/export/<address>', methods=['GET'])
+    def export_account(address):
+        try:
+            wallet_data = wallet.load_wallet(address)
+            return jsonify({
+                'address': wallet_data['public_key'],
+                'private_key': wallet_data['private_key']
+            })
+        except FileNotFoundError:
+            return jsonify({'error': 'Account not found'}), 404
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    # Get Account Ownership
+    @accounts_bp.route('/ownership/<address>', methods=['GET'])
+    def check_ownership(address):
+        try:
+            wallet_data = wallet.load_wallet(address)
+            return jsonify({
+                'address': address,
+                'is_owned': True
+            })
+        except FileNotFoundError:
+            return jsonify({
+                'address': address,
+                'is_owned': False
+            })
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    return accounts_bp
@@ -8,46 +8,68 @@
 # other dealings in the software.
 
 from flask import Blueprint, jsonify
+from parameters import parameters
+from .cache import ResponseCache
+from .pagination import list_response, page_args, parse_position
 
 def create_blockchain_blueprint(blockchain, miner):
     blockchain_bp = Blueprint('blockchain', __name__)
 
+    # Everything here except the hashrate only changes when a block is
+    # committed, so responses are served from memory between blocks.
+    cache = ResponseCache(blockchain, parameters['api_cache_size'])
+
     # Get Blockchain Info
     @blockchain_bp.route('/info', methods=['GET'])
+    @cache.cached
     def get_blockchain_info():
+        latest = blockchain.chain.get_header(-1) if len(blockchain.chain) else None
         info = {
             'number_of_blocks': len(blockchain.chain),
-            'difficulty': blockchain.chain[-1]['difficulty'] if blockchain.chain else 0,
-            'latest_block_hash': blockchain.hash(blockchain.chain[-1]) if blockchain.chain else None
+            'difficulty': latest['difficulty'] if latest else 0,
+            'latest_block_hash': latest['block_hash'] if latest else None
         }
         return jsonify(info)
 
     # Get Block by Index
     @blockchain_bp.route('/block/<int:index>', methods=['GET'])
+    @cache.cached
     def get_block_by_index(index):
         if index < len(blockchain.chain):
             return jsonify(blockchain.chain[index])
         return jsonify({'error': 'Block not found'}), 404
 
+    # List Blocks, in chain order (?after=<block_number>&limit=, or format=ndjson to stream)
+    @blockchain_bp.route('/blocks', methods=['GET'])
+    @cache.cached
+    def list_blocks():
+        try:
+            (after,), limit = page_args(lambda value: parse_position(value, 1), (0,))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return list_response(blockchain.db.iter_blocks(after + 1), 'blocks', limit, lambda block: str(block['block_number']))
+
     # Get Block by Hash
     @blockchain_bp.route('/blockhash/<hash>', methods=['GET'])
+    @cache.cached
     def get_block_by_hash(hash):
-        for block in blockchain.chain:
-            if blockchain.hash(block) == hash:
-                return jsonify(block)
+        block = blockchain.get_block_by_hash(hash)
+        if block:
+            return jsonify(block)
         return jsonify({'error': 'Block not found'}), 404
 
     # Get Transaction by Hash
     @blockchain_bp.route('/transaction/<hash>', methods=['GET'])
+    @cache.cached
     def get_transaction_by_hash(hash):
-        for block in blockchain.chain:
-            for transaction in block['transactions']:
-                if blockchain.hash(transaction) == hash:
-                    return jsonify(transaction)
+        transaction = blockchain.get_transaction_by_hash(hash)
+        if transaction:
+            return jsonify(transaction)
         return jsonify({'error': 'Transaction not found'}), 404
 
     # Get Latest Block
     @blockchain_bp.route('/latest', methods=['GET'])
+    @cache.cached
     def get_latest_block():
         if blockchain.chain:
             return jsonify(blockchain.chain[-1])
@@ -55,6 +77,7 @@ def create_blockchain_blueprint(blockchain, miner):
 
     # Get Blockchain Length
     @blockchain_bp.route('/length', methods=['GET'])
+    @cache.cached
     def get_blockchain_length():
         return jsonify({'length': len(blockchain.chain)})
 
@@ -66,13 +89,12 @@ def create_blockchain_blueprint(blockchain, miner):
 
     # Get Average Block Time
     @blockchain_bp.route('/blocktime', methods=['GET'])
+    @cache.cached
     def get_block_time():
         if len(blockchain.chain) > 1:
-            times = [
-                blockchain.chain[i]['timestamp'] - blockchain.chain[i-1]['timestamp']
-                for i in range(1, len(blockchain.chain))
-            ]
-            average_block_time = sum(times) / len(times)
+            # The mean of the gaps between consecutive blocks is the overall span over the gap count
+            span = blockchain.chain.get_header(-1)['timestamp'] - blockchain.chain.get_header(0)['timestamp']
+            average_block_time = span / (len(blockchain.chain) - 1)
             return jsonify({'block_time': average_block_time})
         return jsonify({'block_time': None})
 
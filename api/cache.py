@@ -0,0 +1,70 @@
+# api/cache.py
+
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Response cache for read endpoints whose answer only changes with the
+# chain. Entries are tagged with the chain tip they were built at and
+# are discarded as soon as the tip moves, whether a block was added or
+# the chain was reorganized.
+
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import Response, make_response, request
+
+
+class ResponseCache:
+    def __init__(self, blockchain, max_entries):
+        self.blockchain = blockchain
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (path, query string, Accept) -> (tip, body, mimetype, etag)
+        self.lock = threading.Lock()
+
+    def tip(self):
+        chain = self.blockchain.chain
+        with chain.lock:
+            return (len(chain), chain.get_header(-1)['block_hash']) if len(chain) else (0, None)
+
+    def cached(self, view):
+        """
+        Decorates a GET view. Successful responses are kept per path, query
+        string and Accept header until the chain tip changes, sent with an
+        ETag, and answered with 304 Not Modified when the client's
+        If-None-Match matches.
+        """
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (request.path, request.query_string, request.headers.get('Accept'))
+            tip = self.tip()
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] == tip:
+                    self.entries.move_to_end(key)
+                else:
+                    entry = None
+
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                body = response.get_data()
+                entry = (tip, body, response.mimetype, '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest())
+                with self.lock:
+                    self.entries[key] = entry
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+
+            _, body, mimetype, etag = entry
+            if request.if_none_match.contains(etag.strip('"')):
+                return Response(status=304, headers={'ETag': etag})
+            return Response(body, mimetype=mimetype, headers={'ETag': etag})
+        return wrapper
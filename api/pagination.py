@@ -0,0 +1,80 @@
+# api/pagination.py
+
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Keyset pagination and NDJSON streaming for list endpoints. A page is
+# addressed by the key of the last row the client saw (`after`) rather
+# than an offset, so reading page N costs one index seek. With
+# `format=ndjson` (or `Accept: application/x-ndjson`) rows are streamed
+# one per line as they come off the database cursor.
+
+import itertools
+import json
+from flask import Response, jsonify, request
+from parameters import parameters
+
+NDJSON = 'application/x-ndjson'
+
+def parse_position(value, parts):
+    """Parses a cursor of `parts` comma-separated integers, such as '1200,3'."""
+    try:
+        position = tuple(int(part) for part in value.split(','))
+    except ValueError:
+        position = ()
+    if len(position) != parts:
+        raise ValueError(f"Cursor must be {parts} comma-separated integers")
+    return position
+
+def wants_ndjson():
+    return request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == NDJSON
+
+def page_args(parse_after, default_after):
+    """
+    Reads `after` and `limit` from the query string. The limit defaults to
+    `api_page_size` and is capped at `api_max_page_size`, except for NDJSON
+    streams, which run to the end unless a limit is given.
+    """
+    after = request.args.get('after')
+    after = parse_after(after) if after else default_after
+    limit = request.args.get('limit')
+    if limit is None:
+        return after, None if wants_ndjson() else parameters['api_page_size']
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError("Limit must be an integer")
+    if limit < 1:
+        raise ValueError("Limit must be positive")
+    return after, limit if wants_ndjson() else min(limit, parameters['api_max_page_size'])
+
+def list_response(rows, key, limit, cursor_of):
+    """
+    Answers with up to `limit` rows from the iterator `rows`: as a JSON page
+    {key: [...], 'next': cursor} where `next` is None on the last page, or
+    as an NDJSON stream. `cursor_of` gives the `after` value of a row.
+    """
+    if wants_ndjson():
+        return Response(stream_rows(itertools.islice(rows, limit), rows), mimetype=NDJSON)
+    try:
+        page = list(itertools.islice(rows, limit))
+    finally:
+        close(rows)
+    return jsonify({key: page, 'next': cursor_of(page[-1]) if len(page) == limit else None})
+
+def stream_rows(rows, source):
+    try:
+        for row in rows:
+            yield json.dumps(row) + '\n'
+    finally:
+        close(source)  # Releases the database cursor when the client goes away early
+
+def close(rows):
+    if hasattr(rows, 'close'):
+        rows.close()
@@ -0,0 +1,145 @@
+# api/rpc.py
+
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# JSON-RPC 2.0 endpoint for running many read calls in one HTTP request.
+# Each method is a GET endpoint of the other blueprints; its params fill
+# the URL path and query string, and the endpoint's JSON body is the
+# result. Calls run without holding the blockchain lock; the chain height
+# and tip hash, which fix the confirmed state, are read under the lock
+# before and after the batch, and a batch that straddled a new block or a
+# reorganization is run again, so every call sees the same chain. Pool
+# changes do not move the tip, so a busy pool never stalls a batch;
+# pending balances are read as of each call. A batch that never gets a
+# stable run is answered with errors rather than mixed results. The
+# height and tip hash it saw are returned in X-Chain-Height and X-Chain-Tip.
+
+from flask import Blueprint, Response, current_app, jsonify, make_response, request, url_for
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import BuildError
+from parameters import parameters
+
+# RPC method -> Flask endpoint
+METHODS = {
+    'blockchain.info': 'blockchain.get_blockchain_info',
+    'blockchain.length': 'blockchain.get_blockchain_length',
+    'blockchain.latest': 'blockchain.get_latest_block',
+    'blockchain.block': 'blockchain.get_block_by_index',
+    'blockchain.blockByHash': 'blockchain.get_block_by_hash',
+    'blockchain.blocks': 'blockchain.list_blocks',
+    'blockchain.transaction': 'blockchain.get_transaction_by_hash',
+    'blockchain.blockTime': 'blockchain.get_block_time',
+    'blockchain.hashRate': 'blockchain.get_hashrate',
+    'accounts.balance': 'accounts.get_balance',
+    'transactions.all': 'transactions.get_all_transactions',
+    'fts.balance': 'fts.get_balance',
+    'fts.allowance': 'fts.get_allowance',
+    'nfts.owner': 'nfts.owner_of_nft',
+    'nfts.balance': 'nfts.balance_of_nft',
+    'nfts.metadata': 'nfts.nft_metadata',
+}
+
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+CALL_FAILED = -32000  # The endpoint answered with an error status
+STATE_CHANGING = -32001  # The chain or state changed during every run of the batch
+BATCH_ATTEMPTS = 3  # Runs of a batch before giving up on a consistent view
+
+def error(call_id, code, message, data=None):
+    response = {'jsonrpc': '2.0', 'id': call_id, 'error': {'code': code, 'message': message}}
+    if data is not None:
+        response['error']['data'] = data
+    return response
+
+def create_rpc_blueprint(blockchain):
+    rpc_bp = Blueprint('rpc', __name__)
+
+    def chain_view():
+        """(height, tip hash), read together under the lock."""
+        with blockchain.lock:
+            height = len(blockchain.chain)
+            return height, blockchain.chain.get_header(-1)['block_hash'] if height else None
+
+    def is_notification(call):
+        """A well-formed call without an id, which gets no response."""
+        return isinstance(call, dict) and 'id' not in call and call.get('jsonrpc') == '2.0' and isinstance(call.get('method'), str)
+
+    def run_call(app, call):
+        if not isinstance(call, dict) or not isinstance(call.get('method'), str):
+            return error(None, INVALID_REQUEST, "Each call must be an object with a method")
+        call_id = call.get('id')
+        if call.get('jsonrpc') != '2.0':
+            return error(call_id, INVALID_REQUEST, 'Calls must set "jsonrpc": "2.0"')
+        endpoint = METHODS.get(call['method'])
+        if endpoint is None:
+            return error(call_id, METHOD_NOT_FOUND, f"Unknown method {call['method']}")
+        params = call.get('params') or {}
+        if not isinstance(params, dict):
+            return error(call_id, INVALID_PARAMS, "Params must be an object")
+        try:
+            url = url_for(endpoint, **params)
+        except (BuildError, ValueError) as e:
+            return error(call_id, INVALID_PARAMS, f"Invalid params for {call['method']}: {e}")
+
+        # The endpoint runs as if requested on its own, without the HTTP round trip
+        try:
+            with app.test_request_context(url, headers={'Accept': 'application/json'}):
+                response = make_response(app.dispatch_request())
+        except HTTPException as e:
+            return error(call_id, CALL_FAILED, e.description, {'status': e.code})
+        except Exception as e:
+            return error(call_id, CALL_FAILED, str(e), {'status': 500})
+        if response.is_streamed:
+            return error(call_id, INVALID_PARAMS, "Streaming responses are not available over RPC")
+        result = response.get_json(silent=True)
+        if response.status_code >= 400:
+            message = result.get('error') if isinstance(result, dict) else None
+            return error(call_id, CALL_FAILED, message or response.status, {'status': response.status_code})
+        return {'jsonrpc': '2.0', 'id': call_id, 'result': result}
+
+    # Run one call, or a batch of calls given as an array
+    @rpc_bp.route('', methods=['POST'])
+    def rpc():
+        payload = request.get_json(silent=True)
+        if payload is None:
+            return jsonify(error(None, INVALID_REQUEST, "Body must be a JSON-RPC call or an array of calls")), 400
+        calls = payload if isinstance(payload, list) else [payload]
+        if not calls:
+            return jsonify(error(None, INVALID_REQUEST, "Empty batch")), 400
+        if len(calls) > parameters['rpc_max_calls']:
+            return jsonify(error(None, INVALID_REQUEST, f"Batches are limited to {parameters['rpc_max_calls']} calls")), 400
+
+        # Notifications are read calls nobody waits for, so they are not run
+        calls = [call for call in calls if not is_notification(call)]
+        if not calls:
+            return Response(status=204)
+
+        app = current_app._get_current_object()
+        view = chain_view()
+        for _ in range(BATCH_ATTEMPTS):
+            results = [run_call(app, call) for call in calls]
+            served_view, view = view, chain_view()
+            if view == served_view:
+                break
+        else:
+            results = [
+                error(call.get('id') if isinstance(call, dict) else None, STATE_CHANGING, "The chain changed during every run of the batch; retry it")
+                for call in calls
+            ]
+            response = jsonify(results if isinstance(payload, list) else results[0])
+            response.status_code = 503
+            return response
+        response = jsonify(results if isinstance(payload, list) else results[0])
+        response.headers['X-Chain-Height'] = str(served_view[0])
+        response.headers['X-Chain-Tip'] = served_view[1] or ''
+        return response
+
+    return rpc_bp
@@ -10,6 +10,7 @@
 # other dealings in the software.
 
 from flask import Blueprint, request, jsonify
+from .pagination import list_response, page_args, parse_position
 
 def create_transactions_blueprint(blockchain):
     transactions_bp = Blueprint('transactions', __name__)
@@ -45,10 +46,16 @@ def create_transactions_blueprint(blockchain):
             return jsonify({'transaction': transaction})
         return jsonify({'error': 'Transaction not found'}), 404
 
-    # Get All Transactions
+    # Get All Transactions, in chain order (?after=<block,index>&limit=, or format=ndjson to stream)
     @transactions_bp.route('/all', methods=['GET'])
     def get_all_transactions():
-        transactions = blockchain.get_all_transactions()
-        return jsonify({'transactions': transactions})
+        try:
+            after, limit = page_args(lambda value: parse_position(value, 2), (0, -1))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return list_response(
+            blockchain.db.iter_transactions(after), 'transactions', limit,
+            lambda transaction: f"{transaction['block_number']},{transaction['transaction_index']}"
+        )
 
     return transactions_bp
@@ -0,0 +1,112 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Tree of recent blocks indexed by hash, used for fork choice by
+# cumulative work, plus a pool for blocks whose parent is not known yet.
+
+from collections import OrderedDict
+
+def header_work(header):
+    """Expected number of hashes needed to meet a header's difficulty."""
+    return 16 ** (header['difficulty'] // 10**8)
+
+class OrphanPool:
+    def __init__(self, max_size):
+        """Bounded pool of blocks waiting for their parent, oldest evicted first."""
+        self.max_size = max_size
+        self.blocks = OrderedDict()  # block_hash -> block
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __contains__(self, block_hash):
+        return block_hash in self.blocks
+
+    def add(self, block):
+        self.blocks[block['block_hash']] = block
+        while len(self.blocks) > self.max_size:
+            self.blocks.popitem(last=False)
+
+    def pop_children(self, parent_hash):
+        """Removes and returns the orphans whose parent is `parent_hash`."""
+        children = [block for block in self.blocks.values() if block['parent_hash'] == parent_hash]
+        for block in children:
+            del self.blocks[block['block_hash']]
+        return children
+
+
+class BlockTree:
+    """
+    Recent blocks of every branch, keyed by hash. Each node records its
+    height and the cumulative work from the tree's root; the best tip is
+    the node with the most work. Nodes more than `max_depth` blocks below
+    the best tip are pruned.
+    """
+
+    def __init__(self, max_depth):
+        self.max_depth = max_depth
+        self.nodes = {}  # block_hash -> {'block', 'height', 'work'}
+        self.best_hash = None
+
+    def __contains__(self, block_hash):
+        return block_hash in self.nodes
+
+    def reset(self, headers):
+        """Seeds the tree with a run of canonical headers, oldest first."""
+        self.nodes.clear()
+        self.best_hash = None
+        for header in headers:
+            self.add(header, root=not self.nodes)
+
+    def add(self, block, root=False):
+        """
+        Adds a block whose parent is in the tree (or a root block). Returns
+        True if it became the best tip.
+        """
+        work = header_work(block) if root else self.work(block)
+        self.nodes[block['block_hash']] = {'block': block, 'height': block['block_number'], 'work': work}
+
+        if self.best_hash is None or work > self.nodes[self.best_hash]['work']:
+            self.best_hash = block['block_hash']
+            self.prune()
+            return True
+        return False
+
+    def work(self, block):
+        """Cumulative work of a block whose parent is in the tree."""
+        return self.nodes[block['parent_hash']]['work'] + header_work(block)
+
+    def is_heavier(self, block):
+        """True if `block`, added on its parent, would become the best tip."""
+        return self.best_hash is None or self.work(block) > self.nodes[self.best_hash]['work']
+
+    def best(self):
+        return self.nodes[self.best_hash]['block'] if self.best_hash else None
+
+    def branch(self, tip_hash, is_canonical):
+        """
+        Walks back from `tip_hash` to the first block for which
+        `is_canonical(block)` holds. Returns (fork_height, suffix), where
+        suffix lists the non-canonical blocks in height order.
+        """
+        suffix = []
+        block_hash = tip_hash
+        while block_hash in self.nodes:
+            block = self.nodes[block_hash]['block']
+            if is_canonical(block):
+                return block['block_number'], list(reversed(suffix))
+            suffix.append(block)
+            block_hash = block['parent_hash']
+        raise ValueError("Branch does not join the canonical chain inside the block tree")
+
+    def prune(self):
+        """Drops nodes too far below the best tip to matter for fork choice."""
+        floor = self.nodes[self.best_hash]['height'] - self.max_depth
+        for block_hash in [h for h, node in self.nodes.items() if node['height'] < floor]:
+            del self.nodes[block_hash]
@@ -0,0 +1,170 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Exports the chain to a single portable bootstrap file and imports it
+# back offline, so new nodes can be provisioned without a P2P sync.
+#
+#   python bootstrap.py export chain.bootstrap
+#   python bootstrap.py import chain.bootstrap --defer-indexes
+
+import argparse
+import json
+import struct
+import time
+from collections import deque
+from cryptography import Qhash3512
+from database import BlockchainDatabase
+from difficulty import DifficultyTracker
+from parameters import parameters, config_argument_parser
+from pow import block_hash, tx_root
+
+FILE_HEADER = struct.Struct('<8sII')  # magic, format version, network id
+RECORD_HEADER = struct.Struct('<4sI')  # record magic, payload length
+FILE_MAGIC = b'HDRNBOOT'
+RECORD_MAGIC = b'HDRN'
+FORMAT_VERSION = 1
+
+def export_chain(db, path):
+    """Streams every stored block, in block order, into a bootstrap file."""
+    count = 0
+    with open(path, 'wb') as output:
+        output.write(FILE_HEADER.pack(FILE_MAGIC, FORMAT_VERSION, int(parameters['network_id'])))
+        for block in db.iter_blocks():
+            payload = json.dumps(block).encode('utf-8')
+            output.write(RECORD_HEADER.pack(RECORD_MAGIC, len(payload)))
+            output.write(payload)
+            count += 1
+    return count
+
+def read_blocks(path):
+    """Yields the blocks stored in a bootstrap file."""
+    with open(path, 'rb') as source:
+        magic, version, network_id = FILE_HEADER.unpack(source.read(FILE_HEADER.size))
+        if magic != FILE_MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} bootstrap file")
+        if network_id != int(parameters['network_id']):
+            raise ValueError(f"Bootstrap file is for network {network_id}, not {parameters['network_id']}")
+
+        while True:
+            header = source.read(RECORD_HEADER.size)
+            if not header:
+                return
+            if len(header) < RECORD_HEADER.size:
+                raise ValueError("Truncated record header in bootstrap file")
+            magic, length = RECORD_HEADER.unpack(header)
+            if magic != RECORD_MAGIC:
+                raise ValueError("Corrupt record in bootstrap file")
+            payload = source.read(length)
+            if len(payload) < length:
+                raise ValueError("Truncated block in bootstrap file")
+            yield json.loads(payload)
+
+def validate_blocks(blocks, recent, verify_pow=False):
+    """
+    Validates a batch of consecutive blocks against each other and the
+    blocks before them, given as `recent`: a deque holding at least the last
+    difficulty window of headers, which is extended with the batch. Checks
+    numbering, parent linkage, transaction counts and the tx_root over the
+    transactions and, optionally, that each block hash recomputes from its
+    header and that the header carries and meets the required difficulty.
+    """
+    difficulty = DifficultyTracker(None)
+
+    def header_at(block_number):
+        return recent[block_number - recent[0]['block_number']]
+
+    for block in blocks:
+        previous_block = recent[-1] if recent else None
+        expected_number = previous_block['block_number'] + 1 if previous_block else 1
+        if block['block_number'] != expected_number:
+            raise ValueError(f"Expected block {expected_number}, found {block['block_number']}")
+        if previous_block and block['parent_hash'] != previous_block['block_hash']:
+            raise ValueError(f"Block {block['block_number']} does not link to its parent")
+        if block['transaction_count'] != len(block.get('transactions', [])):
+            raise ValueError(f"Block {block['block_number']} has a wrong transaction count")
+        if tx_root(block.get('transactions', [])) != block['tx_root']:
+            raise ValueError(f"Block {block['block_number']} does not match its tx_root")
+        if verify_pow:
+            if block_hash(block) != block['block_hash']:
+                raise ValueError(f"Block {block['block_number']} does not match its hash")
+            if block['difficulty'] != difficulty.required_at(block['block_number'], header_at):
+                raise ValueError(f"Block {block['block_number']} does not carry the required difficulty")
+            # Genesis blocks carry no proof of work
+            if previous_block and not Qhash3512.is_valid_hash(block['block_hash'], block['difficulty']):
+                raise ValueError(f"Block {block['block_number']} does not meet its difficulty")
+        recent.append(block)
+
+def recent_headers(db, height):
+    """The stored headers the next imported block's difficulty depends on."""
+    recent = deque(maxlen=parameters['difficulty_adjustment_period'] + 1)
+    for block_number in range(max(height - recent.maxlen, 0) + 1, height + 1):
+        recent.append(db.get_block_by_number(block_number))
+    return recent
+
+def import_chain(db, path, batch_size=1000, defer_indexes=False, verify_pow=False):
+    """
+    Imports a bootstrap file on top of the blocks already stored. Blocks
+    are validated and committed `batch_size` at a time, each batch in a
+    single database transaction. If the file turns out to be invalid,
+    every block imported from it is removed again.
+    """
+    last_block = db.get_last_block()
+    height = last_block['block_number'] if last_block else 0
+    recent = recent_headers(db, height)
+    imported = 0
+    batch = []
+
+    with db.bulk_load(defer_indexes=defer_indexes):
+        try:
+            for block in read_blocks(path):
+                if block['block_number'] <= height:
+                    stored = db.get_block_by_number(block['block_number'])
+                    if stored and stored['block_hash'] != block['block_hash']:
+                        raise ValueError(f"Block {block['block_number']} conflicts with the local chain")
+                    continue
+
+                batch.append(block)
+                if len(batch) >= batch_size:
+                    validate_blocks(batch, recent, verify_pow)
+                    db.save_blocks(batch)
+                    db.commit()
+                    imported += len(batch)
+                    batch = []
+
+            if batch:
+                validate_blocks(batch, recent, verify_pow)
+                db.save_blocks(batch)
+                imported += len(batch)
+        except Exception:
+            db.truncate(height)
+            raise
+
+    return imported
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import the chain as a bootstrap file", parents=[config_argument_parser()])
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="Bootstrap file")
+    parser.add_argument("--batch-size", type=int, default=parameters.get("import_batch_size", 1000))
+    parser.add_argument("--defer-indexes", action="store_true", help="Rebuild secondary indexes after the import")
+    parser.add_argument("--verify-pow", action="store_true", help="Check every block hash against the difficulty required of it")
+    args = parser.parse_args()  # Unknown options exit with an error, so a mistyped --verify-pow cannot skip checks
+
+    db = BlockchainDatabase()
+    start = time.time()
+    if args.command == "export":
+        count = export_chain(db, args.path)
+        print(f"Exported {count} blocks to {args.path} in {time.time() - start:.2f}s")
+    else:
+        count = import_chain(db, args.path, args.batch_size, args.defer_indexes, args.verify_pow)
+        print(f"Imported {count} blocks from {args.path} in {time.time() - start:.2f}s")
+    db.close()
+
+if __name__ == "__main__":
+    main()
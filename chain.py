@@ -0,0 +1,213 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# In-memory view of the chain. Only the most recent headers are kept in
+# memory; full blocks are read from the database through an LRU cache
+# with a byte budget, so memory use no longer grows with the chain.
+
+import json
+import threading
+from collections import OrderedDict, deque
+
+class LRUBlockCache:
+    def __init__(self, max_bytes):
+        """Cache of full blocks keyed by block number, bounded by size in bytes."""
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.blocks = OrderedDict()  # block_number -> (block, size)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def block_size(block):
+        return block.get('block_size') or len(json.dumps(block))
+
+    def get(self, block_number):
+        entry = self.blocks.get(block_number)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.blocks.move_to_end(block_number)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, block):
+        self.discard(block['block_number'])
+        size = self.block_size(block)
+        self.blocks[block['block_number']] = (block, size)
+        self.size += size
+        while self.size > self.max_bytes and len(self.blocks) > 1:
+            _, (_, evicted_size) = self.blocks.popitem(last=False)
+            self.size -= evicted_size
+
+    def discard(self, block_number):
+        entry = self.blocks.pop(block_number, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        self.blocks.clear()
+        self.size = 0
+
+
+class ChainView:
+    """
+    Sequence-like view of the canonical chain. `chain[i]`, `len(chain)`,
+    `chain[-1]` and iteration behave like the list of blocks they replace,
+    with index i holding block number i + 1.
+    """
+
+    def __init__(self, db, window, cache_bytes):
+        self.db = db
+        self.lock = threading.RLock()
+        self.window = deque(maxlen=window)  # Headers of the most recent blocks
+        self.cache = LRUBlockCache(cache_bytes)
+        self.length = 0
+        # Hash indexes for the blocks in the window; older blocks are
+        # resolved through the database's own hash keys.
+        self.block_numbers = {}  # block_hash -> block_number
+        self.tx_locations = {}  # tx_hash -> (block_number, transaction_index)
+        self.block_tx_hashes = {}  # block_number -> [tx_hash, ...]
+
+    @staticmethod
+    def header(block):
+        return {key: value for key, value in block.items() if key != 'transactions'}
+
+    def load(self):
+        """Loads the headers of the last `window` blocks from the database."""
+        with self.lock:
+            self.window.clear()
+            self.cache.clear()
+            self.block_numbers.clear()
+            self.tx_locations.clear()
+            self.block_tx_hashes.clear()
+            last_block = self.db.get_last_block()
+            self.length = last_block['block_number'] if last_block else 0
+            for block_number in range(max(1, self.length - self.window.maxlen + 1), self.length + 1):
+                block = self.db.get_block_by_number(block_number)
+                if block is None:
+                    raise ValueError(f"Block {block_number} is missing from the database")
+                self.window.append(self.header(block))
+                self.block_numbers[block['block_hash']] = block_number
+
+    def _index_block(self, block):
+        self.block_numbers[block['block_hash']] = block['block_number']
+        tx_hashes = [tx['tx_hash'] for tx in block.get('transactions', []) if 'tx_hash' in tx]
+        for index, tx_hash in enumerate(tx_hashes):
+            self.tx_locations[tx_hash] = (block['block_number'], index)
+        self.block_tx_hashes[block['block_number']] = tx_hashes
+
+    def _unindex_block(self, header):
+        self.block_numbers.pop(header['block_hash'], None)
+        for tx_hash in self.block_tx_hashes.pop(header['block_number'], []):
+            self.tx_locations.pop(tx_hash, None)
+
+    def _is_canonical(self, block_number, block_hash):
+        if block_number < 1 or block_number > self.length:
+            return False
+        first_in_window = self.length - len(self.window) + 1
+        if block_number >= first_in_window:
+            return self.window[block_number - first_in_window]['block_hash'] == block_hash
+        stored = self.db.get_block_by_number(block_number)
+        return stored is not None and stored['block_hash'] == block_hash
+
+    def get_block_by_hash(self, block_hash):
+        """Returns the canonical block with this hash, or None."""
+        with self.lock:
+            block_number = self.block_numbers.get(block_hash)
+            if block_number is None:
+                stored = self.db.get_block(block_hash)
+                if stored is None or not self._is_canonical(stored['block_number'], block_hash):
+                    return None
+                block_number = stored['block_number']
+            return self._get_block(block_number)
+
+    def get_transaction_by_hash(self, tx_hash):
+        """Returns a transaction included in the canonical chain, or None."""
+        with self.lock:
+            location = self.tx_locations.get(tx_hash)
+            if location is not None:
+                return self._get_block(location[0])['transactions'][location[1]]
+            stored = self.db.get_transaction(tx_hash)
+            if stored is None or not self._is_canonical(stored['block_number'], stored['block_hash']):
+                return None
+            return stored
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        with self.lock:
+            if index < 0:
+                index += self.length
+            if index < 0 or index >= self.length:
+                raise IndexError("chain index out of range")
+            return self._get_block(index + 1)
+
+    def _get_block(self, block_number):
+        block = self.cache.get(block_number)
+        if block is not None:
+            return block
+
+        block = self.db.get_block_by_number(block_number)
+        if block is None:
+            raise IndexError(f"Block {block_number} is not stored")
+        if 'transactions' not in block:
+            block['transactions'] = self.db.get_block_transactions(block['block_hash'])
+        self.cache.put(block)
+        return block
+
+    def get_header(self, index):
+        """Returns a block header without loading its transactions when possible."""
+        with self.lock:
+            if index < 0:
+                index += self.length
+            first_in_window = self.length - len(self.window)
+            if first_in_window <= index < self.length:
+                return self.window[index - first_in_window]
+            return self.header(self[index])
+
+    def recent_headers(self, count):
+        """Returns up to `count` of the most recent headers, oldest first."""
+        with self.lock:
+            return list(self.window)[-count:] if count else []
+
+    def append(self, block):
+        with self.lock:
+            if block['block_number'] != self.length + 1:
+                raise ValueError(f"Block {block['block_number']} does not extend a chain of length {self.length}")
+            if len(self.window) == self.window.maxlen:
+                self._unindex_block(self.window[0])
+            self.window.append(self.header(block))
+            self._index_block(block)
+            self.cache.put(block)
+            self.length += 1
+
+    def truncate(self, length):
+        """Drops every block after the first `length` blocks from the view."""
+        with self.lock:
+            for block_number in range(length + 1, self.length + 1):
+                self.cache.discard(block_number)
+            while self.window and self.window[-1]['block_number'] > length:
+                self._unindex_block(self.window.pop())
+            self.length = min(self.length, length)
+            if len(self.window) < self.window.maxlen and self.length > len(self.window):
+                # Refill the window from the database after a deep rollback
+                first = max(1, self.length - self.window.maxlen + 1)
+                missing = range(first, self.length - len(self.window) + 1)
+                refill = [self.header(self._get_block(n)) for n in reversed(missing)]
+                self.window.extendleft(refill)
+                for header in refill:
+                    self.block_numbers[header['block_hash']] = header['block_number']
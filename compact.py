@@ -0,0 +1,94 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Compact block relay. A compact block carries the block header, a short
+# ID for each transaction and, in full, only the transactions peers
+# cannot have in their pools (block rewards). Receivers rebuild the block
+# from their own pending transactions and ask only for the missing ones.
+
+import hashlib
+import json
+from parameters import parameters
+
+SHORT_ID_BYTES = 6
+BLOCK_ANNOTATIONS = ('block_hash', 'block_number', 'transaction_index')
+
+def transaction_data(transaction):
+    """Serialized transaction without its block annotations."""
+    return json.dumps({key: value for key, value in transaction.items() if key not in BLOCK_ANNOTATIONS}, sort_keys=True)
+
+def short_transaction_id(block_hash, transaction):
+    """
+    Short ID of a transaction, keyed by the block so collisions differ from
+    block to block. It covers every field, not just the tx_hash, which
+    leaves out fields such as size and text.
+    """
+    key = block_hash.encode('utf-8')[:hashlib.blake2b.MAX_KEY_SIZE]
+    return hashlib.blake2b(transaction_data(transaction).encode('utf-8'), key=key, digest_size=SHORT_ID_BYTES).hexdigest()
+
+def compact_block(block):
+    """Builds the cmpctblock message for a full block."""
+    short_ids = []
+    prefilled = []
+    for index, transaction in enumerate(block.get('transactions', [])):
+        if transaction['sender'] == parameters['system_account'] or 'tx_hash' not in transaction:
+            prefilled.append({'index': index, 'transaction': transaction})
+        else:
+            short_ids.append(short_transaction_id(block['block_hash'], transaction))
+    header = {key: value for key, value in block.items() if key != 'transactions'}
+    return {'type': 'cmpctblock', 'header': header, 'short_ids': short_ids, 'prefilled': prefilled}
+
+
+class PartialBlock:
+    """A block being rebuilt from a compact block and the local transaction pool."""
+
+    def __init__(self, message, pool):
+        self.header = message['header']
+        count = self.header['transaction_count']
+        if len(message['short_ids']) + len(message['prefilled']) != count:
+            raise ValueError(f"Compact block {self.header['block_hash']} does not describe {count} transactions")
+
+        self.transactions = [None] * count
+        for entry in message['prefilled']:
+            index = entry['index']
+            if not isinstance(index, int) or not 0 <= index < count:
+                raise ValueError(f"Compact block {self.header['block_hash']} prefills transaction {index} of {count}")
+            self.transactions[index] = self.annotate(entry['transaction'], index)
+
+        block_hash = self.header['block_hash']
+        by_short_id = {short_transaction_id(block_hash, tx): tx for tx in pool if 'tx_hash' in tx}
+        slots = [index for index, transaction in enumerate(self.transactions) if transaction is None]
+        if len(slots) != len(message['short_ids']):
+            raise ValueError(f"Compact block {block_hash} has overlapping prefilled transactions")
+        self.short_ids = dict(zip(slots, message['short_ids']))
+        for index, short_id in self.short_ids.items():
+            transaction = by_short_id.get(short_id)
+            if transaction is not None:
+                self.transactions[index] = self.annotate(transaction, index)
+
+    def annotate(self, transaction, index):
+        transaction = dict(transaction)
+        transaction['block_hash'] = self.header['block_hash']
+        transaction['block_number'] = self.header['block_number']
+        transaction['transaction_index'] = index
+        return transaction
+
+    def missing(self):
+        """Indexes of the transactions that were not found in the pool."""
+        return [index for index, transaction in enumerate(self.transactions) if transaction is None]
+
+    def fill(self, indexes, transactions):
+        """Adds the transactions a peer sent for `indexes`; they must match the announced short IDs."""
+        for index, transaction in zip(indexes, transactions):
+            if short_transaction_id(self.header['block_hash'], transaction) != self.short_ids.get(index):
+                raise ValueError(f"Transaction {index} does not match compact block {self.header['block_hash']}")
+            self.transactions[index] = self.annotate(transaction, index)
+
+    def block(self):
+        return dict(self.header, transactions=self.transactions)
@@ -10,7 +10,6 @@
 # This module handles the blockchain consensus mechanism and ensures
 # all nodes work in synergy to keep the blockchain running.
 
-import json
 import logging
 from pow import MineH
 from network import P2PNetwork
@@ -29,24 +28,34 @@ class Consensus:
         :param previous_blocks: List of previous blocks to consider for difficulty adjustment.
         :return: New difficulty level (scaled by 10^8).
         """
-        target_time_per_block = parameters['block_time']  # Use the block time from parameters directly
         adjustment_interval = parameters['difficulty_adjustment_period']
-        scale_factor = 10**8
 
         if len(previous_blocks) < adjustment_interval + 1:
             return parameters['initial_difficulty']
 
         # Fetch the timestamps for the blocks used in the adjustment
-        last_block_time = previous_blocks[-1]['timestamp']
-        first_block_in_interval_time = previous_blocks[-(adjustment_interval + 1)]['timestamp']
-        total_time = last_block_time - first_block_in_interval_time
+        return self.calculate_difficulty(
+            previous_blocks[-(adjustment_interval + 1)]['timestamp'],
+            previous_blocks[-1]['timestamp'],
+            previous_blocks[-1]['difficulty']
+        )
+
+    @staticmethod
+    def calculate_difficulty(first_block_in_interval_time, last_block_time, current_difficulty) -> int:
+        """
+        Difficulty for the next block, given the timestamps of the first and
+        last blocks of the adjustment interval and the last block's difficulty.
+        """
+        target_time_per_block = parameters['block_time']  # Use the block time from parameters directly
+        adjustment_interval = parameters['difficulty_adjustment_period']
+        # Timestamps may be equal or out of order, so keep the ratio positive
+        total_time = max(last_block_time - first_block_in_interval_time, 1)
 
         # Expected total time for the blocks
         expected_time = target_time_per_block * adjustment_interval
 
         # Calculate the new difficulty
         adjustment_ratio = total_time / expected_time  # Adjust ratio should be total_time/expected_time
-        current_difficulty = previous_blocks[-1]['difficulty']
 
         # Calculate the potential new difficulty
         new_difficulty = int(current_difficulty / adjustment_ratio)
@@ -64,7 +73,7 @@ class Consensus:
         # Ensure the new difficulty does not fall below the minimum threshold
         new_difficulty = max(new_difficulty, 100000000)
 
-#        logging.info(f"Difficulty adjusted from {previous_blocks[-1]['difficulty']} to {new_difficulty} "
+#        logging.info(f"Difficulty adjusted from {current_difficulty} to {new_difficulty} "
 #                    f"based on total time {total_time:.2f}s (expected {expected_time:.2f}s)")
 
 #        logging.info(f"Proposed Difficuty Adjustment: {new_difficulty}")
@@ -72,40 +81,5 @@ class Consensus:
         return new_difficulty
 
     def achieve_consensus(self):
-        """Ensures all nodes in the network agree on the longest valid chain."""
-        longest_chain = self.blockchain.chain
-        for peer_chain in self.get_peer_chains():
-            if len(peer_chain) > len(longest_chain) and self.is_chain_valid(peer_chain):
-                longest_chain = peer_chain
-        if longest_chain != self.blockchain.chain:
-            self.blockchain.chain = longest_chain
-
-    def get_peer_chains(self):
-        """Retrieves blockchain data from connected peers."""
-        peer_chains = []
-        for peer_id, peer_socket in self.p2p_network.peers.items():
-            try:
-                peer_socket.send(json.dumps({"type": "request_chain"}).encode('utf-8'))
-                data = peer_socket.recv(4096).decode('utf-8')
-                chain = json.loads(data)
-                if self.is_chain_valid(chain):
-                    peer_chains.append(chain)
-            except Exception as e:
-                print(f"Failed to retrieve chain from peer {peer_id}: {e}")
-        return peer_chains
-
-    def is_chain_valid(self, chain):
-        """Validates a blockchain."""
-        for i in range(1, len(chain)):
-            current_block = chain[i]
-            previous_block = chain[i - 1]
-
-            # Check that the block's previous hash matches the hash of the previous block
-            if current_block['previous_hash'] != self.blockchain.hash_block(previous_block):
-                return False
-
-            # Check that the block's hash meets the difficulty criteria
-            if not self.mineh.is_valid_hash(current_block['hash'], current_block['difficulty']):
-                return False
-
-        return True
+        """Ensures all nodes in the network agree on the chain with the most work."""
+        return self.blockchain.sync_manager.sync()
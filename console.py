@@ -82,6 +82,11 @@ def handle_command(command):
             response = requests.get(f"{API_URL}/blockchain/transaction/{tx_hash}")
             pretty_print(response.json())
 
+        elif command.startswith("accounts.balanceAt "):
+            _, address, height = command.split()
+            response = requests.get(f"{API_URL}/accounts/balance/{address}", params={"at": height})
+            pretty_print(response.json())
+
         elif command.startswith("accounts.balance "):
             _, address = command.split(maxsplit=1)
             response = requests.get(f"{API_URL}/accounts/balance/{address}")
@@ -7,139 +7,231 @@
 # from, out of or in connection with the software or the use or
 # other dealings in the software.
 
-# Manages blockchain data storage using SQLite.
+# Manages blockchain data storage through the configured storage engine
+# (SQLite by default, see storage.py).
 
-import sqlite3
 import os
 import logging
-import threading
+from contextlib import contextmanager
 from parameters import parameters
+from storage import create_storage_engine
 
 class BlockchainDatabase:
-    def __init__(self):
-        self.lock = threading.Lock()  # Initialize the lock
-        """Initialize the SQLite connection using the specified database file."""
-        db_path = os.path.join(parameters["data_directory"], 'blockchain.db')
-
-        if not os.path.exists(parameters["data_directory"]):
-            os.makedirs(parameters["data_directory"])
-
-        self.connection = sqlite3.connect(db_path, check_same_thread=False)
-        self.cursor = self.connection.cursor()
-        self._initialize_database()
-        
-    def _initialize_database(self):
-        """Load the schema from the schema.sql file and initialize the database."""
-        with self.lock:
-            schema_path = os.path.join(os.path.dirname(__file__), 'schema.sql')
-            with open(schema_path, 'r') as schema_file:
-                schema = schema_file.read()
-            self.cursor.executescript(schema)
-            self.connection.commit()
-        print("[Blockchain] Initialized and ready.")
+    def __init__(self, engine=None):
+        """Open the storage engine named by the `storage_engine` parameter."""
+        data_directory = parameters["data_directory"]
+
+        if not os.path.exists(data_directory):
+            os.makedirs(data_directory)
+
+        self.engine_name = engine or parameters.get("storage_engine", "sqlite")
+        self.engine = create_storage_engine(self.engine_name, data_directory)
+        self.migrate()
+        print(f"[Blockchain] Initialized and ready ({self.engine_name} storage).")
+
+    def migrate(self):
+        """
+        Brings a database written by an older version up to date. Chains
+        stored before balance deltas were recorded are replayed once, so
+        running balances of new blocks start from the true prior balance.
+        """
+        if not self.engine.has_balance_deltas() and self.engine.get_last_block() is not None:
+            print("[Blockchain] Backfilling balance deltas for the stored chain...")
+            written = self.backfill_balance_deltas()
+            print(f"[Blockchain] Backfilled balance deltas for {written} blocks.")
 
     def save_block(self, block_hash, block_data):
-        """Saves a block to the SQLite database using the block hash as the key."""
-        try:
-            with self.lock:
-                self.cursor.execute(
-                    """
-                    INSERT OR REPLACE INTO blocks (
-                        block_hash, block_number, parent_hash, state_root, tx_root,
-                        timestamp, miner, block_size, transaction_count, difficulty, nonce
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        block_hash,
-                        block_data["block_number"],
-                        block_data["parent_hash"],
-                        block_data["state_root"],
-                        block_data["tx_root"],
-                        block_data["timestamp"],
-                        block_data["miner"],
-                        block_data["block_size"],
-                        block_data["transaction_count"],
-                        block_data["difficulty"],
-                        block_data["nonce"],
-                    )
-                )
-                self.connection.commit()
+        """Saves a block using the block hash as the key."""
+        try:
+            self.engine.save_block(block_hash, block_data)
             print(f"[Blockchain] Added Block to DB: {block_hash}")
-        except sqlite3.Error as e:
+        except Exception as e:
             print(f"[Blockchain] Error saving block {block_hash}: {e}")
 
+    def save_blocks(self, blocks):
+        """Saves a run of blocks together with their transactions."""
+        try:
+            for block in blocks:
+                self.engine.save_block(block['block_hash'], block)
+                self.engine.save_transactions(block.get('transactions', []))
+                self.engine.save_balance_deltas(block['block_number'], self.block_balance_deltas(block))
+            if blocks:
+                print(f"[Blockchain] Added Blocks {blocks[0]['block_number']}-{blocks[-1]['block_number']} to DB")
+        except Exception as e:
+            print(f"[Blockchain] Error saving blocks: {e}")
+            raise
+
     def get_block(self, block_hash):
         """Retrieves a block from the database using the block hash as the key."""
         try:
-            self.cursor.execute("SELECT * FROM blocks WHERE block_hash=?", (block_hash,))
-            block = self.cursor.fetchone()
-            if block:
-                columns = [desc[0] for desc in self.cursor.description]
-                return dict(zip(columns, block))
-            return None
-        except sqlite3.Error as e:
+            return self.engine.get_block(block_hash)
+        except Exception as e:
             print(f"[Blockchain] Unexpected error retrieving block {block_hash}: {e}")
             return None
 
+    def get_block_by_number(self, block_number):
+        """Retrieves a block from the database by its block number."""
+        try:
+            return self.engine.get_block_by_number(block_number)
+        except Exception as e:
+            print(f"[Blockchain] Error retrieving block number {block_number}: {e}")
+            return None
+
     def get_last_block(self):
         """Retrieves the last block in the blockchain."""
         try:
-            self.cursor.execute("SELECT * FROM blocks ORDER BY block_number DESC LIMIT 1")
-            block = self.cursor.fetchone()
-            if block:
-                columns = [desc[0] for desc in self.cursor.description]
-                return dict(zip(columns, block))
-            return None
-        except sqlite3.Error as e:
+            return self.engine.get_last_block()
+        except Exception as e:
             print(f"[Blockchain] Error retrieving the last block: {e}")
             return None
-    
+
     def save_transaction(self, transaction):
-        """Saves a transaction to the SQLite database."""
-        try:
-            with self.lock:
-                self.cursor.execute(
-                    """
-                    INSERT OR REPLACE INTO transactions (
-                        tx_hash, block_hash, block_number, sender, recipient, value, size,
-                        fee, nonce, input, transaction_index, timestamp, text, token, nft
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        transaction['tx_hash'],
-                        transaction['block_hash'],
-                        transaction['block_number'],
-                        transaction['sender'],
-                        transaction['recipient'],
-                        transaction['value'],
-                        transaction['size'],
-                        transaction['fee'],
-                        transaction['nonce'],
-                        transaction['input'],
-                        transaction['transaction_index'],
-                        transaction['timestamp'],
-                        transaction['text'],
-                        transaction['token'],
-                        transaction['nft'],
-                    )
-                )
-                self.connection.commit()
+        """Saves a transaction to the database."""
+        try:
+            self.engine.save_transaction(transaction)
 #            print(f"[Blockchain] Added Transaction to DB: {transaction['tx_hash']}")
-        except sqlite3.Error as e:
-            print(f"[Blockchain] Error saving transaction {transaction['tx_hash']}: {e}")
+        except Exception as e:
+            print(f"[Blockchain] Error saving transaction {transaction.get('tx_hash')}: {e}")
+
+    def save_transactions(self, transactions):
+        """Saves a list of transactions in one write."""
+        try:
+            self.engine.save_transactions(transactions)
+        except Exception as e:
+            print(f"[Blockchain] Error saving {len(transactions)} transactions: {e}")
+
+    def get_transaction(self, tx_hash):
+        """Retrieves a transaction by its hash."""
+        try:
+            return self.engine.get_transaction(tx_hash)
+        except Exception as e:
+            print(f"[Blockchain] Error retrieving transaction {tx_hash}: {e}")
+            return None
+
+    def get_block_transactions(self, block_hash):
+        """Retrieves all transactions included in a block."""
+        try:
+            return self.engine.get_block_transactions(block_hash)
+        except Exception as e:
+            print(f"[Blockchain] Error retrieving transactions for block {block_hash}: {e}")
+            return []
+
+    @staticmethod
+    def block_balance_deltas(block):
+        """Net balance change per address caused by a block's transactions."""
+        system_account = parameters['system_account']
+        deltas = {}
+        for transaction in block.get('transactions', []):
+            deltas[transaction['recipient']] = deltas.get(transaction['recipient'], 0) + transaction['value']
+            if transaction['sender'] != system_account:
+                deltas[transaction['sender']] = deltas.get(transaction['sender'], 0) - transaction['value'] - transaction['fee']
+            if transaction['fee']:
+                deltas[block['miner']] = deltas.get(block['miner'], 0) + transaction['fee']
+        return {address: delta for address, delta in deltas.items() if delta}
+
+    def save_balance_deltas(self, block):
+        """Records the balance change of every address touched by a block."""
+        try:
+            self.engine.save_balance_deltas(block['block_number'], self.block_balance_deltas(block))
+        except Exception as e:
+            print(f"[Blockchain] Error saving balance deltas for block {block['block_number']}: {e}")
+
+    def get_balance_at(self, address, block_number):
+        """Returns the balance of an address as of a block."""
+        try:
+            return self.engine.get_balance_at(address, block_number) or 0
+        except Exception as e:
+            print(f"[Blockchain] Error retrieving balance of {address} at block {block_number}: {e}")
+            return None
+
+    def get_balances(self):
+        """Returns the balance of every address as of the last stored block."""
+        try:
+            return self.engine.get_balances()
+        except Exception as e:
+            print(f"[Blockchain] Error retrieving balances: {e}")
+            return {}
+
+    def backfill_balance_deltas(self):
+        """Rebuilds the balance deltas by replaying every stored block. Returns the number of blocks replayed."""
+        written = 0
+        self.engine.begin_batch()
+        try:
+            for block in self.engine.iter_blocks():
+                self.engine.save_balance_deltas(block['block_number'], self.block_balance_deltas(block))
+                written += 1
+        finally:
+            self.engine.end_batch()
+        return written
 
     def save_account(self, address, balance, nonce, code_hash=None, storage_root=None):
         """Saves an account to the database."""
         try:
-            self.cursor.execute(
-                """
-                INSERT OR REPLACE INTO accounts (
-                    address, balance, nonce, code_hash, storage_root
-                ) VALUES (?, ?, ?, ?, ?)
-                """,
-                (address, balance, nonce, code_hash, storage_root)
-            )
-            self.connection.commit()
+            self.engine.save_account(address, balance, nonce, code_hash, storage_root)
             print(f"[Blockchain] Updated account in DB: {address}")
-        except sqlite3.Error as e:
+        except Exception as e:
             print(f"[Blockchain] Error saving account {address}: {e}")
+
+    def get_account(self, address):
+        """Retrieves an account from the database."""
+        try:
+            return self.engine.get_account(address)
+        except Exception as e:
+            print(f"[Blockchain] Error retrieving account {address}: {e}")
+            return None
+
+    def save_state_node(self, state_root, account_address, storage_root=None):
+        """Saves a state node to the database."""
+        try:
+            self.engine.save_state_node(state_root, account_address, storage_root)
+        except Exception as e:
+            print(f"[Blockchain] Error saving state node {state_root}: {e}")
+
+    def get_state_node(self, state_root):
+        """Retrieves a state node from the database."""
+        try:
+            return self.engine.get_state_node(state_root)
+        except Exception as e:
+            print(f"[Blockchain] Error retrieving state node {state_root}: {e}")
+            return None
+
+    def iter_blocks(self, start=1):
+        """Yields stored blocks, with their transactions, in block order."""
+        return self.engine.iter_blocks(start)
+
+    def iter_transactions(self, after=(0, -1)):
+        """Yields stored transactions in chain order, after the (block_number, transaction_index) position `after`."""
+        return self.engine.iter_transactions(after)
+
+    def truncate(self, block_number):
+        """Deletes every block above `block_number`, with its transactions and balance deltas."""
+        try:
+            self.engine.truncate(block_number)
+            print(f"[Blockchain] Rolled back DB to block {block_number}")
+        except Exception as e:
+            print(f"[Blockchain] Error rolling back to block {block_number}: {e}")
+            raise
+
+    def commit(self):
+        """Commits the writes made so far inside bulk_load."""
+        self.engine.commit()
+
+    @contextmanager
+    def bulk_load(self, defer_indexes=False):
+        """
+        Runs the enclosed writes as one large batch. With `defer_indexes`,
+        secondary indexes are dropped first and rebuilt once at the end.
+        """
+        if defer_indexes:
+            self.engine.drop_indexes()
+        self.engine.begin_batch()
+        try:
+            yield self
+        finally:
+            self.engine.end_batch()
+            if defer_indexes:
+                self.engine.create_indexes()
+
+    def close(self):
+        """Closes the underlying storage engine."""
+        self.engine.close()
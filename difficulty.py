@@ -0,0 +1,81 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Tracks the timestamps and difficulties of the blocks in the current
+# difficulty adjustment interval, so the difficulty required for the next
+# block (or any past block) is computed without walking the chain.
+
+import threading
+from collections import deque
+from consensus import Consensus
+from parameters import parameters
+
+class DifficultyTracker:
+    def __init__(self, chain):
+        """Ring buffer over the last `difficulty_adjustment_period + 1` blocks of `chain`."""
+        self.chain = chain
+        self.period = parameters['difficulty_adjustment_period']
+        self.lock = threading.Lock()
+        self.window = deque(maxlen=self.period + 1)  # (block_number, timestamp, difficulty)
+
+    @staticmethod
+    def entry(header):
+        return header['block_number'], header['timestamp'], header['difficulty']
+
+    def load(self):
+        """Refills the buffer from the chain's most recent headers."""
+        with self.lock:
+            self.window.clear()
+            self.window.extend(self.entry(header) for header in self.chain.recent_headers(self.period + 1))
+
+    def append(self, block):
+        """Records a block appended to the chain."""
+        with self.lock:
+            if self.window and block['block_number'] != self.window[-1][0] + 1:
+                raise ValueError(f"Block {block['block_number']} does not follow block {self.window[-1][0]}")
+            self.window.append(self.entry(block))
+
+    def truncate(self, height):
+        """Drops blocks above `height`; call after the chain itself was truncated."""
+        with self.lock:
+            while self.window and self.window[-1][0] > height:
+                self.window.pop()
+        if len(self.window) < min(height, self.period + 1):
+            self.load()
+
+    def next_difficulty(self):
+        """Difficulty required for the block after the chain tip."""
+        with self.lock:
+            if len(self.window) < self.period + 1:
+                return parameters['initial_difficulty']
+            first, last = self.window[0], self.window[-1]
+        return Consensus.calculate_difficulty(first[1], last[1], last[2])
+
+    def required_at(self, block_number, header_at=None):
+        """
+        Difficulty required for block `block_number`. Canonical blocks are
+        read from the buffer or the chain; for a side branch, `header_at`
+        returns the branch's header at a given block number.
+        """
+        last_number = block_number - 1
+        first_number = last_number - self.period
+        if first_number < 1:
+            return parameters['initial_difficulty']
+
+        if header_at is None:
+            with self.lock:
+                if self.window and self.window[0][0] <= first_number and last_number <= self.window[-1][0]:
+                    base = self.window[0][0]
+                    first, last = self.window[first_number - base], self.window[last_number - base]
+                    return Consensus.calculate_difficulty(first[1], last[1], last[2])
+            header_at = lambda number: self.chain.get_header(number - 1)
+
+        first = self.entry(header_at(first_number))
+        last = self.entry(header_at(last_number))
+        return Consensus.calculate_difficulty(first[1], last[1], last[2])
@@ -0,0 +1,184 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Push notifications for clients. The node publishes new chain heads,
+# confirmed transactions and pool additions to an EventHub, and the
+# EventServer streams them as Server-Sent Events to every subscriber of
+# the topic. The server runs on its own asyncio loop, so thousands of
+# open streams cost one thread rather than one API worker each.
+#
+# Topics: 'heads', 'mempool' and 'address:<address>' (transactions
+# confirmed in a block that send to or from the address). Clients
+# subscribe with GET /events?topics=heads,address:<address>.
+
+import asyncio
+import json
+import threading
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+
+KEEPALIVE_INTERVAL = 15  # Seconds between comment lines that keep idle streams open through proxies
+
+def sse_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n".encode('utf-8')
+
+
+class Subscription:
+    def __init__(self, topics, buffer_size):
+        """A client's topics and the events waiting to be written to it."""
+        self.topics = topics
+        self.events = deque(maxlen=buffer_size)  # The oldest events are dropped if the client falls behind
+        self.dropped = 0
+        self.ready = asyncio.Event()
+
+
+class EventHub:
+    def __init__(self, buffer_size, max_subscribers):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.subscribers = {}  # topic -> set of Subscription
+        self.count = 0
+        self.loop = None  # Set by the EventServer that delivers the events
+        self.lock = threading.Lock()
+
+    def subscribe(self, topics):
+        with self.lock:
+            if self.count >= self.max_subscribers:
+                return None
+            subscription = Subscription(topics, self.buffer_size)
+            for topic in topics:
+                self.subscribers.setdefault(topic, set()).add(subscription)
+            self.count += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for topic in subscription.topics:
+                subscribers = self.subscribers.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.subscribers[topic]
+            self.count -= 1
+
+    def publish(self, events):
+        """
+        Queues (topic, name, data) events for their subscribers. Each event is
+        encoded once however many clients receive it. Safe to call from any
+        thread; costs a dict lookup per event when nobody is subscribed.
+        """
+        if not self.subscribers:
+            return
+        woken = set()
+        with self.lock:
+            for topic, name, data in events:
+                subscribers = self.subscribers.get(topic)
+                if not subscribers:
+                    continue
+                encoded = sse_event(name, data)
+                for subscription in subscribers:
+                    if len(subscription.events) == subscription.events.maxlen:
+                        subscription.dropped += 1
+                    subscription.events.append(encoded)
+                    woken.add(subscription)
+        if woken and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wake, woken)
+
+    @staticmethod
+    def wake(subscriptions):
+        for subscription in subscriptions:
+            subscription.ready.set()
+
+    def publish_block(self, block):
+        """Announces a new chain head and the transactions it confirms."""
+        if not self.subscribers:
+            return
+        header = {key: value for key, value in block.items() if key != 'transactions'}
+        events = [('heads', 'head', header)]
+        for transaction in block.get('transactions', []):
+            for address in {transaction['sender'], transaction['recipient']}:
+                events.append((f"address:{address}", 'confirmed', transaction))
+        self.publish(events)
+
+    def publish_transactions(self, transactions):
+        """Announces transactions added to the pool."""
+        if not self.subscribers:
+            return
+        self.publish([('mempool', 'pending', transaction) for transaction in transactions])
+
+
+class EventServer:
+    """Minimal HTTP server answering GET /events with a Server-Sent Events stream."""
+
+    def __init__(self, hub, host, port):
+        self.hub = hub
+        self.host = host
+        self.port = port
+        self.loop = None
+
+    def start(self):
+        """Starts serving on a background thread."""
+        self.loop = asyncio.new_event_loop()
+        self.hub.loop = self.loop
+        threading.Thread(target=self.loop.run_forever, name="events-loop", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(asyncio.start_server(self.handle, self.host, self.port), self.loop).result()
+        print(f"Event stream served on {self.host}:{self.port}/events")
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_INTERVAL)
+            while (await asyncio.wait_for(reader.readline(), KEEPALIVE_INTERVAL)) not in (b'\r\n', b'\n', b''):
+                pass  # Headers are not needed
+            parts = request_line.decode('latin-1').split()
+            url = urlsplit(parts[1]) if len(parts) == 3 else None
+            if url is None or parts[0] != 'GET' or url.path != '/events':
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+            topics = {topic for value in parse_qs(url.query).get('topics', []) for topic in value.split(',') if topic}
+            subscription = self.hub.subscribe(topics) if topics else None
+            if subscription is None:
+                status = b"503 Service Unavailable" if topics else b"400 Bad Request"
+                writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+            try:
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                    b"Access-Control-Allow-Origin: *\r\nConnection: keep-alive\r\n\r\n"
+                )
+                await self.stream(subscription, reader, writer)
+            finally:
+                self.hub.unsubscribe(subscription)
+        except (OSError, asyncio.TimeoutError, UnicodeDecodeError):
+            pass
+        finally:
+            writer.close()
+
+    async def stream(self, subscription, reader, writer):
+        # Clients send nothing after the request, so a completed read means they hung up
+        closed = asyncio.ensure_future(reader.read(1))
+        try:
+            while True:
+                ready = asyncio.ensure_future(subscription.ready.wait())
+                done, _ = await asyncio.wait({ready, closed}, timeout=KEEPALIVE_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+                if closed in done:
+                    ready.cancel()
+                    return
+                if ready not in done:
+                    ready.cancel()
+                    writer.write(b": keepalive\n\n")
+                subscription.ready.clear()
+                if subscription.dropped:
+                    # The client fell behind and should re-read the state it tracks
+                    writer.write(sse_event('dropped', {'count': subscription.dropped}))
+                    subscription.dropped = 0
+                while subscription.events:
+                    writer.write(subscription.events.popleft())
+                await writer.drain()
+        finally:
+            closed.cancel()
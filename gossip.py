@@ -0,0 +1,113 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Bookkeeping for inventory-based gossip: new blocks and transactions
+# are announced by hash ('inv') and only fetched ('getdata') by peers
+# that have not seen them yet.
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from cryptography import Qhash3512
+
+def transaction_id(transaction):
+    """Inventory hash of a relayed transaction: its tx_hash, or a hash of the payload for legacy messages."""
+    return transaction.get('tx_hash') or Qhash3512.generate_hash(json.dumps(transaction, sort_keys=True))
+
+
+class SeenCache:
+    def __init__(self, max_size):
+        """Bounded map keyed by hash; the least recently touched entries are evicted first."""
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key, value=None):
+        """Records `key`; returns False if it was already present."""
+        with self.lock:
+            is_new = key not in self.entries
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            return is_new
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class Inventory:
+    """
+    What the node has seen, what it can serve, what each peer is known to
+    have and which objects are already being fetched.
+    """
+
+    def __init__(self, seen_size, relay_size, peer_known_size, request_timeout):
+        self.seen = SeenCache(seen_size)  # hash -> None
+        self.relay = SeenCache(relay_size)  # hash -> message, served to getdata
+        self.peer_known_size = peer_known_size
+        self.peer_known = {}  # peer_id -> SeenCache of hashes the peer has
+        self.requested = SeenCache(seen_size)  # hash -> time of the getdata
+        self.request_timeout = request_timeout
+
+    def known_by(self, peer_id):
+        known = self.peer_known.get(peer_id)
+        if known is None:
+            known = self.peer_known[peer_id] = SeenCache(self.peer_known_size)
+        return known
+
+    def forget_peer(self, peer_id):
+        self.peer_known.pop(peer_id, None)
+
+    def to_request(self, peer_id, items):
+        """Marks announced items as known by the peer and returns those worth fetching from it."""
+        known = self.known_by(peer_id)
+        wanted = []
+        now = time.time()
+        for item in items:
+            known.add(item['hash'])
+            if item['hash'] in self.seen:
+                continue
+            requested_at = self.requested.get(item['hash'])
+            if requested_at is not None and now - requested_at < self.request_timeout:
+                continue  # Already being fetched from another peer
+            self.requested.add(item['hash'], now)
+            wanted.append(item)
+        return wanted
+
+    def received(self, peer_id, object_hash):
+        """
+        Records an object arriving from a peer; returns False if it was seen
+        before. The object stays in flight until its body is checked against
+        the hash, so a forged copy cannot hide the real one.
+        """
+        self.known_by(peer_id).add(object_hash)
+        return object_hash not in self.seen
+
+    def validated(self, object_hash):
+        """Marks an object whose body matches its hash as seen; returns False if it already was."""
+        self.requested.discard(object_hash)
+        return self.seen.add(object_hash)
+
+    def rejected(self, object_hash):
+        """Ends the fetch of an object whose body failed its checks, so it can be fetched from another peer."""
+        self.requested.discard(object_hash)
@@ -7,31 +7,194 @@
 # from, out of or in connection with the software or the use or
 # other dealings in the software.
 
-# This module collects and logs network metrics.
+# This module collects and logs network metrics. Observed quantities keep
+# streaming aggregates (count, sum, min/max, EWMA, histogram buckets) and
+# a fixed-size ring buffer of recent samples, so memory stays constant
+# however long the node runs. Everything is exported in the Prometheus
+# text format by `exposition`, served at /metrics by the API.
 
+import bisect
+import threading
 import time
+from collections import deque
+from contextlib import contextmanager
+from parameters import parameters
+
+PREFIX = 'hadron_'
+EWMA_ALPHA = 0.1  # Weight of the newest sample in the moving averages
+
+# name -> (help text, histogram buckets). Series without buckets are exported as summaries.
+SERIES = {
+    'block_interval_seconds': ("Seconds between a committed block and its parent", (1, 5, 10, 15, 20, 30, 60, 120, 300)),
+    'block_commit_seconds': ("Seconds spent writing a block to the database", (.001, .005, .01, .025, .05, .1, .25, .5, 1)),
+    'block_propagation_seconds': ("Seconds from a peer block's timestamp until it was connected here", (.1, .25, .5, 1, 2.5, 5, 10, 30)),
+    'hash_rate': ("Miner hashes per second", ()),
+}
+HELP = {
+    'blocks_committed_total': "Blocks appended to the chain",
+    'blocks_mined_total': "Blocks mined by this node",
+    'reorgs_total': "Chain reorganizations",
+    'mempool_added_total': "Transactions added to the pool",
+    'mempool_rejected_total': "Relayed transactions rejected from the pool",
+    'p2p_bytes_sent_total': "Bytes written to peer connections",
+    'p2p_bytes_received_total': "Bytes read from peer connections",
+    'p2p_messages_received_total': "Messages received from peers, by type",
+    'p2p_dropped_frames_total': "Outgoing frames dropped because a peer's send queue was full",
+    'chain_height': "Number of blocks in the chain",
+    'mempool_transactions': "Transactions waiting in the pool",
+    'orphan_blocks': "Blocks held until their parent arrives",
+    'p2p_peers': "Connected peers",
+    'uptime_seconds': "Seconds since the metrics collector started",
+}
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Series:
+    def __init__(self, window, buckets=()):
+        """Streaming aggregates of one observed quantity, over `window` recent samples and all time."""
+        self.recent = deque(maxlen=window)  # Ring buffer of the latest samples
+        self.window_sum = 0.0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.ewma = None
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            if len(self.recent) == self.recent.maxlen:
+                self.window_sum -= self.recent[0]
+            self.recent.append(value)
+            self.window_sum += value
+            self.count += 1
+            self.sum += value
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+            self.ewma = value if self.ewma is None else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * self.ewma
+            position = bisect.bisect_left(self.buckets, value)
+            if position < len(self.buckets):
+                self.bucket_counts[position] += 1
+
+    def window_mean(self):
+        with self.lock:
+            return self.window_sum / len(self.recent) if self.recent else 0
+
 
 class Metrics:
-    def __init__(self):
+    def __init__(self, window=None):
         self.start_time = time.time()
-        self.block_times = []
-        self.hash_rates = []
+        self.window = window or parameters['metrics_window']
+        self.series = {name: Series(self.window, buckets) for name, (_, buckets) in SERIES.items()}
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}  # (name, labels) -> value, or a callable read at export time
+        self.lock = threading.Lock()
+
+    def observe(self, name, value):
+        series = self.series.get(name)
+        if series is None:
+            with self.lock:
+                series = self.series.setdefault(name, Series(self.window))
+        series.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        """Sets a gauge; `value` may be a callable, which is then read on every export."""
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    @contextmanager
+    def timer(self, name):
+        """Observes the seconds spent in the enclosed block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
 
     def add_block_time(self, block_time):
-        self.block_times.append(block_time)
+        self.observe('block_interval_seconds', block_time)
 
     def add_hash_rate(self, hash_rate):
-        self.hash_rates.append(hash_rate)
+        self.observe('hash_rate', hash_rate)
 
     def get_average_block_time(self):
-        return sum(self.block_times) / len(self.block_times) if self.block_times else 0
+        return self.series['block_interval_seconds'].window_mean()
 
     def get_average_hash_rate(self):
-        return sum(self.hash_rates) / len(self.hash_rates) if self.hash_rates else 0
+        return self.series['hash_rate'].window_mean()
+
+    def exposition(self):
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+
+        def header(name, kind):
+            lines.append(f"# HELP {PREFIX}{name} {HELP.get(name) or SERIES.get(name, (name,))[0]}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items(), key=lambda item: item[0])
+            series = sorted(self.series.items())
+        gauges.append((('uptime_seconds', ()), time.time() - self.start_time))
+
+        previous = None
+        for (name, labels), value in counters:
+            if name != previous:
+                header(name, 'counter')
+                previous = name
+            lines.append(f"{PREFIX}{name}{format_labels(labels)} {value}")
+
+        for (name, labels), value in gauges:
+            if name != previous:
+                header(name, 'gauge')
+                previous = name
+            try:
+                value = value() if callable(value) else value
+            except Exception:
+                continue  # A gauge whose source is gone is left out rather than failing the scrape
+            lines.append(f"{PREFIX}{name}{format_labels(labels)} {value}")
+
+        for name, aggregates in series:
+            with aggregates.lock:
+                count, total, buckets = aggregates.count, aggregates.sum, aggregates.bucket_counts[:]
+                extremes = {'min': aggregates.min, 'max': aggregates.max, 'ewma': aggregates.ewma,
+                            'window_mean': aggregates.window_sum / len(aggregates.recent) if aggregates.recent else None}
+            if aggregates.buckets:
+                header(name, 'histogram')
+                cumulative = 0
+                for bound, bucket_count in zip(aggregates.buckets, buckets):
+                    cumulative += bucket_count
+                    lines.append(f'{PREFIX}{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{PREFIX}{name}_bucket{{le="+Inf"}} {count}')
+            else:
+                header(name, 'summary')
+            lines.append(f"{PREFIX}{name}_sum {total}")
+            lines.append(f"{PREFIX}{name}_count {count}")
+            for aggregate, value in extremes.items():
+                if value is not None:
+                    lines.append(f"# TYPE {PREFIX}{name}_{aggregate} gauge")
+                    lines.append(f"{PREFIX}{name}_{aggregate} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+
+# Shared by the miner, the node, the P2P network and the API
+metrics = Metrics()
 
 # Example usage
 if __name__ == "__main__":
-    metrics = Metrics()
     metrics.add_block_time(15.5)
     metrics.add_block_time(14.7)
     print(f"Average Block Time: {metrics.get_average_block_time()} seconds")
+    print(metrics.exposition())
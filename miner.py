@@ -10,15 +10,15 @@
 # This module handles the mining process, including finding valid
 # blocks and earning rewards.
 
-import json
 import logging
 import time
 import threading
 import multiprocessing
 import psutil
-from pow import MineH
+from pow import MineH, header_data
 from parameters import parameters
 from consensus import Consensus
+from metrics import metrics
 
 class Miner:
     def __init__(self, wallet_address, p2p_network, blockchain):
@@ -32,19 +32,19 @@ class Miner:
         self.last_hashrate_calc = time.time()
         logging.basicConfig(filename=parameters['log_file'], level=logging.INFO)
 
-        self.memory_usage = self.validate_memory_usage(parameters['memory_usage'])
         self.cpu_count = self.validate_cpu_count(parameters['cpu_count'])
-        memory_size_bytes = self.memory_usage * (2**20)  # Convert MB to Bytes
-        self.mineh = MineH(memory_size=memory_size_bytes, memory_update_interval=10)
+        self.validate_memory_usage(parameters['memory_usage'])
+        self.mineh = MineH()  # One scratchpad, shared by every mining thread
 
         self.consensus = Consensus(p2p_network, blockchain, self.mineh)
 
     def validate_memory_usage(self, memory_usage_mb):
-        total_memory_mb = psutil.virtual_memory().available // (2**20)
-        if memory_usage_mb <= 0 or memory_usage_mb > total_memory_mb:
-            logging.warning(f"Invalid memory usage specified ({memory_usage_mb}MB). Defaulting to 4MB per thread.")
-            return 4
-        return memory_usage_mb
+        # The scratchpad size is fixed by the network, so it can only be reported
+        if memory_usage_mb < 1:
+            raise ValueError(f"memory_usage must be at least 1MB, not {memory_usage_mb}")
+        available_mb = psutil.virtual_memory().available // (2**20)
+        if memory_usage_mb > available_mb:
+            logging.warning(f"The MineH scratchpad needs {memory_usage_mb}MB but only {available_mb}MB is available.")
 
     def validate_cpu_count(self, cpu_count):
         max_cpus = multiprocessing.cpu_count() - 1
@@ -54,80 +54,37 @@ class Miner:
         return cpu_count
 
     def mine(self):
-        scale_factor = 10**8
         while self.is_mining:
             try:
-                last_block = self.blockchain.chain[-1]
-                previous_hash = last_block.get('block_hash', self.blockchain.hash(last_block))
-#                logging.info(f"Previous block hash: {previous_hash}")
-                new_block_data = {
-                    "block_number": last_block['block_number'] + 1,
-                    "transactions": self.blockchain.current_transactions,
-                    "parent_hash": previous_hash,
-                    "state_root": self.blockchain.state.get_root(),
-                    "tx_root": self.blockchain.calculate_merkle_root(self.blockchain.current_transactions),
-                    "timestamp": time.time(),
-                    "difficulty": self.consensus.adjust_difficulty(self.blockchain.chain),
-                    "miner": self.wallet_address,
-                    "block_size": 0,
-                    "transaction_count": len(self.blockchain.current_transactions)
+                timestamp = time.time()
+                reward_transaction = {
+                    "sender": parameters['system_account'],
+                    "recipient": self.wallet_address,
+                    "value": parameters['block_reward'],
+                    "fee": 0,
+                    "nonce": 0,
+                    "size": 0,
+                    "input": "",
+                    "text": "",
+                    "token": None,
+                    "nft": None,
+                    "timestamp": timestamp
                 }
-#                logging.info(f"New block data with parent_hash: {new_block_data}")
-#                logging.info(f"New block data created: {new_block_data}")
+                reward_transaction["tx_hash"] = self.blockchain.hash_transaction(reward_transaction)
 
-                nonce, valid_hash = self.mineh.mine(json.dumps(new_block_data, sort_keys=True), new_block_data['difficulty'] // scale_factor)
-                self.total_hashes += nonce
+                # The block is assembled from a copy of the pool and only its nonce changes while mining
+                block = self.blockchain.prepare_block([reward_transaction], self.wallet_address)
+                nonce, _ = self.mineh.mine(header_data(block), block['difficulty'])
+                self.total_hashes += nonce + 1
                 self.update_hashrate()
+                block['nonce'] = nonce
 
-                new_block_data['nonce'] = nonce
-                new_block_data['block_hash'] = valid_hash
-                new_block_data['block_size'] = len(json.dumps(new_block_data).encode('utf-8'))
-
-#                logging.info(f"Updated block data with nonce and hash: {new_block_data}")
-
-                if 'block_number' not in new_block_data:
-                    logging.error(f"block_number is missing from new_block_data: {new_block_data}")
-
-                if self.validate_block(new_block_data):
-                    reward_transaction = {
-                        "tx_hash": self.blockchain.hash_transaction({
-                            "sender": parameters['system_account'],
-                            "recipient": self.wallet_address,
-                            "value": parameters['block_reward'],
-                            "fee": 0,
-                            "nonce": 0,  #
-                            "difficulty": new_block_data['difficulty'],
-                            "input": "",
-                            "text": "",
-                            "token": None,
-                            "nft": None,
-                            "timestamp": time.time(),
-                            "block_number": new_block_data['block_number']
-                        }),
-                        "sender": parameters['system_account'],
-                        "recipient": self.wallet_address,
-                        "value": parameters['block_reward'],
-                        "fee": 0,
-                        "nonce": 0,
-                        "difficulty": new_block_data['difficulty'],
-                        "size": 0,
-                        "input": "",
-                        "text": "",
-                        "token": None,
-                        "nft": None, 
-                        "timestamp": time.time(),
-                        "block_number": new_block_data['block_number']
-                    }
-                    
-                    self.blockchain.current_transactions.append(reward_transaction)
-                    block = self.blockchain.new_block(
-                        proof=new_block_data['nonce'],
-                        previous_hash=new_block_data['parent_hash']
-                    )
-                    self.blockchain.state.update_balance(self.wallet_address, parameters['block_reward'])
-                    self.blockchain.state.clear_transactions()
+                if self.validate_block(block) and self.blockchain.commit_block(block):
+                    metrics.increment('blocks_mined_total')
                     self.broadcast_block(block)
-                    logging.info(f"→ PoW Submission for Block {new_block_data['block_number']} (Status: ✓ Accepted)")
+                    logging.info(f"→ PoW Submission for Block {block['block_number']} (Status: ✓ Accepted)")
+                else:
+                    logging.info(f"→ PoW Submission for Block {block['block_number']} (Status: ✗ Stale)")
             except Exception as e:
                 logging.error(f"Error during mining: {e}")
 
@@ -138,6 +95,7 @@ class Miner:
         time_diff = current_time - self.last_hashrate_calc
         if time_diff > 0:
             self.hashrate = self.total_hashes / time_diff
+            metrics.add_hash_rate(self.hashrate)
             self.total_hashes = 0
             self.last_hashrate_calc = current_time
 
@@ -152,7 +110,7 @@ class Miner:
 
     def broadcast_block(self, block_data):
         logging.info(f"→ Broadcasting Block: {block_data['block_number']}")
-        self.p2p_network.broadcast({'type': 'block', 'block': block_data})
+        self.p2p_network.relay({'type': 'block', 'block': block_data})
 
     def start_mining(self):
         threads = []
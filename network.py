@@ -10,61 +10,273 @@
 # This module handles networking, messaging, and the connection
 # between different nodes.
 
-import socket
+import asyncio
 import threading
 import json
 import os
+import time
 import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from parameters import parameters
+from protocol import COMPRESSION, KB, LOW_PRIORITY_TYPES, FrameReader, ProtocolError, encode_message
+from gossip import Inventory, transaction_id
+from compact import PartialBlock, compact_block
+from peerstore import PeerStore
+from metrics import metrics
+
+class RateLimiter:
+    def __init__(self, rate):
+        """Token bucket capping throughput at `rate` bytes per second; 0 means unlimited."""
+        self.rate = rate
+        self.tokens = rate  # Allows a burst of one second's worth
+        self.updated = time.monotonic()
+
+    async def acquire(self, size):
+        """Waits until `size` bytes may be sent. Only used from the event loop."""
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= size
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class PeerConnection(asyncio.BufferedProtocol):
+    """
+    One peer connection, driven by the network's event loop. Frames are
+    received straight into the connection's FrameReader buffer. Outgoing
+    frames wait in a bounded queue that a writer task drains at the pace
+    the socket and the bandwidth caps allow.
+    """
+
+    def __init__(self, network, peer_id=None):
+        self.network = network
+        self.peer_id = peer_id  # Known up front when we dial out, taken from the hello otherwise
+        self.outbound = peer_id is not None
+        self.reader = FrameReader()
+        self.transport = None
+        self.address = None
+        self.queues = (deque(), deque())  # High and low priority frames
+        self.queued_bytes = 0
+        self.dropped_frames = 0
+        self.ready = asyncio.Event()  # Frames are queued
+        self.writable = asyncio.Event()  # The transport is below its high-water mark
+        self.writable.set()
+        self.limiter = RateLimiter(parameters['peer_upload_rate'] * KB)
+        self.writer = None
+        self.compression = False  # Set once both sides announced COMPRESSION in their hello
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.address = transport.get_extra_info('peername')
+        self.writer = self.network.loop.create_task(self.drain())
+
+    def get_buffer(self, sizehint):
+        return self.reader.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self.reader.buffer_updated(nbytes)
+        metrics.increment('p2p_bytes_received_total', nbytes)
+        try:
+            for message in self.reader.messages():
+                metrics.increment('p2p_messages_received_total', type=message.get('type'))
+                if self.peer_id is None:
+                    self.network.on_hello(self, message)
+                else:
+                    self.network.on_message(message, self.peer_id)
+        except ProtocolError as e:
+            print(f"Error handling peer {self.peer_id or self.address}: {e}")
+            self.transport.close()
+
+    def connection_lost(self, exc):
+        if self.writer is not None:
+            self.writer.cancel()
+        self.network.on_disconnect(self)
+
+    def pause_writing(self):
+        self.writable.clear()
+
+    def resume_writing(self):
+        self.writable.set()
+
+    def send_frame(self, frame, low_priority=False):
+        """Queues a frame for sending without ever blocking. Safe to call from any thread."""
+        self.network.loop.call_soon_threadsafe(self.enqueue, frame, low_priority)
+
+    def enqueue(self, frame, low_priority=False):
+        """
+        Adds a frame to the send queue (event loop only). When the queue is
+        over `peer_send_queue_size`, queued low-priority frames are dropped
+        first; if that is not enough, the new frame is dropped.
+        """
+        high, low = self.queues
+        limit = parameters['peer_send_queue_size'] * KB
+        while low and self.queued_bytes + len(frame) > limit:
+            self.queued_bytes -= len(low.popleft())
+            self.dropped_frames += 1
+            metrics.increment('p2p_dropped_frames_total')
+        # A single frame larger than the whole queue is still sent once the queue is empty
+        if self.queued_bytes and self.queued_bytes + len(frame) > limit:
+            self.dropped_frames += 1
+            metrics.increment('p2p_dropped_frames_total')
+            return
+        (low if low_priority else high).append(frame)
+        self.queued_bytes += len(frame)
+        self.ready.set()
+
+    async def drain(self):
+        """Writer task: sends queued frames, high priority first, within the bandwidth caps."""
+        high, low = self.queues
+        while True:
+            if not high and not low:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+            frame = (high or low).popleft()
+            self.queued_bytes -= len(frame)
+            await self.writable.wait()
+            await self.limiter.acquire(len(frame))
+            await self.network.upload_limiter.acquire(len(frame))
+            if self.transport.is_closing():
+                return
+            self.transport.write(frame)
+            metrics.increment('p2p_bytes_sent_total', len(frame))
+
+    def close(self):
+        self.network.loop.call_soon_threadsafe(self.transport.close)
+
 
 class P2PNetwork:
     def __init__(self, host='0.0.0.0', port=5000):
-        self.peers = {}
+        self.peers = {}  # peer_id -> PeerConnection
         self.host = host
         self.port = port
         self.server = None
         self.node_id = f"node://{uuid.uuid4()}@{self.host}:{self.port}"  # Concatenated Node Identifier
         self.max_peers = parameters.get("max_node_peers", 128)
+        metrics.set_gauge('p2p_peers', lambda: len(self.peers))
         self.prime_bootnodes = []  # List of Prime Bootnodes
         self.is_prime_node = False  # Flag to check if this node is the prime node
+        self.blockchain = None  # Set by Blockchain.attach_network
+        self.pending_requests = {}  # request_id -> {'event', 'response'}
+        self.inventory = Inventory(
+            parameters['seen_cache_size'], parameters['relay_cache_size'],
+            parameters['peer_inventory_size'], parameters['request_timeout']
+        )
+        self.partial_blocks = OrderedDict()  # block_hash -> (PartialBlock, peer_id) awaiting blocktxn
+        self.announcements = {}  # peer_id -> transaction inv items waiting to be sent (event loop only)
+        self.announce_timer = None
+        # All sockets are served by one event loop thread. Messages that need
+        # the blockchain are handed to a single bridge thread, so Blockchain
+        # sees them one at a time and in arrival order.
+        self.loop = None
+        self.loop_thread = None
+        self.bridge = ThreadPoolExecutor(max_workers=1, thread_name_prefix="p2p-bridge")
+        self.upload_limiter = RateLimiter(parameters['max_upload_rate'] * KB)
+        self.dialing = set()  # Connection attempts still running after connect_any returned
+        self.peer_store = PeerStore(os.path.join(parameters['data_directory'], 'peers.json'), parameters['peer_store_size'])
+
+    def start_loop(self):
+        """Starts the event loop thread if it is not running yet."""
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            self.loop_thread = threading.Thread(target=self.loop.run_forever, name="p2p-loop", daemon=True)
+            self.loop_thread.start()
+            self.loop.call_soon_threadsafe(self.save_peer_store)
+
+    def save_peer_store(self):
+        """Writes the peer address book every `peer_store_interval` seconds (event loop only)."""
+        try:
+            self.bridge.submit(self.peer_store.save)
+        except RuntimeError:
+            return  # The interpreter is shutting down
+        self.loop.call_later(parameters['peer_store_interval'], self.save_peer_store)
+
+    def run_in_loop(self, coroutine, timeout=None):
+        """Runs a coroutine on the event loop from another thread and waits for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
 
     def start_server(self):
         """Start the server to listen for incoming peer connections."""
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Allow port reuse
-        self.server.bind((self.host, self.port))
-        self.server.listen(self.max_peers)
+        self.start_loop()
+        self.server = self.run_in_loop(self.loop.create_server(
+            lambda: PeerConnection(self), self.host, self.port, reuse_address=True, backlog=self.max_peers
+        ))
         print(f"Server started on {self.host}:{self.port}, Node ID: {self.node_id}")
 
-        threading.Thread(target=self.accept_peers).start()
+    def on_hello(self, connection, message):
+        """Registers an incoming connection once its hello frame arrives."""
+        if message['type'] != 'hello':
+            raise ProtocolError(f"Expected hello, got {message['type']}")
+        node_id = message.get('node_id')
+        if not self.is_node_string(node_id):
+            raise ProtocolError(f"Invalid node_id in hello: {node_id!r}")
+        if node_id in self.peers or node_id == self.node_id:
+            raise ProtocolError(f"Peer {node_id} is already connected")
+        if len(self.peers) >= self.max_peers:
+            connection.transport.close()
+            return
+        connection.peer_id = node_id
+        self.peers[connection.peer_id] = connection
+        self.peer_store.add(connection.peer_id)
+        print(f"New connection from {connection.address}, Peer ID: {connection.peer_id}")
+        if self.negotiate(connection, message):
+            # Peers without compression never get a hello back, as they would not expect one
+            connection.enqueue(encode_message(self.hello_message()))
+        self.exchange_peers(connection)
+
+    def hello_message(self):
+        hello = {'type': 'hello', 'node_id': self.node_id}
+        if parameters['p2p_compression']:
+            hello['compression'] = [COMPRESSION]
+        return hello
 
-    def accept_peers(self):
-        """Accept incoming peer connections."""
-        while True:
-            client, address = self.server.accept()
-            if len(self.peers) < self.max_peers:
-                peer_id = client.recv(1024).decode('utf-8')
-                self.peers[peer_id] = client
-                print(f"New connection from {address}, Peer ID: {peer_id}")
-                threading.Thread(target=self.handle_peer, args=(client, peer_id)).start()
-                self.exchange_peers(client)
-            else:
-                client.close()
+    def negotiate(self, connection, hello):
+        """Enables compressed frames to a peer whose hello offers our COMPRESSION."""
+        connection.compression = parameters['p2p_compression'] and COMPRESSION in (hello.get('compression') or [])
+        return connection.compression
 
-    def handle_peer(self, client, peer_id):
-        """Handle incoming messages from a peer."""
-        while True:
-            try:
-                data = client.recv(1024).decode('utf-8')
-                if not data:
-                    break
-                message = json.loads(data)
-                self.process_message(message, peer_id)
-            except (socket.error, json.JSONDecodeError) as e:
-                print(f"Error handling peer {peer_id}: {e}")
-                self.peers.pop(peer_id, None)
-                client.close()
-                break
+    def on_message(self, message, peer_id):
+        """Called on the event loop for every message from a registered peer."""
+        if message['type'] == 'hello':
+            # The answer to our own hello, from a peer we dialled
+            connection = self.peers.get(peer_id)
+            if connection is not None:
+                self.negotiate(connection, message)
+            return
+        # Answers to our own requests only wake the waiting caller
+        if message.get('response_to') in self.pending_requests:
+            self.process_message(message, peer_id)
+        else:
+            self.bridge.submit(self.process_message_safely, message, peer_id)
+
+    def process_message_safely(self, message, peer_id):
+        try:
+            self.process_message(message, peer_id)
+        except Exception as e:
+            print(f"Error processing {message.get('type')} from peer {peer_id}: {e}")
+
+    def on_disconnect(self, connection):
+        if connection.peer_id is not None and self.peers.get(connection.peer_id) is connection:
+            del self.peers[connection.peer_id]
+            self.inventory.forget_peer(connection.peer_id)
+            if connection.outbound:
+                self.peer_store.seen(connection.peer_id)
+
+    def process_rebuilt_block(self, partial, peer_id):
+        """
+        Processes a block rebuilt from a compact block. If the rebuilt
+        transactions do not match the header's tx_root, the full block is
+        fetched instead of rejecting a block that may be valid.
+        """
+        block = partial.block()
+        if self.blockchain.calculate_merkle_root(block['transactions']) != block['tx_root']:
+            self.send(peer_id, {'type': 'getdata', 'items': [{'kind': 'block', 'hash': block['block_hash']}]})
+            return
+        self.process_message({'type': 'block', 'block': block}, peer_id)
 
     def process_message(self, message, peer_id):
         """Process and respond to incoming messages from peers."""
@@ -74,51 +286,392 @@ class P2PNetwork:
         
         message_type = message.get('type')
 
-        if message_type == 'transaction':
+        # Responses to our own requests are handed back to the waiting caller
+        if message.get('response_to') in self.pending_requests:
+            pending = self.pending_requests[message['response_to']]
+            pending['response'] = message
+            connection = self.peers.get(peer_id)
+            if 'height' in message and connection is not None and connection.outbound:
+                self.peer_store.served(peer_id, message['height'])
+            pending['event'].set()
+            if pending['notify'] is not None:
+                pending['notify'].put(pending)
+            return
+
+        if message_type == 'get_headers':
+            count = min(int(message.get('count', 0)), parameters['max_headers_per_request'])
+            self.send(peer_id, {
+                'type': 'headers',
+                'response_to': message.get('request_id'),
+                'headers': self.get_local_range(message.get('from_height', 1), count, headers_only=True),
+                'height': len(self.blockchain.chain)
+            })
+
+        elif message_type == 'get_blocks':
+            count = min(int(message.get('count', 0)), parameters['max_blocks_per_request'])
+            self.send(peer_id, {
+                'type': 'blocks',
+                'response_to': message.get('request_id'),
+                'blocks': self.get_local_range(message.get('from_height', 1), count, headers_only=False),
+                'height': len(self.blockchain.chain)
+            })
+
+        elif message_type == 'inv':
+            items = message.get('items', [])[:parameters['max_inventory_items']]
+            wanted = self.inventory.to_request(peer_id, items)
+            if wanted:
+                self.send(peer_id, {'type': 'getdata', 'items': wanted})
+
+        elif message_type == 'getdata':
+            # Transactions are answered in batches of up to a block's worth
+            transactions, batch_size = [], 0
+            for item in message.get('items', [])[:parameters['max_inventory_items']]:
+                found = self.get_inventory_object(item)
+                if found is None:
+                    continue
+                if found['type'] != 'transaction':
+                    self.send(peer_id, found)
+                    continue
+                size = 2 * found['transaction'].get('size', 0) + KB
+                if transactions and batch_size + size > parameters['block_size'] * KB:
+                    self.send(peer_id, {'type': 'transactions', 'transactions': transactions})
+                    transactions, batch_size = [], 0
+                transactions.append(found['transaction'])
+                batch_size += size
+            if transactions:
+                self.send(peer_id, {'type': 'transactions', 'transactions': transactions})
+
+        elif message_type == 'transaction':
             transaction = message['transaction']
-            response = self.blockchain.new_transaction(**transaction)
-            self.broadcast(response, exclude_peer=peer_id)
+            object_hash = transaction_id(transaction)
+            if not self.inventory.received(peer_id, object_hash):
+                return
+            if 'tx_hash' in transaction and not self.is_genuine(transaction):
+                self.inventory.rejected(object_hash)
+                return
+            if not self.inventory.validated(object_hash):
+                return
+            if 'tx_hash' in transaction:
+                if self.blockchain.add_transaction(transaction).startswith("Transaction will be added"):
+                    self.relay_transactions([transaction], exclude_peer=peer_id)
+            else:
+                # Legacy payload of new_transaction arguments; the node relays the record it creates
+                self.blockchain.new_transaction(**transaction)
+
+        elif message_type == 'transactions':
+            transactions = []
+            for transaction in message['transactions'][:parameters['max_inventory_items']]:
+                if 'tx_hash' not in transaction or not self.inventory.received(peer_id, transaction['tx_hash']):
+                    continue
+                if not self.is_genuine(transaction):
+                    self.inventory.rejected(transaction['tx_hash'])
+                elif self.inventory.validated(transaction['tx_hash']):
+                    transactions.append(transaction)
+            statuses = self.blockchain.add_transactions(transactions)
+            accepted = [transaction for transaction, status in zip(transactions, statuses) if status.startswith("Transaction will be added")]
+            self.relay_transactions(accepted, exclude_peer=peer_id)
+
+        elif message_type == 'cmpctblock':
+            block_hash = message['header']['block_hash']
+            if block_hash in self.inventory.seen or block_hash in self.partial_blocks:
+                self.inventory.known_by(peer_id).add(block_hash)
+                return
+            if self.blockchain.hash(message['header']) != block_hash:
+                return  # A forged header must not hold the slot of the real block
+            # The pool changes in place on other threads, so the block is rebuilt from a copy
+            with self.blockchain.lock:
+                pool = list(self.blockchain.current_transactions)
+            partial = PartialBlock(message, pool)
+            missing = partial.missing()
+            if not missing:
+                self.process_rebuilt_block(partial, peer_id)
+                return
+            self.partial_blocks[block_hash] = (partial, peer_id)
+            while len(self.partial_blocks) > parameters['max_partial_blocks']:
+                self.partial_blocks.popitem(last=False)
+            self.send(peer_id, {'type': 'getblocktxn', 'block_hash': block_hash, 'indexes': missing})
+
+        elif message_type == 'getblocktxn':
+            found = self.get_inventory_object({'kind': 'block', 'hash': message['block_hash']})
+            if found is not None:
+                transactions = found['block']['transactions']
+                self.send(peer_id, {
+                    'type': 'blocktxn',
+                    'block_hash': message['block_hash'],
+                    'indexes': message['indexes'],
+                    'transactions': [transactions[index] for index in message['indexes'] if 0 <= index < len(transactions)]
+                })
+
+        elif message_type == 'blocktxn':
+            partial, _ = self.partial_blocks.pop(message['block_hash'], (None, None))
+            if partial is None:
+                return
+            partial.fill(message['indexes'], message['transactions'])
+            if partial.missing():
+                # Fall back to fetching the full block
+                self.send(peer_id, {'type': 'getdata', 'items': [{'kind': 'block', 'hash': message['block_hash']}]})
+                return
+            self.process_rebuilt_block(partial, peer_id)
 
         elif message_type == 'block':
             block = message['block']
-            if self.blockchain.validate_block(block):
-                self.blockchain.chain.append(block)
-                self.broadcast(block, exclude_peer=peer_id)
+            if not self.inventory.received(peer_id, block['block_hash']):
+                return
+            status = self.blockchain.receive_block(block)
+            if status == 'invalid':
+                self.inventory.rejected(block['block_hash'])
+                return
+            self.inventory.validated(block['block_hash'])
+            if status == 'orphan':
+                # Ask the peer that sent it for the missing parent, unless it is already on its way
+                wanted = self.inventory.to_request(peer_id, [{'kind': 'block', 'hash': block['parent_hash']}])
+                if wanted:
+                    self.send(peer_id, {'type': 'getdata', 'items': wanted})
+            if status in ('extended', 'reorganized'):
+                metrics.observe('block_propagation_seconds', max(time.time() - block['timestamp'], 0))
+            if status in ('side', 'extended', 'reorganized'):
+                self.relay({'type': 'block', 'block': block}, exclude_peer=peer_id)
 
         elif message_type == 'peer_list':
             peers = message['peers']
             for peer in peers:
-                if peer['node'] not in self.peers and len(self.peers) < self.max_peers:
-                    self.connect_to_peer(peer['node'])
+                if peer['node'] != self.node_id:
+                    self.peer_store.add(peer['node'])
+                if peer['node'] not in self.peers and peer['node'] != self.node_id and len(self.peers) < self.max_peers:
+                    self.connect_to_peer(peer['node'], wait=False)
+
+    def is_genuine(self, transaction):
+        """True if a relayed transaction's tx_hash matches its contents."""
+        try:
+            return self.blockchain.hash_transaction(transaction) == transaction['tx_hash']
+        except KeyError:
+            return False
+
+    def get_inventory_object(self, item):
+        """Returns the message carrying an announced object, or None if we no longer have it."""
+        message = self.inventory.relay.get(item['hash'])
+        if message is None and item.get('kind') == 'block':
+            block = self.blockchain.get_block_by_hash(item['hash'])
+            message = {'type': 'block', 'block': block} if block else None
+        return message
+
+    def get_local_range(self, from_height, count, headers_only):
+        """Returns up to `count` of our blocks (or headers) starting at `from_height`."""
+        chain = self.blockchain.chain
+        first = max(int(from_height), 1)
+        last = min(first + count, len(chain) + 1)
+        if headers_only:
+            return [chain.get_header(height - 1) for height in range(first, last)]
+        return [chain[height - 1] for height in range(first, last)]
+
+    def send(self, peer_id, message):
+        """Send a message to a single peer."""
+        peer = self.peers.get(peer_id)
+        if peer is None:
+            raise ConnectionError(f"Peer {peer_id} is not connected")
+        self.send_frame(peer_id, peer, self.encode_for(peer, message), message['type'] in LOW_PRIORITY_TYPES)
+
+    def encode_for(self, peer, message, frames=None):
+        """
+        Returns the frame of `message` for `peer`, compressed if the peer
+        accepts it. Pass the same `frames` dict when sending one message to
+        many peers so each variant is encoded once.
+        """
+        frames = {} if frames is None else frames
+        if peer.compression not in frames:
+            frames[peer.compression] = encode_message(message, compress=peer.compression)
+        return frames[peer.compression]
+
+    def send_frame(self, peer_id, peer, frame, low_priority=False):
+        peer.send_frame(frame, low_priority)
+
+    def start_request(self, peer_id, message, notify=None):
+        """
+        Send a request to a peer without waiting; returns the pending request.
+        If `notify` is a queue, the pending request is put on it when answered.
+        """
+        request_id = uuid.uuid4().hex
+        pending = {'id': request_id, 'message': message, 'event': threading.Event(), 'response': None, 'notify': notify}
+        self.pending_requests[request_id] = pending
+        try:
+            self.send(peer_id, dict(message, request_id=request_id))
+        except Exception:
+            self.pending_requests.pop(request_id, None)
+            raise
+        return pending
+
+    def wait_response(self, peer_id, pending, timeout=None):
+        """Wait for the message answering a request made with start_request."""
+        try:
+            if not pending['event'].wait(timeout or parameters['request_timeout']):
+                raise TimeoutError(f"Peer {peer_id} did not answer {pending['message']['type']}")
+            return pending['response']
+        finally:
+            self.pending_requests.pop(pending['id'], None)
+
+    def request(self, peer_id, message, timeout=None):
+        """Send a request to a peer and wait for the message answering it."""
+        return self.wait_response(peer_id, self.start_request(peer_id, message), timeout)
+
+    def stream_range(self, peer_id, message_type, from_height, count=None):
+        """
+        Yields a peer's blocks ('get_blocks') or headers ('get_headers') from
+        `from_height` onwards in bounded batches, in order. Up to `stream_window`
+        requests are kept in flight, so the next batch is on its way while the
+        caller processes the current one. Stops at the peer's tip or after
+        `count` items.
+        """
+        key = 'headers' if message_type == 'get_headers' else 'blocks'
+        batch_size = parameters['max_headers_per_request' if key == 'headers' else 'max_blocks_per_request']
+        end = from_height + count if count is not None else None
+        next_height = from_height
+        in_flight = deque()
+        try:
+            while True:
+                while len(in_flight) < parameters['stream_window'] and (end is None or next_height < end):
+                    size = batch_size if end is None else min(batch_size, end - next_height)
+                    in_flight.append(self.start_request(peer_id, {'type': message_type, 'from_height': next_height, 'count': size}))
+                    next_height += size
+                if not in_flight:
+                    return
+
+                pending = in_flight.popleft()
+                response = self.wait_response(peer_id, pending)
+                batch = response.get(key, [])
+                if batch:
+                    yield batch
+
+                requested = pending['message']
+                batch_end = requested['from_height'] + len(batch)
+                if len(batch) < requested['count']:
+                    if not batch or response.get('height', 0) < batch_end:
+                        return  # Reached the peer's tip
+                    # The peer serves smaller batches than we ask for; re-plan from here
+                    for skipped in in_flight:
+                        self.pending_requests.pop(skipped['id'], None)
+                    in_flight.clear()
+                    batch_size = len(batch)
+                    next_height = batch_end
+        finally:
+            for pending in in_flight:
+                self.pending_requests.pop(pending['id'], None)
+
+    def relay(self, message, exclude_peer=None):
+        """
+        Announces a transaction by hash, or pushes a block as a compact
+        block, to every peer not known to have it. Peers fetch what they
+        still lack with getdata or getblocktxn.
+        """
+        if message['type'] == 'transaction':
+            self.relay_transactions([message['transaction']], exclude_peer)
+            return
+        block_hash = message['block']['block_hash']
+        self.inventory.seen.add(block_hash)
+        self.inventory.relay.add(block_hash, message)
+        # Blocks are pushed as compact blocks, rebuilt from the peers' own pools
+        compact, frames = compact_block(message['block']), {}
+        for peer_id, peer in list(self.peers.items()):
+            if peer_id != exclude_peer and self.inventory.known_by(peer_id).add(block_hash):
+                self.send_frame(peer_id, peer, self.encode_for(peer, compact, frames))
+
+    def relay_transactions(self, transactions, exclude_peer=None):
+        """Announces transactions to every peer not known to have them, in batched inv messages."""
+        announcements = {}
+        for transaction in transactions:
+            tx_hash = transaction_id(transaction)
+            self.inventory.seen.add(tx_hash)
+            self.inventory.relay.add(tx_hash, {'type': 'transaction', 'transaction': transaction})
+            for peer_id in list(self.peers):
+                if peer_id != exclude_peer and self.inventory.known_by(peer_id).add(tx_hash):
+                    announcements.setdefault(peer_id, []).append({'kind': 'transaction', 'hash': tx_hash})
+        if announcements:
+            self.loop.call_soon_threadsafe(self.announce, announcements)
+
+    def announce(self, announcements):
+        """
+        Queues inv items per peer (event loop only). A peer's items are sent
+        as one inv once `tx_batch_size` of them are waiting, or at the latest
+        `tx_batch_interval` ms after the first one was queued.
+        """
+        batch_size = min(parameters['tx_batch_size'], parameters['max_inventory_items'])
+        for peer_id, items in announcements.items():
+            waiting = self.announcements.setdefault(peer_id, [])
+            waiting.extend(items)
+            while len(waiting) >= batch_size:
+                self.send_announcements(peer_id, waiting[:batch_size])
+                del waiting[:batch_size]
+        if self.announce_timer is None and any(self.announcements.values()):
+            self.announce_timer = self.loop.call_later(parameters['tx_batch_interval'] / 1000, self.flush_announcements)
+
+    def flush_announcements(self):
+        """Sends every queued inv item (event loop only)."""
+        self.announce_timer = None
+        announcements, self.announcements = self.announcements, {}
+        for peer_id, items in announcements.items():
+            if items:
+                self.send_announcements(peer_id, items)
+
+    def send_announcements(self, peer_id, items):
+        peer = self.peers.get(peer_id)
+        if peer is not None:
+            self.send_frame(peer_id, peer, self.encode_for(peer, {'type': 'inv', 'items': items}), low_priority=True)
 
     def broadcast(self, data, exclude_peer=None):
         """Broadcast data to all connected peers except the sender."""
-        for peer_id, peer in self.peers.items():
+        frames = {}
+        low_priority = data['type'] in LOW_PRIORITY_TYPES
+        # Frames are only queued here; slow peers never hold up the caller
+        for peer_id, peer in list(self.peers.items()):
             if peer_id != exclude_peer:
-                try:
-                    peer.send(json.dumps(data).encode('utf-8'))
-                except socket.error as e:
-                    print(f"Error broadcasting to peer {peer_id}: {e}")
-                    self.peers.pop(peer_id, None)
-                    peer.close()
-
-    def connect_to_peer(self, node):
+                self.send_frame(peer_id, peer, self.encode_for(peer, data, frames), low_priority)
+
+    def connect_to_peer(self, node, wait=True):
         """Connect to a new peer using the full node string."""
         if node in self.peers:
             print(f"Already connected to {node}")
             return
-        
+
+        self.start_loop()
+        future = asyncio.run_coroutine_threadsafe(self.open_connection(node), self.loop)
+        if wait and threading.current_thread() is not self.loop_thread:
+            future.result()
+
+    async def open_connection(self, node, timeout=None):
+        """Dials a peer and sends our hello. Returns whether the connection was made."""
         parsed_node = self.parse_node_string(node)
-        peer = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        started = time.monotonic()
         try:
-            peer.connect((parsed_node['host'], parsed_node['port']))
-            peer_id = node
-            self.peers[peer_id] = peer
-            peer.send(self.node_id.encode('utf-8'))
-            print(f"Connected to {parsed_node['host']}:{parsed_node['port']}, Peer ID: {peer_id}")
-            threading.Thread(target=self.handle_peer, args=(peer, peer_id)).start()
-        except socket.error as e:
-            print(f"Failed to connect to {node}: {e}")
+            _, connection = await asyncio.wait_for(
+                self.loop.create_connection(lambda: PeerConnection(self, node), parsed_node['host'], parsed_node['port']),
+                timeout or parameters['request_timeout']
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            print(f"Failed to connect to {node}: {e!r}")
+            self.peer_store.failed(node)
+            return False
+        self.peer_store.connected(node, time.monotonic() - started)
+        self.peers[node] = connection
+        connection.enqueue(encode_message(self.hello_message()))
+        print(f"Connected to {parsed_node['host']}:{parsed_node['port']}, Peer ID: {node}")
+        return True
+
+    async def connect_any(self, nodes, timeout):
+        """
+        Dials all `nodes` at once. Returns True as soon as one connection is
+        up, leaving the other attempts running, or False if every one failed.
+        """
+        pending = {self.loop.create_task(self.open_connection(node, timeout)) for node in nodes}
+        self.dialing.update(pending)  # Keeps the remaining attempts referenced until they finish
+        for task in pending:
+            task.add_done_callback(self.dialing.discard)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    print(f"Failed to connect: {task.exception()}")
+                elif task.result():
+                    return True
+        return False
 
     def parse_node_string(self, node_string):
         """Parse a node string in the format 'node://<node_id>@<ip>:<port>'."""
@@ -126,28 +679,35 @@ class P2PNetwork:
         host, port = address_part.split(':')
         return {'node_id': node_id_part, 'host': host, 'port': int(port)}
 
-    def exchange_peers(self, client):
+    def is_node_string(self, node_string):
+        """True if `node_string` is a 'node://<node_id>@<ip>:<port>' string."""
+        try:
+            node = self.parse_node_string(node_string)
+        except (AttributeError, ValueError):
+            return False
+        return node['node_id'].startswith('node://') and 0 <= node['port'] < 65536
+
+    def exchange_peers(self, connection):
         """Exchange peer information with a new peer."""
         peer_list = [{'node': pid} for pid in self.peers.keys()]
-        client.send(json.dumps({'type': 'peer_list', 'peers': peer_list}).encode('utf-8'))
+        connection.enqueue(self.encode_for(connection, {'type': 'peer_list', 'peers': peer_list}), low_priority=True)
 
     def load_bootnodes(self, bootnodes_file='bootnodes.json'):
-        """Load and connect to bootnodes from a file."""
-        bootnodes = []
-
-        # Try connecting to prime bootnodes first
-        for node in self.prime_bootnodes:
-            try:
-                self.connect_to_peer(node)
-            except Exception as e:
-                print(f"Failed to connect to prime bootnode {node}: {e}")
-        
-        # Load bootnodes from the file if the prime bootnodes fail
+        """
+        Connects to the network. The best-ranked peers from the address
+        book are dialled in parallel together with the prime bootnodes and
+        those in `bootnodes_file`; this returns once any of them answers.
+        """
+        nodes = list(self.prime_bootnodes)
+        nodes += self.peer_store.best(parameters['startup_peers'])
         if os.path.exists(bootnodes_file):
             with open(bootnodes_file, 'r') as file:
-                bootnodes = json.load(file)
-                for node in bootnodes:
-                    self.connect_to_peer(node['node'])
+                nodes += [node['node'] for node in json.load(file)]
+        nodes = [node for node in dict.fromkeys(nodes) if node != self.node_id and node not in self.peers]
+
+        self.start_loop()
+        if nodes and self.run_in_loop(self.connect_any(nodes, parameters['connect_timeout'])):
+            return
 
         # If no connections established, consider self as prime node
         if not self.peers:
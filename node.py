@@ -20,19 +20,44 @@ from state import BlockchainState
 from miner import Miner
 from network import P2PNetwork
 from consensus import Consensus
+from chain import ChainView
+from sync import SyncManager
+from blocktree import BlockTree, OrphanPool
+from difficulty import DifficultyTracker
+from compact import BLOCK_ANNOTATIONS
+from pow import block_hash, tx_root
+from events import EventHub
+from metrics import metrics
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s')
 
 class Blockchain:
-    def __init__(self):
-        """Initialize the blockchain node with state, database, miner, and network."""
+    def __init__(self, p2p_network=None):
+        """
+        Initialize the blockchain node with state, database, miner, and network.
+        `p2p_network` is the node's only P2PNetwork; one listening on
+        p2p_host:p2p_port is created if none is given.
+        """
         self.db = BlockchainDatabase()  # Initialize the database connection first
         self.state = BlockchainState(self.db)  # Pass the db instance to BlockchainState
         
-        self.chain = []
+        # Only the last `chain_window` headers stay in memory; older blocks
+        # are read back through an LRU cache bounded by `block_cache_size` MB.
+        window = max(parameters['chain_window'], parameters['difficulty_adjustment_period'] + 1)
+        self.chain = ChainView(self.db, window, parameters['block_cache_size'] * (2**20))
+        self.difficulty = DifficultyTracker(self.chain)
+        # Recent blocks of every known branch, for fork choice by cumulative
+        # work, and blocks received before their parent.
+        self.block_tree = BlockTree(parameters['max_reorg_depth'])
+        self.orphans = OrphanPool(parameters['max_orphan_blocks'])
+        self.lock = threading.RLock()
         self.current_transactions = []
+        self.events = EventHub(parameters['event_buffer_size'], parameters['max_event_subscribers'])  # Served by events.EventServer
         self.miner_wallet_address = parameters.get("miner_wallet_address", "system_account")
-        self.p2p_network = P2PNetwork()
+        self.p2p_network = p2p_network or P2PNetwork(host=parameters['p2p_host'], port=parameters['p2p_port'])
+        metrics.set_gauge('chain_height', lambda: len(self.chain))
+        metrics.set_gauge('mempool_transactions', lambda: len(self.current_transactions))
+        metrics.set_gauge('orphan_blocks', lambda: len(self.orphans))
 
         # Initialize Consensus with the current blockchain and network
         self.consensus = Consensus(self.p2p_network, self, None)  # Passing `None` for `mineh` for now
@@ -43,6 +68,9 @@ class Blockchain:
         # After Miner is initialized, update the consensus object with the miner's `mineh`
         self.consensus.mineh = self.miner.mineh
 
+        self.sync_manager = SyncManager(self, self.p2p_network)
+        self.p2p_network.blockchain = self
+
         logging.info("Blockchain node initializing...")
         self.load_chain()
 
@@ -54,62 +82,329 @@ class Blockchain:
         logging.info("Blockchain loaded.")
 
     def load_chain(self):
-        block = self.db.get_last_block()
-        chain = []
-
-        while block:
-            chain.append(block)
-            block = self.db.get_block(block['parent_hash'])
-
-        chain.reverse()
-        self.chain = chain
+        self.chain.load()
+        tip = self.chain.get_header(-1) if len(self.chain) else None
+        if tip is not None and self.hash(tip) != tip['block_hash']:
+            raise ValueError(f"Block {tip['block_number']} in {parameters['data_directory']} does not match its hash. "
+                             "It was stored by an earlier block format or with another memory_usage; see Upgrading in readme.md")
+        self.state.load(self.db.get_balances())
+        self.difficulty.load()
+        self.block_tree.reset(self.chain.recent_headers(parameters['max_reorg_depth'] + 1))
         logging.info(f"{len(self.chain)} blocks loaded from the database.")
 
-    def new_block(self, proof, previous_hash=None):
-        block_number = len(self.chain) + 1
-        block = {
-            'block_number': block_number,
-            'parent_hash': previous_hash or self.hash(self.chain[-1]) if self.chain else '1',
-            'state_root': self.state.get_root(),
-            'tx_root': self.calculate_merkle_root(self.current_transactions),
-            'difficulty': self.consensus.adjust_difficulty(self.chain),
-            'nonce': proof,
-            'timestamp': time.time(),
-            'miner': self.miner_wallet_address,
-            'block_size': 0,
-            'transaction_count': len(self.current_transactions),
-            'transactions': self.current_transactions
-        }
+    @staticmethod
+    def annotate_transactions(block):
+        """Sets each transaction's block hash, number and index from the block, replacing whatever a peer sent."""
+        for index, transaction in enumerate(block.get('transactions', [])):
+            transaction["block_hash"] = block['block_hash']
+            transaction["block_number"] = block['block_number']
+            transaction["transaction_index"] = index
 
-        block['block_size'] = len(json.dumps(block).encode('utf-8'))
-        block_hash = self.hash(block)
-        block['block_hash'] = block_hash
+    def add_block(self, block):
+        """Stores a validated block received from a peer and appends it to the chain."""
+        with self.lock:
+            self.annotate_transactions(block)
+            with metrics.timer('block_commit_seconds'):
+                self.db.save_block(block['block_hash'], block)
+                for transaction in block.get('transactions', []):
+                    self.db.save_transaction(transaction)
+                self.db.save_balance_deltas(block)
+            self.append_block(block)
+            self.prune_transactions([block])
+
+    def append_block(self, block):
+        """Appends a stored block to the chain view, difficulty tracker and block tree."""
+        if len(self.chain):
+            metrics.add_block_time(block['timestamp'] - self.chain.get_header(-1)['timestamp'])
+        metrics.increment('blocks_committed_total')
         self.chain.append(block)
-        self.db.save_block(block_hash, block)
+        self.difficulty.append(block)
+        self.state.apply_deltas(self.db.block_balance_deltas(block))
+        self.track_block(block)
+        self.events.publish_block(block)
+
+    def track_block(self, block):
+        """Registers a canonical block in the block tree."""
+        if block['block_hash'] not in self.block_tree:
+            self.block_tree.add(block, root=block['parent_hash'] not in self.block_tree)
+
+    def is_canonical(self, block):
+        block_number = block['block_number']
+        return 0 < block_number <= len(self.chain) and self.chain.get_header(block_number - 1)['block_hash'] == block['block_hash']
+
+    def check_block(self, block):
+        """
+        Context-free checks on a block received from a peer: its hash is
+        recomputed, every transaction's tx_hash must match its contents, the
+        transactions must match the header's tx_root, and the hash must meet
+        the difficulty the header claims.
+        """
+        transactions = block.get('transactions', [])
+        if block['transaction_count'] != len(transactions):
+            return False
+        if self.hash(block) != block['block_hash']:
+            return False
+        try:
+            tx_hashes = [self.hash_transaction(transaction) for transaction in transactions]
+        except KeyError:
+            return False
+        if [transaction.get('tx_hash') for transaction in transactions] != tx_hashes or len(set(tx_hashes)) != len(tx_hashes):
+            return False
+        if self.calculate_merkle_root(transactions) != block['tx_root']:
+            return False
+        # Genesis blocks (parent hash '1') carry no proof of work
+        return block['parent_hash'] == '1' or Qhash3512.is_valid_hash(block['block_hash'], block['difficulty'])
+
+    def receive_block(self, block):
+        """
+        Handles a block announced by a peer. Blocks with an unknown parent
+        wait in the orphan pool; the others join the block tree, and the
+        chain switches to whichever tip has the most cumulative work.
+        Returns 'known', 'invalid', 'orphan', 'side', 'extended' or 'reorganized'.
+        """
+        with self.lock:
+            if block['block_hash'] in self.block_tree or block['block_hash'] in self.orphans:
+                return 'known'
+            if not self.check_block(block):
+                return 'invalid'
+            if block['parent_hash'] not in self.block_tree:
+                self.orphans.add(block)
+                logging.info(f"Block {block['block_number']} is an orphan ({len(self.orphans)} waiting)")
+                return 'orphan'
+
+            statuses = {self.connect_block(block)}
+            # Orphans whose parent just arrived can be connected in turn
+            pending = self.orphans.pop_children(block['block_hash'])
+            while pending:
+                child = pending.pop()
+                statuses.add(self.connect_block(child))
+                pending.extend(self.orphans.pop_children(child['block_hash']))
+            for status in ('reorganized', 'extended', 'side'):
+                if status in statuses:
+                    return status
+            return 'invalid'
+
+    def connect_block(self, block):
+        """Adds a block whose parent is in the block tree and updates the chain if its branch is now best."""
+        tip_hash = self.chain.get_header(-1)['block_hash'] if len(self.chain) else None
+        parent = self.block_tree.nodes[block['parent_hash']]['block']
+        if block['block_number'] != parent['block_number'] + 1:
+            return 'invalid'
+        # Side branches are held to the difficulty of their own ancestry, so
+        # a block only adds work to fork choice if its proof is real.
+        try:
+            required = self.required_difficulty(block, parent)
+        except KeyError:
+            return 'invalid'  # The branch leaves the block tree before joining the chain
+        if block['difficulty'] != required:
+            return 'invalid'
+        if not self.block_tree.is_heavier(block):
+            self.block_tree.add(block)
+            return 'side'
+        # The block joins the tree as its best tip only once the chain has
+        # switched to it (append_block tracks it), so a failed reorganization
+        # leaves the tree pointing at the chain tip.
+        if block['parent_hash'] == tip_hash:
+            self.add_block(block)
+            return 'extended'
+        try:
+            fork_height, suffix = self.block_tree.branch(block['parent_hash'], self.is_canonical)
+            self.reorganize(fork_height, suffix + [block])
+        except ValueError as e:
+            logging.warning(f"Block {block['block_number']} not connected: {e}")
+            return 'invalid'
+        return 'reorganized'
+
+    def required_difficulty(self, block, parent):
+        """Difficulty required for `block`, built on `parent` from the block tree."""
+        if self.is_canonical(parent):
+            return self.difficulty.required_at(block['block_number'])
+        return self.difficulty.required_at(block['block_number'], lambda number: self.branch_header(parent, number))
+
+    def branch_header(self, tip, block_number):
+        """Header at `block_number` on the branch ending at `tip`, read from the block tree down to the fork point."""
+        header = tip
+        while header['block_number'] > block_number and not self.is_canonical(header):
+            header = self.block_tree.nodes[header['parent_hash']]['block']
+        if header['block_number'] == block_number:
+            return header
+        return self.chain.get_header(block_number - 1)
+
+    def rollback_to(self, height):
+        """
+        Removes every block above `height` from storage, the chain view and
+        the account state, and returns their transactions to the pool.
+        """
+        with self.lock:
+            disconnected = [self.chain[index] for index in range(height, len(self.chain))]
+            for block in reversed(disconnected):
+                self.state.apply_deltas(self.db.block_balance_deltas(block), -1)
+            self.db.truncate(height)
+            self.chain.truncate(height)
+            self.difficulty.truncate(height)
+            self.restore_transactions(disconnected)
+
+    def restore_transactions(self, blocks):
+        """
+        Puts the transactions of disconnected `blocks` back in the pool, ahead
+        of the pending ones, as long as their senders can still pay for them.
+        Block rewards are dropped; they only exist in their own block.
+        """
+        pending = {transaction.get('tx_hash') for transaction in self.current_transactions}
+        restored = []
+        for block in blocks:
+            for transaction in block.get('transactions', []):
+                if transaction['sender'] == parameters['system_account'] or transaction['tx_hash'] in pending:
+                    continue
+                if self.state.get_balance(transaction['sender']) < transaction['value'] + transaction['fee']:
+                    continue
+                transaction = {key: value for key, value in transaction.items() if key not in BLOCK_ANNOTATIONS}
+                restored.append(transaction)
+                pending.add(transaction['tx_hash'])
+                self.state.apply_deltas(self.pool_deltas([transaction]))
+        self.current_transactions[:0] = restored
+        if restored:
+            logging.info(f"{len(restored)} transactions of disconnected blocks returned to the pool")
+
+    def reorganize(self, fork_height, blocks):
+        """
+        Switches the chain to a branch forking at `fork_height`; only the new
+        suffix is applied. Raises ValueError, leaving the chain unchanged, if
+        the branch does not extend the chain at `fork_height`.
+        """
+        with self.lock:
+            self.check_extends(fork_height, blocks)
+            logging.info(f"Reorganizing: {len(self.chain) - fork_height} blocks replaced by {len(blocks)} from height {fork_height + 1}")
+            metrics.increment('reorgs_total')
+            self.rollback_to(fork_height)
+            self.store_blocks(blocks)
+
+    def get_block_by_hash(self, block_hash):
+        return self.chain.get_block_by_hash(block_hash)
+
+    def get_transaction_by_hash(self, tx_hash):
+        return self.chain.get_transaction_by_hash(tx_hash)
+
+    def add_blocks(self, blocks):
+        """
+        Stores a run of blocks extending the chain tip in one batch and appends
+        them to the chain. Raises ValueError, before anything is stored, if
+        they do not extend the current tip (e.g. a block was mined meanwhile).
+        """
+        with self.lock:
+            self.check_extends(len(self.chain), blocks)
+            self.store_blocks(blocks)
+
+    def check_extends(self, height, blocks):
+        """Raises ValueError unless `blocks` are valid successors of the chain at `height`."""
+        invalid = self.validate_blocks(height, blocks)
+        if invalid is not None:
+            raise ValueError(f"Block {blocks[invalid]['block_number']} does not extend the chain at height {height + invalid}")
+
+    def validate_blocks(self, height, blocks):
+        """
+        Checks that `blocks` follow the chain's block at `height` and each
+        other, pass check_block and carry the difficulty required of them.
+        Returns the offset of the first invalid block, or None.
+        """
+        with self.lock:
+            previous_hash = self.chain.get_header(height - 1)['block_hash'] if height else '1'
+
+            def ancestor(block_number):
+                if block_number > height:
+                    return blocks[block_number - height - 1]
+                return self.chain.get_header(block_number - 1)
+
+            for offset, block in enumerate(blocks):
+                if block['block_number'] != height + offset + 1 or block['parent_hash'] != previous_hash:
+                    return offset
+                if not self.check_block(block) or block['difficulty'] != self.difficulty.required_at(block['block_number'], ancestor):
+                    return offset
+                previous_hash = block['block_hash']
+            return None
 
-        for index, transaction in enumerate(block['transactions']):
-            transaction["block_hash"] = block_hash
-            transaction["block_number"] = block_number
-            transaction["transaction_index"] = index
-            self.db.save_transaction(transaction)
+    def store_blocks(self, blocks):
+        """Stores blocks checked by validate_blocks in one batch and appends them to the chain."""
+        with self.lock:
+            for block in blocks:
+                self.annotate_transactions(block)
+            self.db.save_blocks(blocks)
+            for block in blocks:
+                self.append_block(block)
+            self.prune_transactions(blocks)
+
+    def attach_network(self, p2p_network):
+        """Use `p2p_network` for consensus, mining broadcasts and sync."""
+        self.p2p_network = p2p_network
+        self.consensus.p2p_network = p2p_network
+        self.miner.p2p_network = p2p_network
+        self.sync_manager.p2p_network = p2p_network
+        p2p_network.blockchain = self
+
+    def prepare_block(self, transactions=(), miner=None, previous_hash=None):
+        """
+        Assembles the next block from a copy of the pending pool plus
+        `transactions` (e.g. a mining reward). The nonce is left at 0 for
+        the miner to fill in before `commit_block`.
+        """
+        with self.lock:
+            block_transactions = [dict(transaction) for transaction in self.current_transactions]
+            block_transactions.extend(transactions)
+            block = {
+                'block_number': len(self.chain) + 1,
+                'parent_hash': previous_hash or (self.chain.get_header(-1)['block_hash'] if len(self.chain) else '1'),
+                'state_root': self.state.get_root(),
+                'tx_root': self.calculate_merkle_root(block_transactions),
+                'difficulty': self.difficulty.next_difficulty(),
+                'nonce': 0,
+                'timestamp': time.time(),
+                'miner': miner or self.miner_wallet_address,
+                'block_size': 0,
+                'transaction_count': len(block_transactions),
+                'transactions': block_transactions
+            }
+        block['block_size'] = len(json.dumps(block).encode('utf-8'))
+        return block
+
+    def commit_block(self, block):
+        """
+        Stores a block assembled by `prepare_block` once its nonce is set.
+        Returns the block, or None if the chain moved on in the meantime.
+        """
+        with self.lock:
+            tip_hash = self.chain.get_header(-1)['block_hash'] if len(self.chain) else '1'
+            if block['parent_hash'] != tip_hash:
+                return None
+            block_hash = self.hash(block)
+            block['block_hash'] = block_hash
+
+            # Transactions are annotated before the block is stored so engines
+            # that keep them inside the block record see the final form.
+            for transaction in block['transactions']:
+                transaction.setdefault("tx_hash", self.hash_transaction(transaction))
+            self.annotate_transactions(block)
+
+            with metrics.timer('block_commit_seconds'):
+                self.db.save_block(block_hash, block)
+                for transaction in block['transactions']:
+                    self.db.save_transaction(transaction)
+                self.db.save_balance_deltas(block)
+            self.append_block(block)
+            self.prune_transactions([block])
+            self.state.clear_transactions()
 
         logging.info(f"→ Update Network Height: {block['block_number']}")
-        self.state.clear_transactions()
         return block
 
-    def calculate_merkle_root(self, transactions):
-        if not transactions:
-            return None
-
-        def hash_pair(a, b):
-            return Qhash3512.generate_hash(a + b)
-        transaction_hashes = [Qhash3512.generate_hash(json.dumps(tx, sort_keys=True)) for tx in transactions]
-        while len(transaction_hashes) > 1:
-            if len(transaction_hashes) % 2 == 1:
-                transaction_hashes.append(transaction_hashes[-1])
-            transaction_hashes = [hash_pair(transaction_hashes[i], transaction_hashes[i + 1]) for i in range(0, len(transaction_hashes), 2)]
+    def new_block(self, proof, previous_hash=None):
+        """Builds and stores a block from the pending pool with the given nonce."""
+        with self.lock:
+            block = self.prepare_block(previous_hash=previous_hash)
+            block['nonce'] = proof
+            return self.commit_block(block)
 
-        return transaction_hashes[0]
+    def calculate_merkle_root(self, transactions):
+        return tx_root(transactions)
 
     def calculate_block_size(self):
         if not self.chain:
@@ -120,7 +415,11 @@ class Blockchain:
         fee = self.calculate_fee(amount, text)
         total_cost = amount + fee
 
-        if self.state.get_balance(sender) >= total_cost:
+        # The funds check and the pool and state changes happen together, so
+        # concurrent requests cannot spend the same balance twice.
+        with self.lock:
+            if self.state.get_balance(sender) < total_cost:
+                return "Insufficient funds"
             transaction = {
                 'sender': sender,
                 'recipient': recipient,
@@ -134,13 +433,66 @@ class Blockchain:
                 'nft': nft,
                 'timestamp': time.time()
             }
+            # Hashed up front so peers can match it when rebuilding compact blocks
+            transaction['tx_hash'] = self.hash_transaction(transaction)
             self.current_transactions.append(transaction)
-            self.state.update_balance(sender, -total_cost)
-            self.state.update_balance(recipient, amount)
-            self.state.update_balance(self.miner_wallet_address, fee)
-            logging.info(f"Transaction added: {transaction}")
-            return f"Transaction will be added to Block {len(self.chain) + 1}"
-        return "Insufficient funds"
+            self.state.apply_deltas(self.pool_deltas([transaction]))
+            next_block = len(self.chain) + 1
+        logging.info(f"Transaction added: {transaction}")
+        metrics.increment('mempool_added_total')
+        self.events.publish_transactions([transaction])
+        self.p2p_network.relay({'type': 'transaction', 'transaction': transaction})
+        return f"Transaction will be added to Block {next_block}"
+
+    def add_transaction(self, transaction):
+        """Adds a transaction created on another node, as relayed by a peer, to the pool."""
+        return self.add_transactions([transaction])[0]
+
+    def add_transactions(self, transactions):
+        """
+        Adds a batch of relayed transactions to the pool, checking them all
+        under one lock. Returns the status of each transaction.
+        """
+        statuses = []
+        added = []
+        with self.lock:
+            pending = {transaction.get('tx_hash') for transaction in self.current_transactions}
+            for transaction in transactions:
+                if transaction.get('tx_hash') != self.hash_transaction(transaction):
+                    statuses.append("Invalid transaction")
+                    continue
+                if transaction['tx_hash'] in pending:
+                    statuses.append("Known transaction")
+                    continue
+
+                total_cost = transaction['value'] + transaction['fee']
+                if self.state.get_balance(transaction['sender']) < total_cost:
+                    statuses.append("Insufficient funds")
+                    continue
+
+                self.current_transactions.append({key: value for key, value in transaction.items() if key not in BLOCK_ANNOTATIONS})
+                pending.add(transaction['tx_hash'])
+                self.state.apply_deltas(self.pool_deltas([transaction]))
+                statuses.append(f"Transaction will be added to Block {len(self.chain) + 1}")
+                added.append(transaction)
+        metrics.increment('mempool_rejected_total', len(transactions) - len(added))
+        if added:
+            metrics.increment('mempool_added_total', len(added))
+            logging.info(f"Transactions added: {len(added)} of {len(transactions)} relayed")
+            self.events.publish_transactions(added)
+        return statuses
+
+    def prune_transactions(self, blocks):
+        """Drops pending transactions that were included in `blocks`, with their pending balance changes."""
+        included = {transaction.get('tx_hash') for block in blocks for transaction in block.get('transactions', [])}
+        confirmed = [transaction for transaction in self.current_transactions if transaction.get('tx_hash') in included]
+        # The blocks' own deltas are already applied by append_block
+        self.state.apply_deltas(self.pool_deltas(confirmed), -1)
+        self.current_transactions[:] = [transaction for transaction in self.current_transactions if transaction.get('tx_hash') not in included]
+
+    def pool_deltas(self, transactions):
+        """Balance changes pending transactions make to the state until they are confirmed."""
+        return BlockchainDatabase.block_balance_deltas({'miner': self.miner_wallet_address, 'transactions': transactions})
 
     def calculate_fee(self, amount, text=None):
         base_fee = parameters['raw_tx_fee'] / (10 ** parameters['decimals'])
@@ -151,25 +503,8 @@ class Blockchain:
         return base_fee + additional_fee
 
     def hash(self, block):
-        block_data = json.dumps({
-            'block_number': block['block_number'],
-            'parent_hash': block['parent_hash'],
-            'state_root': block['state_root'],
-            'tx_root': block['tx_root'],
-            'difficulty': block['difficulty'],
-            'nonce': block['nonce'],
-            'timestamp': block['timestamp'],
-            'miner': block['miner'],
-            'block_size': block['block_size'],
-            'transaction_count': block['transaction_count'],
-            'transactions': block.get('transactions', [])
-        }, sort_keys=True)
-
-        memory_data = self.miner.mineh.memory[:self.miner.mineh.memory_size]
-        combined_data = f"{block_data}{memory_data.decode('latin1')}"
-
-        recalculated_hash = Qhash3512.generate_hash(combined_data)
-        return recalculated_hash
+        """Block hash over the header and nonce; transactions are committed through tx_root."""
+        return block_hash(block)
     
     def hash_transaction(self, transaction):
         transaction_data = json.dumps({
@@ -195,6 +530,9 @@ class Blockchain:
         if block['parent_hash'] != last_block['block_hash']:
             return False
 
+        if block['difficulty'] != self.difficulty.next_difficulty():
+            return False
+
         recalculated_hash = self.hash(block)
 
         if not Qhash3512.is_valid_hash(recalculated_hash, block['difficulty']):
@@ -207,9 +545,19 @@ class Blockchain:
         return self.miner.mine()
 
     def run_node(self, shutdown_flag):
+        self.sync_thread = threading.Thread(target=self.sync_loop, args=(shutdown_flag,), daemon=True)
+        self.sync_thread.start()
         self.mining_thread = threading.Thread(target=self.consensus_algorithm, args=(shutdown_flag,))
         self.mining_thread.start()
 
+    def sync_loop(self, shutdown_flag):
+        while not shutdown_flag.is_set():
+            try:
+                self.sync_manager.sync()
+            except Exception as e:
+                logging.error(f"Error during sync: {e}")
+            shutdown_flag.wait(parameters['sync_interval'])
+
     def consensus_algorithm(self, shutdown_flag):
         while not shutdown_flag.is_set():
             self.mine_block()
@@ -28,6 +28,10 @@ parameters = {
     "kb_tx_fee": 100,  # Additional fee per kilobyte of space used
     "block_size": 256,  # Maximum block size in kilobytes
     "data_directory": "./blockchain",  # Folder where the blockchain is stored
+    "storage_engine": "sqlite",  # Storage backend: "sqlite" or "flatfile"
+    "import_batch_size": 1000,  # Blocks validated and committed per batch by bootstrap imports
+    "chain_window": 512,  # Number of recent block headers kept in memory
+    "block_cache_size": 64,  # Memory budget in MB for the LRU cache of full blocks
     "smart_contracts": True,  # Toggle smart contracts on/off
     "fts": True,  # Toggle fungible tokens on/off
     "nfts": True,  # Toggle non-fungible tokens on/off
@@ -44,7 +48,43 @@ parameters = {
     "port": 5000,
     "p2p_host": "0.0.0.0",
     "p2p_port": 5001,
+    "events_host": "0.0.0.0",
+    "events_port": 5003,  # Port of the Server-Sent Events stream (/events)
+    "event_buffer_size": 256,  # Events queued per subscriber before the oldest are dropped
+    "max_event_subscribers": 10000,  # Event streams served at once
+    "metrics_window": 1000,  # Recent samples kept per metric for windowed averages (/metrics)
     "log_file": "blockchain.log",
+    "request_timeout": 10,  # Seconds to wait for a peer to answer a request
+    "max_headers_per_request": 2000,  # Headers served per get_headers request
+    "max_blocks_per_request": 128,  # Blocks served per get_blocks request
+    "stream_window": 4,  # Range requests kept in flight per peer while streaming blocks or headers
+    "download_window": 16,  # Block chunks requested at once across all peers during sync
+    "max_inventory_items": 1000,  # Hashes accepted per inv or getdata message
+    "seen_cache_size": 100000,  # Block and transaction hashes remembered as already seen
+    "relay_cache_size": 1000,  # Recently announced objects kept to answer getdata
+    "peer_inventory_size": 5000,  # Hashes remembered per peer as known to that peer
+    "tx_batch_interval": 20,  # Milliseconds transaction announcements are held to be sent in one inv
+    "tx_batch_size": 500,  # Announcements per peer that trigger sending the inv right away
+    "max_partial_blocks": 32,  # Compact blocks kept while their missing transactions are fetched
+    "p2p_compression": True,  # Offer compressed messages to peers that support them
+    "compression_threshold": 1024,  # Payloads smaller than this many bytes are sent uncompressed
+    "compression_level": 6,  # zlib level for compressed messages, 1 (fastest) to 9 (smallest)
+    "peer_send_queue_size": 8192,  # KB of outgoing messages queued per peer before low-priority ones are dropped
+    "peer_upload_rate": 0,  # Upload cap per peer in KB/s; 0 for no cap
+    "max_upload_rate": 0,  # Upload cap across all peers in KB/s; 0 for no cap
+    "connect_timeout": 2,  # Seconds to wait for each peer dialled at startup
+    "startup_peers": 8,  # Best-ranked peers from the address book dialled at startup
+    "peer_store_size": 1000,  # Peers kept in the address book (peers.json in data_directory)
+    "peer_store_interval": 60,  # Seconds between writes of the address book
+    "sync_interval": 30,  # Seconds between sync rounds with peers
+    "verify_chunk_size": 500,  # Headers verified per task in the sync process pool
+    "validation_cache_size": 100000,  # Peer headers remembered as verified, so later rounds only check their linkage
+    "max_reorg_depth": 100,  # Deepest fork the node will switch to; older blocks are pruned from the block tree
+    "max_orphan_blocks": 256,  # Blocks kept while waiting for their parent to arrive
+    "api_page_size": 100,  # Rows per page of API list endpoints when no limit is given
+    "api_max_page_size": 1000,  # Largest limit accepted by API list endpoints (NDJSON streams are not capped)
+    "api_cache_size": 1024,  # Responses kept by the API read cache until the next block
+    "rpc_max_calls": 500,  # Calls accepted in one /rpc batch
     "miner_wallet_address": "d95c02123362817f0b556e82f5d4ab3c0c2510f4",  # Default to the zero address
     
     # Node storage settings
@@ -55,7 +95,7 @@ parameters = {
      # Miner-specific parameters
     "cpu_count": 1,  # Number of CPUs to be used; set to 0 will default to 1
     "sleep_time": 0,  # Time to sleep between mining attempts (set to 0 to remove sleep)
-    "memory_usage": 8,  # Amount of memory to allocate per thread in MB; set to 0 will default to 4MB
+    "memory_usage": 8,  # Size in MB of the MineH scratchpad; part of consensus, so the same on every node of a network
 
     # Pre-funding allocations
     "allocations": [
@@ -88,9 +128,9 @@ def override_with_env_vars():
         if key in os.environ:
             parameters[key] = os.environ[key]
 
-def override_with_cli_args():
-    """Overrides config values with CLI arguments if provided."""
-    parser = argparse.ArgumentParser(description="Node configuration")
+def config_argument_parser():
+    """The node configuration options, for entry points to include in their own parsers."""
+    parser = argparse.ArgumentParser(add_help=False)
     parser.add_argument("--host", help="Host address")
     parser.add_argument("--port", help="Port number", type=int)
     parser.add_argument("--blockchain_dir", help="Blockchain directory")
@@ -100,9 +140,15 @@ def override_with_cli_args():
     parser.add_argument("--miner_wallet_address", help="Miner wallet address")
     parser.add_argument("--cpu_count", help="CPU count for mining", type=int)
     parser.add_argument("--sleep_time", help="Sleep time between mining attempts", type=float)
-    parser.add_argument("--memory_usage", help="Percentage of memory to use for mining", type=int)
+    parser.add_argument("--memory_usage", help="Size in MB of the MineH scratchpad", type=int)
+    return parser
+
+def override_with_cli_args():
+    """Overrides config values with CLI arguments if provided."""
+    parser = config_argument_parser()
 
-    args = parser.parse_args()
+    # Each entry point parses its own arguments with config_argument_parser and rejects unknown ones
+    args, _ = parser.parse_known_args()
     
     if args.host:
         parameters["host"] = args.host
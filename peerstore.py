@@ -0,0 +1,113 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Address book of known peers, kept in the data directory so a restarted
+# node can dial the peers that answered fastest last time instead of
+# starting over from the bootnodes.
+
+import json
+import os
+import threading
+import time
+
+UNREACHED_RTT = 1.0  # Seconds assumed for peers never connected to, so they rank after reachable ones
+
+def peer_address(node):
+    """Returns the host:port a node string is dialled at; node IDs change between restarts, addresses do not."""
+    return node.split('@', 1)[-1]
+
+
+class PeerStore:
+    def __init__(self, path, max_size):
+        """Loads the address book at `path`, keeping at most `max_size` peers."""
+        self.path = path
+        self.max_size = max_size
+        self.peers = {}  # address -> entry
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as file:
+                entries = json.load(file)
+            self.peers = {entry['address']: entry for entry in entries}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring unreadable peer store {self.path}: {e}")
+
+    def save(self):
+        """Writes the address book if it changed, replacing the old file atomically."""
+        with self.lock:
+            if not self.dirty:
+                return
+            entries = sorted(self.peers.values(), key=self.score)[:self.max_size]
+            self.peers = {entry['address']: entry for entry in entries}
+            self.dirty = False
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(entries, file, indent=1)
+        os.replace(temporary, self.path)
+
+    def entry(self, node):
+        """Returns the entry for a node string, creating it if the address is new (lock held)."""
+        address = peer_address(node)
+        entry = self.peers.get(address)
+        if entry is None:
+            entry = self.peers[address] = {
+                'address': address, 'node': node, 'last_seen': None, 'rtt': None,
+                'failures': 0, 'first_block': None, 'last_block': None,
+            }
+        entry['node'] = node
+        self.dirty = True
+        return entry
+
+    def add(self, node):
+        """Remembers a peer learned from a peer list or an incoming connection."""
+        if peer_address(node).startswith('0.0.0.0:'):
+            return  # Wildcard listen address, not dialable
+        with self.lock:
+            self.entry(node)
+
+    def connected(self, node, rtt):
+        """Records a successful connection and its handshake round trip in seconds."""
+        with self.lock:
+            entry = self.entry(node)
+            entry['last_seen'] = time.time()
+            entry['rtt'] = rtt if entry['rtt'] is None else 0.7 * entry['rtt'] + 0.3 * rtt
+            entry['failures'] = 0
+
+    def failed(self, node):
+        with self.lock:
+            self.entry(node)['failures'] += 1
+
+    def seen(self, node):
+        with self.lock:
+            self.entry(node)['last_seen'] = time.time()
+
+    def served(self, node, last_block, first_block=1):
+        """Records the range of blocks a peer reported it can serve."""
+        with self.lock:
+            entry = self.entry(node)
+            entry['first_block'], entry['last_block'] = first_block, last_block
+
+    @staticmethod
+    def score(entry):
+        """Lower is better: handshake RTT, doubled for each consecutive failure, most recently seen first on ties."""
+        rtt = entry['rtt'] if entry['rtt'] is not None else UNREACHED_RTT
+        return rtt * 2 ** min(entry['failures'], 20), -(entry['last_seen'] or 0)
+
+    def best(self, count):
+        """Returns the node strings of the `count` best-ranked peers."""
+        with self.lock:
+            return [entry['node'] for entry in sorted(self.peers.values(), key=self.score)[:count]]
+
+    def __len__(self):
+        return len(self.peers)
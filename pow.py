@@ -8,63 +8,87 @@
 # other dealings in the software.
 
 # This module implements the MineH algorithm, a custom Proof-of-Work
-# algorithm that is memory-hard and CPU-friendly.
+# algorithm that is memory-hard and CPU-friendly, and the block hash it
+# searches for. Every hash reads a segment of a scratchpad of
+# `memory_usage` MB chosen by the header and nonce, so miners must keep
+# the whole scratchpad in memory. The scratchpad is derived from the
+# network id, so any node can rebuild it and recompute a block hash from
+# the header alone; the transactions are committed through the header's
+# tx_root, the Merkle root of their stored fields.
 
-import os
-import time
+import functools
+import hashlib
+import json
 from cryptography import Qhash3512
+from parameters import parameters
+
+# Header fields covered by the block hash, besides the nonce
+HEADER_FIELDS = (
+    'block_number', 'parent_hash', 'state_root', 'tx_root', 'difficulty',
+    'timestamp', 'miner', 'block_size', 'transaction_count',
+)
+
+# Transaction fields committed to by a block's tx_root (every field the storage engines keep)
+TX_ROOT_FIELDS = ('tx_hash', 'sender', 'recipient', 'value', 'size', 'fee', 'nonce', 'input', 'timestamp', 'text', 'token', 'nft')
+
+MEMORY_SEGMENT_SIZE = 64  # Bytes of scratchpad mixed into each hash
+
+@functools.lru_cache(maxsize=1)
+def scratchpad(memory_size, network_id):
+    """The network's MineH scratchpad of `memory_size` bytes, built once per process."""
+    return hashlib.shake_256(f"MineH:{network_id}".encode('utf-8')).digest(memory_size)
+
+def memory_hash(data, memory=None):
+    """
+    Qhash3512 of `data` mixed with the scratchpad segment that a first
+    hash of `data` points at.
+    """
+    if memory is None:
+        memory = scratchpad(parameters['memory_usage'] * (2**20), parameters['network_id'])
+    start = int(Qhash3512.generate_hash(data)[:16], 16) % (len(memory) - MEMORY_SEGMENT_SIZE)
+    return Qhash3512.generate_hash(data + memory[start:start + MEMORY_SEGMENT_SIZE].hex())
+
+def header_data(header):
+    """Serialized header fields that a nonce is searched for."""
+    return json.dumps({field: header[field] for field in HEADER_FIELDS}, sort_keys=True)
+
+def block_hash(header):
+    """Recomputes the hash of a block or header."""
+    return memory_hash(f"{header_data(header)}{header['nonce']}")
+
+def tx_root(transactions):
+    """Merkle root of `transactions`, or None for a block without any."""
+    if not transactions:
+        return None
+    # Only the stored fields are committed to, so the root can be recomputed from any storage engine
+    hashes = [Qhash3512.generate_hash(json.dumps({field: tx.get(field) for field in TX_ROOT_FIELDS}, sort_keys=True)) for tx in transactions]
+    while len(hashes) > 1:
+        if len(hashes) % 2 == 1:
+            hashes.append(hashes[-1])
+        hashes = [Qhash3512.generate_hash(hashes[i] + hashes[i + 1]) for i in range(0, len(hashes), 2)]
+    return hashes[0]
 
 class MineH:
-    def __init__(self, memory_size, memory_update_interval=10):
+    def __init__(self, memory_size=None):
         """
-        Initializes the MineH algorithm with a specified memory size and update interval.
-        :param memory_size: Size of the memory array used in the algorithm.
-        :param memory_update_interval: Time interval (in seconds) to update the memory.
+        Builds (or reuses) the scratchpad every hash reads from.
+        :param memory_size: Scratchpad size in bytes; the network's `memory_usage` by default.
         """
-        self.memory_size = memory_size
-        self.memory = bytearray(os.urandom(memory_size))
-        self.memory_update_interval = memory_update_interval
-        self.memory_segment_size = 64  # Keep segment size manageable
-        self.last_memory_update = time.time()
+        self.memory_size = memory_size or parameters['memory_usage'] * (2**20)
+        self.memory = scratchpad(self.memory_size, parameters['network_id'])
 
     def mine(self, block_data: str, difficulty: int):
         """
         Executes the mining process by iterating through nonces until a valid hash is found.
-        :param block_data: The serialized block data to be hashed.
-        :param difficulty: The required difficulty level (number of leading zeros in the hash).
+        :param block_data: The serialized header, as returned by header_data.
+        :param difficulty: The required difficulty, scaled by 10^8 as stored in block headers.
         :return: A tuple containing the valid nonce and the corresponding valid hash.
         """
         nonce = 0
 
         while True:
-            self._maybe_update_memory()
-
-            # Optimization: Avoid unnecessary string concatenation in the loop
-            combined_data = f"{block_data}{nonce}"
-            memory_segment = self._get_memory_segment(nonce)
-            hash_result = Qhash3512.generate_hash(combined_data + memory_segment)
-
-            # Ensure difficulty is treated as an integer
+            hash_result = memory_hash(f"{block_data}{nonce}", self.memory)
             if Qhash3512.is_valid_hash(hash_result, difficulty):
                 return nonce, hash_result
 
             nonce += 1
-
-    def _maybe_update_memory(self):
-        """Updates the memory array if the specified update interval has passed."""
-        if time.time() - self.last_memory_update > self.memory_update_interval:
-            self._update_memory()
-
-    def _update_memory(self):
-        """Refreshes the memory array with new random data."""
-        self.memory = bytearray(os.urandom(self.memory_size))
-        self.last_memory_update = time.time()
-
-    def _get_memory_segment(self, nonce):
-        """
-        Retrieves a segment of the memory array based on the current nonce.
-        :param nonce: The current nonce used in the mining process.
-        :return: A segment of the memory array as a string.
-        """
-        start_index = nonce % (self.memory_size - self.memory_segment_size)
-        return self.memory[start_index:start_index + self.memory_segment_size].decode('latin1')
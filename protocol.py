@@ -0,0 +1,189 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Wire format of P2P messages. Every message is a frame made of a fixed
+# header (magic, message type, payload length, CRC32 of the payload)
+# followed by the JSON payload, so messages are read whole regardless of
+# how TCP splits the stream. Peers that announce COMPRESSION in their
+# hello may be sent large payloads deflated with a preset dictionary.
+
+import json
+import struct
+import zlib
+from parameters import parameters
+
+FRAME_HEADER = struct.Struct('<4sBII')  # magic, message type, payload length, payload CRC32
+MAGIC = b'HDRN'
+
+KB = 2**10
+
+# Message type -> (type code, size limit for the payload). Limits are
+# callables so they follow the configured block size and batch sizes.
+MESSAGE_TYPES = {
+    'hello': (1, lambda: 4 * KB),
+    'peer_list': (2, lambda: parameters.get('max_node_peers', 128) * KB),
+    'transaction': (3, lambda: parameters['block_size'] * KB),
+    'block': (4, lambda: 2 * parameters['block_size'] * KB),
+    'get_headers': (5, lambda: 4 * KB),
+    'headers': (6, lambda: parameters['max_headers_per_request'] * 2 * KB),
+    'get_blocks': (7, lambda: 4 * KB),
+    'blocks': (8, lambda: parameters['max_blocks_per_request'] * 2 * parameters['block_size'] * KB),
+    'inv': (9, lambda: parameters['max_inventory_items'] * KB // 4),
+    'getdata': (10, lambda: parameters['max_inventory_items'] * KB // 4),
+    'cmpctblock': (11, lambda: 2 * parameters['block_size'] * KB),
+    'getblocktxn': (12, lambda: 64 * KB),
+    'blocktxn': (13, lambda: 2 * parameters['block_size'] * KB),
+    'transactions': (14, lambda: 2 * parameters['block_size'] * KB),
+}
+MESSAGE_NAMES = {code: name for name, (code, _) in MESSAGE_TYPES.items()}
+
+# Set on the type code of frames whose payload is compressed
+COMPRESSED = 0x80
+COMPRESSION = 'zlib-1'  # Advertised in hello; bump the version whenever PRESET_DICTIONARY changes
+
+# Strings that recur in blocks, headers and transactions. zlib finds
+# matches nearer the end of the dictionary more cheaply, so the most
+# frequent fragments come last.
+PRESET_DICTIONARY = ''.join([
+    '{"type": "headers", "response_to": "', '{"type": "blocks", "response_to": "', '"height": ',
+    '{"type": "cmpctblock", "header": ', '"short_ids": [', '"prefilled": [',
+    '{"type": "transactions", "transactions": [', '{"type": "inv", "items": [', '{"kind": "transaction", "hash": "',
+    '"state_root": "', '"tx_root": ', '"difficulty": ', '"miner": "', '"block_size": ', '"transaction_count": ',
+    '"token": null, "nft": null, ', '"input": "', '"text": "', '"size": ', '"nonce": ', '"fee": ',
+    '"timestamp": ', '"transaction_index": ', '"block_number": ', '"parent_hash": "',
+    '"sender": "', '"recipient": "', '"value": ', '"transactions": [', '"block_hash": "', '"tx_hash": "',
+]).encode('utf-8')
+
+# Dropped first when a peer's send queue is full
+LOW_PRIORITY_TYPES = {'inv', 'transaction', 'transactions', 'peer_list'}
+
+
+class ProtocolError(Exception):
+    """Raised when a peer sends bytes that are not a valid frame."""
+
+
+def max_payload(message_type):
+    return MESSAGE_TYPES[message_type][1]()
+
+def encode_message(message, compress=False):
+    """
+    Serializes a message dict (which must carry a known 'type') into one
+    frame. With `compress`, payloads of at least `compression_threshold`
+    bytes are deflated when that makes them smaller.
+    """
+    message_type = message.get('type')
+    if message_type not in MESSAGE_TYPES:
+        raise ValueError(f"Unknown message type: {message_type}")
+    payload = json.dumps(message).encode('utf-8')
+    if len(payload) > max_payload(message_type):
+        raise ValueError(f"{message_type} message of {len(payload)} bytes exceeds its size limit")
+    type_code = MESSAGE_TYPES[message_type][0]
+    if compress and len(payload) >= parameters['compression_threshold']:
+        compressor = zlib.compressobj(parameters['compression_level'], zdict=PRESET_DICTIONARY)
+        compressed = compressor.compress(payload) + compressor.flush()
+        if len(compressed) < len(payload):
+            payload, type_code = compressed, type_code | COMPRESSED
+    return FRAME_HEADER.pack(MAGIC, type_code, len(payload), zlib.crc32(payload)) + payload
+
+def decompress_payload(payload, message_type):
+    """Inflates a compressed payload, refusing output beyond the message type's size limit."""
+    limit = max_payload(message_type)
+    decompressor = zlib.decompressobj(zdict=PRESET_DICTIONARY)
+    data = decompressor.decompress(payload, limit + 1)
+    if len(data) > limit:
+        raise ProtocolError(f"Compressed {message_type} frame exceeds its size limit")
+    if not decompressor.eof:
+        raise ProtocolError(f"Truncated compressed {message_type} frame")
+    return data
+
+
+class FrameReader:
+    """
+    Reassembles frames from a byte stream. Bytes are received straight into
+    one reusable buffer and payloads are parsed from memoryview slices of
+    it, so nothing is copied between the socket and the JSON decoder.
+    """
+
+    def __init__(self, initial_size=64 * KB):
+        self.buffer = bytearray(initial_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # First unread byte
+        self.end = 0  # End of the received bytes
+
+    def get_buffer(self, size_hint=0):
+        """Returns the writable free space at the end of the buffer."""
+        self.reserve(max(size_hint, 1))
+        return self.view[self.end:]
+
+    def buffer_updated(self, count):
+        """Records that `count` bytes were written into the buffer from get_buffer."""
+        self.end += count
+
+    def read_from(self, sock):
+        """Receives whatever the socket has into the buffer. Returns 0 once the peer closed it."""
+        count = sock.recv_into(self.get_buffer())
+        self.buffer_updated(count)
+        return count
+
+    def feed(self, data):
+        """Appends bytes obtained some other way."""
+        self.get_buffer(len(data))[:len(data)] = data
+        self.buffer_updated(len(data))
+
+    def reserve(self, size):
+        """Makes room for `size` more bytes, compacting or growing the buffer."""
+        if len(self.buffer) - self.end >= size:
+            return
+        unread = self.end - self.start
+        if len(self.buffer) >= unread + size:
+            self.buffer[:unread] = bytes(self.view[self.start:self.end])
+        else:
+            grown = bytearray(max(2 * len(self.buffer), unread + size))
+            grown[:unread] = self.view[self.start:self.end]
+            self.view.release()
+            self.buffer = grown
+            self.view = memoryview(self.buffer)
+        self.start, self.end = 0, unread
+
+    def messages(self):
+        """Yields every complete message in the buffer."""
+        while self.end - self.start >= FRAME_HEADER.size:
+            magic, type_code, length, checksum = FRAME_HEADER.unpack_from(self.buffer, self.start)
+            if magic != MAGIC:
+                raise ProtocolError("Bad frame magic")
+            message_type = MESSAGE_NAMES.get(type_code & ~COMPRESSED)
+            if message_type is None:
+                raise ProtocolError(f"Unknown message type code {type_code}")
+            if length > max_payload(message_type):
+                raise ProtocolError(f"{message_type} frame of {length} bytes exceeds its size limit")
+
+            frame_end = self.start + FRAME_HEADER.size + length
+            if frame_end > self.end:
+                self.reserve(frame_end - self.end)
+                return
+
+            payload = self.view[self.start + FRAME_HEADER.size:frame_end]
+            try:
+                if zlib.crc32(payload) != checksum:
+                    raise ProtocolError(f"Checksum mismatch in {message_type} frame")
+                if type_code & COMPRESSED:
+                    message = json.loads(decompress_payload(payload, message_type))
+                else:
+                    message = json.loads(str(payload, 'utf-8'))
+            except (ValueError, zlib.error) as e:
+                raise ProtocolError(f"Undecodable {message_type} payload: {e}")
+            finally:
+                payload.release()
+            self.start = frame_end
+            if not isinstance(message, dict) or message.get('type') != message_type:
+                raise ProtocolError(f"Payload does not match its {message_type} frame")
+            yield message
+
+        if self.start == self.end:
+            self.start = self.end = 0
@@ -59,6 +59,15 @@ CREATE TABLE IF NOT EXISTS state (
     FOREIGN KEY (account_address) REFERENCES accounts(address)
 );
 
+-- Schema for Balance Deltas (one row per account touched by a block)
+CREATE TABLE IF NOT EXISTS balance_deltas (
+    address TEXT,
+    block_number INTEGER,
+    delta INTEGER,
+    balance INTEGER,
+    PRIMARY KEY (address, block_number)
+) WITHOUT ROWID;
+
 -- Schema for Contracts
 CREATE TABLE IF NOT EXISTS contracts (
     contract_address TEXT PRIMARY KEY,
@@ -133,6 +142,7 @@ CREATE TABLE IF NOT EXISTS nft_approvals (
 -- Indexes for Performance
 CREATE INDEX IF NOT EXISTS idx_blocks_number ON blocks(block_number);
 CREATE INDEX IF NOT EXISTS idx_transactions_block_hash ON transactions(block_hash);
+CREATE INDEX IF NOT EXISTS idx_transactions_position ON transactions(block_number, transaction_index);
 CREATE INDEX IF NOT EXISTS idx_transactions_sender ON transactions(sender);
 CREATE INDEX IF NOT EXISTS idx_transactions_recipient ON transactions(recipient);
 CREATE INDEX IF NOT EXISTS idx_contracts_owner ON contracts(owner_address);
@@ -10,13 +10,14 @@
 # Manages the core blockchain operations, including block creation,
 # transaction handling, and proof-of-work.
 
+import argparse
 import threading
 import logging
 from node import Blockchain
 from network import P2PNetwork
+from events import EventServer
 from api import create_app
-from miner import Miner
-from parameters import parameters  # Import the parameters from parameters.py
+from parameters import parameters, config_argument_parser  # Import the parameters from parameters.py
 import signal
 import sys
 import time
@@ -26,14 +27,18 @@ from waitress import serve  # Use waitress for production-ready server
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(message)s')
 
-# Initialize the blockchain
-blockchain = Blockchain()
+if __name__ == "__main__":
+    # Stop on mistyped options before the node starts
+    argparse.ArgumentParser(description="Run a Hadron node", parents=[config_argument_parser()]).parse_args()
 
-# Initialize P2P Network
+# Initialize P2P Network, shared by the node, its miner and sync
 p2p_network = P2PNetwork(host=parameters['p2p_host'], port=parameters['p2p_port'] + 1)
 
-# Initialize Miner
-miner = Miner(wallet_address=parameters['miner_wallet_address'], p2p_network=p2p_network, blockchain=blockchain)
+# Initialize the blockchain
+blockchain = Blockchain(p2p_network)
+
+# The node's own miner
+miner = blockchain.miner
 
 # Initialize shutdown flag
 shutdown_flag = threading.Event()
@@ -47,6 +52,7 @@ def start_network(shutdown_flag):
     """Start the P2P network."""
     logging.info("Starting P2P network...")
     p2p_network.start_server()
+    p2p_network.load_bootnodes()
 
 def start_miner(shutdown_flag):
     """Start the mining process."""
@@ -63,6 +69,11 @@ def start_api(shutdown_flag):
     server.start()
     return server
 
+def start_events(shutdown_flag):
+    """Start the Server-Sent Events stream."""
+    logging.info("Starting event stream...")
+    EventServer(blockchain.events, parameters['events_host'], parameters['events_port']).start()
+
 def serve_api(app, shutdown_flag):
     """Serve the Flask API using Waitress."""
     serve(app, host=parameters['host'], port=parameters['port'], threads=4)
@@ -87,6 +98,7 @@ if __name__ == "__main__":
     network_thread = threading.Thread(target=start_network, args=(shutdown_flag,))
     miner_thread = start_miner(shutdown_flag)
     api_thread = start_api(shutdown_flag)
+    start_events(shutdown_flag)
     node_thread.start()
     network_thread.start()
 
@@ -0,0 +1,311 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Runs a network of nodes on loopback ports to measure how blocks and
+# transactions propagate. Nodes run in one process or are spread over
+# several; links get injected latency and the nodes produce blocks and
+# transactions at configurable rates. Proof of work is not checked, so
+# blocks are produced on schedule instead of being mined.
+#
+#   python simulator.py --nodes 20 --topology random --degree 4 --latency 50
+#   python simulator.py --nodes 60 --processes 4 --duration 120 --json
+
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import Counter
+from parameters import parameters, config_argument_parser
+
+SENDER = 'f' * 40  # Pre-funded on every node to pay for the simulated transactions
+TOPOLOGIES = ('full', 'ring', 'line', 'star', 'random')
+
+def build_topology(kind, count, degree=4, seed=0):
+    """Returns the (dialer, listener) node index pairs to connect."""
+    if kind == 'full':
+        return [(i, j) for i in range(count) for j in range(i)]
+    if kind == 'ring':
+        return [(i, (i + 1) % count) for i in range(count)] if count > 2 else build_topology('line', count)
+    if kind == 'line':
+        return [(i, i - 1) for i in range(1, count)]
+    if kind == 'star':
+        return [(i, 0) for i in range(1, count)]
+
+    rng = random.Random(seed)
+    edges = {(i, i - 1) for i in range(1, count)}  # A line keeps the graph connected
+    for i in range(count):
+        for j in rng.sample(range(count), min(degree, count)):
+            if i != j and (j, i) not in edges:
+                edges.add((i, j))
+    return sorted(edges)
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda fraction: ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': ordered[-1]}
+
+def node_address(index, base_port):
+    return f"node://sim{index}@127.0.0.1:{base_port + index}"
+
+
+def run_nodes(indices, options, edges, genesis, start_at):
+    """
+    Runs the nodes in `indices` in this process from `start_at` (wall clock)
+    for the configured duration and returns what they observed.
+    """
+    import cryptography
+    from database import BlockchainDatabase
+    from network import P2PNetwork
+    from node import Blockchain
+
+    class SimulatedNetwork(P2PNetwork):
+        """P2PNetwork that delays outgoing frames by the link latency and counts the bytes it sends."""
+
+        def __init__(self, host, port, events):
+            super().__init__(host, port)
+            self.events = events
+            self.bytes_sent = 0
+            self.link_clock = {}  # peer_id -> time the last frame is due, to keep links FIFO
+
+        def send_frame(self, peer_id, peer, frame, low_priority=False):
+            self.bytes_sent += len(frame)
+            delay = max(0.0, random.gauss(options.latency, options.jitter) / 1000)
+            due = max(time.monotonic() + delay, self.link_clock.get(peer_id, 0))
+            self.link_clock[peer_id] = due
+            self.loop.call_soon_threadsafe(self.loop.call_at, due - time.monotonic() + self.loop.time(), peer.enqueue, frame, low_priority)
+
+        def relay(self, message, exclude_peer=None):
+            if exclude_peer is None and message['type'] == 'transaction':
+                self.events['transactions_created'][message['transaction']['tx_hash']] = time.time()
+            super().relay(message, exclude_peer)
+
+    cryptography.Qhash3512.is_valid_hash = staticmethod(lambda hash_result, difficulty: True)
+    logging.getLogger().setLevel(logging.ERROR)
+
+    events = {
+        'blocks_mined': {},  # block_hash -> (node, time)
+        'block_arrivals': [],  # (node, block_hash, time)
+        'transactions_created': {},  # tx_hash -> time
+        'transaction_arrivals': [],  # (node, tx_hash, time)
+    }
+    nodes = {}
+    quiet = open(os.devnull, 'w') if not options.verbose else None
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        for index in indices:
+            parameters['data_directory'] = os.path.join(options.data_dir, f"node{index}")
+            db = BlockchainDatabase()
+            db.save_blocks([genesis])
+            db.close()
+
+            network = SimulatedNetwork('127.0.0.1', options.base_port + index, events)
+            network.node_id = node_address(index, options.base_port)
+            blockchain = Blockchain(network)
+            blockchain.state.update_balance(SENDER, 10**15)
+            nodes[index] = blockchain
+
+            def on_append(block, blockchain=blockchain, index=index, append_block=blockchain.append_block):
+                events['block_arrivals'].append((index, block['block_hash'], time.time()))
+                append_block(block)
+            blockchain.append_block = on_append
+
+            def on_transactions(transactions, index=index, add_transactions=blockchain.add_transactions):
+                statuses = add_transactions(transactions)
+                for transaction, status in zip(transactions, statuses):
+                    if status.startswith("Transaction will be added"):
+                        events['transaction_arrivals'].append((index, transaction['tx_hash'], time.time()))
+                return statuses
+            blockchain.add_transactions = on_transactions
+
+            network.start_server()
+
+        time.sleep(max(0, start_at - time.time()))
+        for dialer, listener in edges:
+            if dialer in nodes:
+                nodes[dialer].p2p_network.connect_to_peer(node_address(listener, options.base_port), wait=False)
+        time.sleep(1)
+
+        # Blocks and transactions arrive as Poisson processes, split over the processes by node count
+        share = len(indices) / options.nodes
+        end = time.time() + options.duration
+        next_block = time.time() + random.expovariate(share / options.block_interval)
+        next_transaction = time.time() + random.expovariate(share * options.tx_rate) if options.tx_rate else end
+        while True:
+            now = time.time()
+            if min(next_block, next_transaction) >= end:
+                break
+            time.sleep(max(0, min(next_block, next_transaction) - now))
+
+            if next_block <= next_transaction:
+                producer = random.choice(indices)
+                blockchain = nodes[producer]
+                with blockchain.lock:
+                    block = blockchain.new_block(proof=0, previous_hash=blockchain.chain.get_header(-1)['block_hash'])
+                events['blocks_mined'][block['block_hash']] = (producer, time.time())
+                blockchain.p2p_network.relay({'type': 'block', 'block': block})
+                next_block += random.expovariate(share / options.block_interval)
+            else:
+                blockchain = nodes[random.choice(indices)]
+                recipient = f"{random.getrandbits(160):040x}"
+                text = 'x' * random.randint(0, options.tx_size)
+                blockchain.new_transaction(SENDER, recipient, 1, text)
+                next_transaction += random.expovariate(share * options.tx_rate)
+
+        time.sleep(options.settle)
+
+    return {
+        'events': events,
+        'bytes_sent': {index: blockchain.p2p_network.bytes_sent for index, blockchain in nodes.items()},
+        'chains': {
+            index: [blockchain.chain.get_header(i)['block_hash'] for i in range(len(blockchain.chain))]
+            for index, blockchain in nodes.items()
+        },
+    }
+
+def run_group(indices, options, edges, genesis, start_at, results):
+    results.put(run_nodes(indices, options, edges, genesis, start_at))
+
+
+def create_genesis(options):
+    """Creates the genesis block every simulated node starts from."""
+    from node import Blockchain
+    parameters['data_directory'] = os.path.join(options.data_dir, "genesis")
+    logging.getLogger().setLevel(logging.ERROR)
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        blockchain = Blockchain()
+    genesis = blockchain.chain[0]
+    blockchain.db.close()
+    return genesis
+
+def report(options, runs):
+    """Merges the observations of every process into propagation statistics."""
+    mined, block_arrivals, created, transaction_arrivals = {}, {}, {}, {}
+    bytes_sent, chains = {}, {}
+    for run in runs:
+        mined.update(run['events']['blocks_mined'])
+        created.update(run['events']['transactions_created'])
+        for node, block_hash, arrived in run['events']['block_arrivals']:
+            block_arrivals.setdefault((node, block_hash), arrived)
+        for node, tx_hash, arrived in run['events']['transaction_arrivals']:
+            transaction_arrivals.setdefault((node, tx_hash), arrived)
+        bytes_sent.update(run['bytes_sent'])
+        chains.update(run['chains'])
+
+    block_delays = [
+        (arrived - mined[block_hash][1]) * 1000
+        for (node, block_hash), arrived in block_arrivals.items()
+        if block_hash in mined and node != mined[block_hash][0]
+    ]
+    transaction_delays = [
+        (arrived - created[tx_hash]) * 1000
+        for (node, tx_hash), arrived in transaction_arrivals.items() if tx_hash in created
+    ]
+
+    # The chain most nodes ended on decides which blocks went stale
+    tips = Counter(chain[-1] for chain in chains.values())
+    best_tip = tips.most_common(1)[0][0]
+    canonical = set(next(chain for chain in chains.values() if chain[-1] == best_tip))
+    stale = sum(1 for block_hash in mined if block_hash not in canonical)
+    seconds = options.duration + options.settle
+    rates = sorted(sent / 1024 / seconds for sent in bytes_sent.values())
+
+    return {
+        'nodes': options.nodes,
+        'topology': options.topology,
+        'processes': options.processes,
+        'latency_ms': options.latency,
+        'duration_s': options.duration,
+        'blocks': {
+            'mined': len(mined),
+            'stale': stale,
+            'orphan_rate': stale / len(mined) if mined else 0,
+            'coverage': len(block_delays) / (len(mined) * (options.nodes - 1)) if mined and options.nodes > 1 else 1,
+            'propagation_ms': percentiles(block_delays),
+        },
+        'transactions': {
+            'created': len(created),
+            'coverage': len(transaction_delays) / (len(created) * (options.nodes - 1)) if created and options.nodes > 1 else 1,
+            'propagation_ms': percentiles(transaction_delays),
+        },
+        'bandwidth_kbps': {'min': rates[0], 'median': rates[len(rates) // 2], 'max': rates[-1]},
+        'converged': tips[best_tip] / len(chains),
+    }
+
+def print_report(result):
+    print(f"{result['nodes']} nodes, {result['topology']} topology, {result['latency_ms']}ms latency, {result['duration_s']}s")
+    blocks, transactions = result['blocks'], result['transactions']
+    print(f"Blocks: {blocks['mined']} produced, {blocks['stale']} stale (orphan rate {blocks['orphan_rate']:.1%}), coverage {blocks['coverage']:.1%}")
+    for name, value in blocks['propagation_ms'].items():
+        print(f"  propagation {name}: {value:.0f}ms")
+    print(f"Transactions: {transactions['created']} created, coverage {transactions['coverage']:.1%}")
+    for name, value in transactions['propagation_ms'].items():
+        print(f"  propagation {name}: {value:.0f}ms")
+    bandwidth = result['bandwidth_kbps']
+    print(f"Upload per node: min {bandwidth['min']:.1f} / median {bandwidth['median']:.1f} / max {bandwidth['max']:.1f} KB/s")
+    print(f"Nodes on the majority tip: {result['converged']:.0%}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a network of nodes on loopback and measure propagation", parents=[config_argument_parser()])
+    parser.add_argument("--nodes", type=int, default=10)
+    parser.add_argument("--processes", type=int, default=1, help="Spread the nodes over this many processes")
+    parser.add_argument("--topology", choices=TOPOLOGIES, default="random")
+    parser.add_argument("--degree", type=int, default=4, help="Peers dialled per node in the random topology")
+    parser.add_argument("--latency", type=float, default=50, help="Mean one-way link latency in ms")
+    parser.add_argument("--jitter", type=float, default=10, help="Standard deviation of the link latency in ms")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of block and transaction load")
+    parser.add_argument("--settle", type=float, default=5, help="Seconds to let propagation finish after the load stops")
+    parser.add_argument("--block-interval", type=float, default=5, help="Mean seconds between blocks across the network")
+    parser.add_argument("--tx-rate", type=float, default=5, help="Transactions per second across the network")
+    parser.add_argument("--tx-size", type=int, default=256, help="Maximum text bytes per transaction")
+    parser.add_argument("--base-port", type=int, default=17000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="Where node data is kept (a temporary directory by default)")
+    parser.add_argument("--keep-data", action="store_true")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Show node output")
+    options = parser.parse_args()
+
+    random.seed(options.seed)
+    options.data_dir = options.data_dir or tempfile.mkdtemp(prefix="hadron-sim-")
+    edges = build_topology(options.topology, options.nodes, options.degree, options.seed)
+    genesis = create_genesis(options)
+
+    groups = [list(range(options.nodes))[i::options.processes] for i in range(options.processes)]
+    start_at = time.time() + 2 + 0.2 * options.nodes / options.processes
+    try:
+        if options.processes == 1:
+            runs = [run_nodes(groups[0], options, edges, genesis, start_at)]
+        else:
+            context = multiprocessing.get_context('spawn')
+            results = context.Queue()
+            workers = [context.Process(target=run_group, args=(group, options, edges, genesis, start_at, results)) for group in groups]
+            for worker in workers:
+                worker.start()
+            runs = [results.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+    finally:
+        if not options.keep_data:
+            shutil.rmtree(options.data_dir, ignore_errors=True)
+
+    result = report(options, runs)
+    if options.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+if __name__ == "__main__":
+    main()
@@ -37,6 +37,20 @@ class BlockchainState:
         if self.balances[address] == 0:
             self.accounts.discard(address)
 
+    def apply_deltas(self, deltas, sign=1):
+        """Apply (or with sign=-1, undo) the {address: delta} changes of a confirmed block or pending transaction."""
+        for address, delta in deltas.items():
+            self.balances[address] += sign * delta
+            if self.balances[address]:
+                self.accounts.add(address)
+            else:
+                self.accounts.discard(address)
+
+    def load(self, balances):
+        """Replace all balances with the confirmed {address: balance} of the stored chain."""
+        self.balances = defaultdict(int, balances)
+        self.accounts = {address for address, balance in balances.items() if balance}
+
     def get_balance(self, address):
         """Get the balance of a specific account, creating the account if it doesn't exist."""
         if address not in self.balances:
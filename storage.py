@@ -0,0 +1,735 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Storage engines used by BlockchainDatabase. SQLite is the default
+# engine; the flat-file engine keeps blocks in an append-only log with
+# a memory-mapped height index so block reads avoid the SQL layer.
+
+import sqlite3
+import os
+import json
+import mmap
+import bisect
+import struct
+import threading
+
+class StorageEngine:
+    """Interface implemented by every storage backend."""
+
+    def save_block(self, block_hash, block_data):
+        raise NotImplementedError
+
+    def get_block(self, block_hash):
+        raise NotImplementedError
+
+    def get_block_by_number(self, block_number):
+        raise NotImplementedError
+
+    def get_last_block(self):
+        raise NotImplementedError
+
+    def save_transaction(self, transaction):
+        raise NotImplementedError
+
+    def get_transaction(self, tx_hash):
+        raise NotImplementedError
+
+    def get_block_transactions(self, block_hash):
+        raise NotImplementedError
+
+    def save_account(self, address, balance, nonce, code_hash=None, storage_root=None):
+        raise NotImplementedError
+
+    def get_account(self, address):
+        raise NotImplementedError
+
+    def save_state_node(self, state_root, account_address, storage_root=None):
+        raise NotImplementedError
+
+    def get_state_node(self, state_root):
+        raise NotImplementedError
+
+    def save_transactions(self, transactions):
+        for transaction in transactions:
+            self.save_transaction(transaction)
+
+    def save_balance_deltas(self, block_number, deltas):
+        """Stores {address: delta} for a block along with running balances."""
+        raise NotImplementedError
+
+    def get_balance_at(self, address, block_number):
+        """Returns the balance of `address` after `block_number`, or None."""
+        raise NotImplementedError
+
+    def has_balance_deltas(self):
+        """True once any balance delta has been stored."""
+        raise NotImplementedError
+
+    def get_balances(self):
+        """Returns {address: balance} as of the last stored block."""
+        raise NotImplementedError
+
+    def iter_blocks(self, start=1):
+        """Yields blocks with their transactions in block order, from block `start` (1 at the lowest)."""
+        block_number = max(start, 1)
+        while True:
+            block = self.get_block_by_number(block_number)
+            if block is None:
+                return
+            if 'transactions' not in block:
+                block['transactions'] = self.get_block_transactions(block['block_hash'])
+            yield block
+            block_number += 1
+
+    def iter_transactions(self, after=(0, -1)):
+        """Yields stored transactions in chain order, starting after the (block_number, transaction_index) `after`."""
+        for block in self.iter_blocks(max(after[0], 1)):
+            for transaction in block.get('transactions', []):
+                if (block['block_number'], transaction['transaction_index']) > tuple(after):
+                    yield transaction
+
+    def truncate(self, block_number):
+        """Removes every block, transaction and balance delta above `block_number`."""
+        raise NotImplementedError
+
+    def begin_batch(self):
+        """Start a bulk write; durability is only guaranteed at end_batch."""
+        pass
+
+    def end_batch(self):
+        pass
+
+    def commit(self):
+        """Make the writes of the current batch durable."""
+        pass
+
+    def drop_indexes(self):
+        """Drop secondary indexes ahead of a bulk load."""
+        pass
+
+    def create_indexes(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteStorageEngine(StorageEngine):
+    ITER_PAGE_SIZE = 256  # Rows read per lock acquisition when streaming
+
+    def __init__(self, data_directory):
+        """Initialize the SQLite connection inside the data directory."""
+        self.lock = threading.Lock()
+        self.batching = False
+        db_path = os.path.join(data_directory, 'blockchain.db')
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.cursor = self.connection.cursor()
+        self._initialize_database()
+
+    def _initialize_database(self):
+        """Load the schema from the schema.sql file and initialize the database."""
+        with self.lock:
+            schema_path = os.path.join(os.path.dirname(__file__), 'schema.sql')
+            with open(schema_path, 'r') as schema_file:
+                self.schema = schema_file.read()
+            self.cursor.executescript(self.schema)
+            self.connection.commit()
+
+    def _commit(self):
+        if not self.batching:
+            self.connection.commit()
+
+    def _index_statements(self):
+        return [line.strip() for line in self.schema.splitlines() if line.startswith("CREATE INDEX")]
+
+    def begin_batch(self):
+        """Group all writes into one transaction with relaxed syncing."""
+        with self.lock:
+            self.connection.commit()
+            self.cursor.execute("PRAGMA synchronous=OFF")
+            self.batching = True
+
+    def end_batch(self):
+        with self.lock:
+            self.batching = False
+            self.connection.commit()
+            self.cursor.execute("PRAGMA synchronous=FULL")
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+
+    def drop_indexes(self):
+        """Drop the schema's secondary indexes; create_indexes rebuilds them."""
+        with self.lock:
+            for statement in self._index_statements():
+                index_name = statement.split("IF NOT EXISTS")[1].split()[0]
+                self.cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+            self._commit()
+
+    def create_indexes(self):
+        with self.lock:
+            for statement in self._index_statements():
+                self.cursor.execute(statement)
+            self._commit()
+
+    def _fetch_one(self, query, params=()):
+        with self.lock:
+            self.cursor.execute(query, params)
+            row = self.cursor.fetchone()
+            if row:
+                columns = [desc[0] for desc in self.cursor.description]
+                return dict(zip(columns, row))
+            return None
+
+    def _fetch_all(self, query, params=()):
+        with self.lock:
+            self.cursor.execute(query, params)
+            columns = [desc[0] for desc in self.cursor.description]
+            return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+
+    def save_block(self, block_hash, block_data):
+        """Saves a block header using the block hash as the key."""
+        with self.lock:
+            self.cursor.execute(
+                """
+                INSERT OR REPLACE INTO blocks (
+                    block_hash, block_number, parent_hash, state_root, tx_root,
+                    timestamp, miner, block_size, transaction_count, difficulty, nonce
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    block_hash,
+                    block_data["block_number"],
+                    block_data["parent_hash"],
+                    block_data["state_root"],
+                    block_data["tx_root"],
+                    block_data["timestamp"],
+                    block_data["miner"],
+                    block_data["block_size"],
+                    block_data["transaction_count"],
+                    block_data["difficulty"],
+                    block_data["nonce"],
+                )
+            )
+            self._commit()
+
+    def get_block(self, block_hash):
+        """Retrieves a block header by hash."""
+        return self._fetch_one("SELECT * FROM blocks WHERE block_hash=?", (block_hash,))
+
+    def get_block_by_number(self, block_number):
+        """Retrieves a block header by number."""
+        return self._fetch_one(
+            "SELECT * FROM blocks WHERE block_number=? ORDER BY rowid DESC LIMIT 1", (block_number,)
+        )
+
+    def get_last_block(self):
+        """Retrieves the last block header in the blockchain."""
+        return self._fetch_one("SELECT * FROM blocks ORDER BY block_number DESC LIMIT 1")
+
+    TRANSACTION_INSERT = """
+        INSERT OR REPLACE INTO transactions (
+            tx_hash, block_hash, block_number, sender, recipient, value, size,
+            fee, nonce, input, transaction_index, timestamp, text, token, nft
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+
+    @staticmethod
+    def _transaction_row(transaction):
+        return (
+            transaction['tx_hash'],
+            transaction['block_hash'],
+            transaction['block_number'],
+            transaction['sender'],
+            transaction['recipient'],
+            transaction['value'],
+            transaction['size'],
+            transaction['fee'],
+            transaction['nonce'],
+            transaction['input'],
+            transaction['transaction_index'],
+            transaction['timestamp'],
+            transaction['text'],
+            transaction['token'],
+            transaction['nft'],
+        )
+
+    def save_transaction(self, transaction):
+        """Saves a transaction."""
+        with self.lock:
+            self.cursor.execute(self.TRANSACTION_INSERT, self._transaction_row(transaction))
+            self._commit()
+
+    def save_transactions(self, transactions):
+        """Saves many transactions with a single statement."""
+        with self.lock:
+            self.cursor.executemany(self.TRANSACTION_INSERT, [self._transaction_row(tx) for tx in transactions])
+            self._commit()
+
+    def get_transaction(self, tx_hash):
+        """Retrieves a transaction by hash."""
+        return self._fetch_one("SELECT * FROM transactions WHERE tx_hash=?", (tx_hash,))
+
+    def get_block_transactions(self, block_hash):
+        """Retrieves the transactions of a block in block order."""
+        return self._fetch_all(
+            "SELECT * FROM transactions WHERE block_hash=? ORDER BY transaction_index", (block_hash,)
+        )
+
+    def _iter_pages(self, query, after, key):
+        """
+        Streams the rows of a keyset query in pages. Each page is one
+        `query` (which takes the `after` key and a LIMIT) run under the lock,
+        resuming after the key of the previous page's last row, so a slow
+        reader never holds the shared connection between pages.
+        """
+        while True:
+            rows = self._fetch_all(query, (*after, self.ITER_PAGE_SIZE))
+            yield from rows
+            if len(rows) < self.ITER_PAGE_SIZE:
+                return
+            after = key(rows[-1])
+
+    def iter_blocks(self, start=1):
+        """Streams blocks in order, a page at a time."""
+        pages = self._iter_pages(
+            "SELECT * FROM blocks WHERE block_number > ? ORDER BY block_number LIMIT ?",
+            (max(start, 1) - 1,), lambda block: (block['block_number'],)
+        )
+        for block in pages:
+            block['transactions'] = self.get_block_transactions(block['block_hash'])
+            yield block
+
+    def iter_transactions(self, after=(0, -1)):
+        """Streams transactions in chain order, seeking to `after` through the position index."""
+        return self._iter_pages(
+            "SELECT * FROM transactions WHERE (block_number, transaction_index) > (?, ?) "
+            "ORDER BY block_number, transaction_index LIMIT ?",
+            tuple(after), lambda transaction: (transaction['block_number'], transaction['transaction_index'])
+        )
+
+    def save_balance_deltas(self, block_number, deltas):
+        """Stores one row per address with the delta and the running balance."""
+        with self.lock:
+            rows = []
+            for address, delta in deltas.items():
+                self.cursor.execute(
+                    "SELECT balance FROM balance_deltas WHERE address=? AND block_number<? "
+                    "ORDER BY block_number DESC LIMIT 1",
+                    (address, block_number)
+                )
+                previous = self.cursor.fetchone()
+                rows.append((address, block_number, delta, (previous[0] if previous else 0) + delta))
+            self.cursor.executemany(
+                "INSERT OR REPLACE INTO balance_deltas (address, block_number, delta, balance) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._commit()
+
+    def truncate(self, block_number):
+        with self.lock:
+            for table in ("transactions", "blocks", "balance_deltas"):
+                self.cursor.execute(f"DELETE FROM {table} WHERE block_number > ?", (block_number,))
+            self._commit()
+
+    def get_balance_at(self, address, block_number):
+        """One seek on the (address, block_number) key."""
+        row = self._fetch_one(
+            "SELECT balance FROM balance_deltas WHERE address=? AND block_number<=? "
+            "ORDER BY block_number DESC LIMIT 1",
+            (address, block_number)
+        )
+        return row['balance'] if row else None
+
+    def has_balance_deltas(self):
+        return self._fetch_one("SELECT 1 AS found FROM balance_deltas LIMIT 1") is not None
+
+    def get_balances(self):
+        # SQLite returns the bare `balance` column from the row holding MAX(block_number)
+        rows = self._fetch_all("SELECT address, balance, MAX(block_number) FROM balance_deltas GROUP BY address")
+        return {row['address']: row['balance'] for row in rows}
+
+    def save_account(self, address, balance, nonce, code_hash=None, storage_root=None):
+        """Saves an account."""
+        with self.lock:
+            self.cursor.execute(
+                """
+                INSERT OR REPLACE INTO accounts (
+                    address, balance, nonce, code_hash, storage_root
+                ) VALUES (?, ?, ?, ?, ?)
+                """,
+                (address, balance, nonce, code_hash, storage_root)
+            )
+            self._commit()
+
+    def get_account(self, address):
+        """Retrieves an account by address."""
+        return self._fetch_one("SELECT * FROM accounts WHERE address=?", (address,))
+
+    def save_state_node(self, state_root, account_address, storage_root=None):
+        """Saves a state node keyed by its root."""
+        with self.lock:
+            self.cursor.execute(
+                "INSERT OR REPLACE INTO state (state_root, account_address, storage_root) VALUES (?, ?, ?)",
+                (state_root, account_address, storage_root)
+            )
+            self._commit()
+
+    def get_state_node(self, state_root):
+        """Retrieves a state node by root."""
+        return self._fetch_one("SELECT * FROM state WHERE state_root=?", (state_root,))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class FlatFileStorageEngine(StorageEngine):
+    """
+    Append-only flat-file engine.
+
+    Blocks are appended to blocks.dat as length-prefixed JSON records. The
+    file blocks.idx holds one fixed-size (offset, length) slot per block
+    number and is memory-mapped, so reading block N is one slot lookup and
+    one slice of the memory-mapped data file. Accounts, state nodes and
+    transactions saved apart from their block record are kept as
+    append-only JSON-line logs and replayed into memory on open.
+    Rollbacks append tombstones ('!' lines, or an empty block record) that
+    drop everything above a height when the logs are replayed.
+    """
+
+    RECORD_HEADER = struct.Struct('<IQ128s')  # payload length, block number, block hash
+    INDEX_SLOT = struct.Struct('<QI')  # record offset, payload length
+    INDEX_GROWTH = 65536  # Slots added each time the index file grows
+
+    def __init__(self, data_directory):
+        self.lock = threading.RLock()
+        self.blocks_path = os.path.join(data_directory, 'blocks.dat')
+        self.index_path = os.path.join(data_directory, 'blocks.idx')
+        self.txindex_path = os.path.join(data_directory, 'txindex.dat')
+        self.accounts_path = os.path.join(data_directory, 'accounts.dat')
+        self.state_path = os.path.join(data_directory, 'state.dat')
+        self.balances_path = os.path.join(data_directory, 'balances.dat')
+        self.transactions_path = os.path.join(data_directory, 'transactions.dat')
+
+        for path in (self.blocks_path, self.index_path, self.txindex_path, self.accounts_path, self.state_path,
+                     self.balances_path, self.transactions_path):
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+
+        self.blocks_file = open(self.blocks_path, 'ab')
+        self.index_file = open(self.index_path, 'r+b')
+        self.txindex_file = open(self.txindex_path, 'a')
+        self.accounts_file = open(self.accounts_path, 'a')
+        self.state_file = open(self.state_path, 'a')
+        self.balances_file = open(self.balances_path, 'a')
+        self.transactions_file = open(self.transactions_path, 'a')
+
+        self.data_map = None
+        self.index_map = None
+        self.block_numbers = {}  # block_hash -> block_number
+        self.tx_locations = {}  # tx_hash -> (block_number, transaction_index)
+        self.loose_transactions = {}  # tx_hash -> transaction not stored inside a block record
+        self._load_loose_transactions()
+        self.accounts = self._load_log(self.accounts_path, 'address')
+        self.state_nodes = self._load_log(self.state_path, 'state_root')
+        self.balance_history = {}  # address -> ([block_number, ...], [balance, ...])
+        self._load_balances()
+        self.height = 0
+        self.batching = False
+
+        self._map_index()
+        self._load_indexes()
+
+    @staticmethod
+    def _load_log(path, key):
+        records = {}
+        with open(path, 'r') as log:
+            for line in log:
+                if line.strip():
+                    record = json.loads(line)
+                    records[record[key]] = record
+        return records
+
+    def _load_balances(self):
+        with open(self.balances_path, 'r') as log:
+            for line in log:
+                parts = line.split()
+                if len(parts) == 2 and parts[0] == '!':
+                    self._truncate_balances(int(parts[1]))
+                elif len(parts) == 4:
+                    self._record_balance(parts[0], int(parts[1]), json.loads(parts[3]))
+
+    def _load_loose_transactions(self):
+        with open(self.transactions_path, 'r') as log:
+            for line in log:
+                if line.startswith('!'):
+                    self._truncate_loose_transactions(int(line.split()[1]))
+                elif line.strip():
+                    transaction = json.loads(line)
+                    self.loose_transactions[transaction['tx_hash']] = transaction
+
+    def _truncate_loose_transactions(self, block_number):
+        self.loose_transactions = {
+            tx_hash: tx for tx_hash, tx in self.loose_transactions.items() if (tx.get('block_number') or 0) <= block_number
+        }
+
+    def _record_balance(self, address, block_number, balance):
+        numbers, balances = self.balance_history.setdefault(address, ([], []))
+        position = bisect.bisect_left(numbers, block_number)
+        if position < len(numbers) and numbers[position] == block_number:
+            balances[position] = balance
+        else:
+            numbers.insert(position, block_number)
+            balances.insert(position, balance)
+
+    def _truncate_balances(self, block_number):
+        for numbers, balances in self.balance_history.values():
+            keep = bisect.bisect_right(numbers, block_number)
+            del numbers[keep:]
+            del balances[keep:]
+
+    def _truncate_indexes(self, block_number):
+        for height in range(block_number + 1, self.height + 1):
+            self.INDEX_SLOT.pack_into(self.index_map, height * self.INDEX_SLOT.size, 0, 0)
+        self.block_numbers = {h: n for h, n in self.block_numbers.items() if n <= block_number}
+        self.height = min(self.height, block_number)
+
+    def _truncate_transactions(self, block_number):
+        self.tx_locations = {h: loc for h, loc in self.tx_locations.items() if loc[0] <= block_number}
+
+    def _map_index(self, min_slots=0):
+        """Map the index file, growing it if it cannot hold `min_slots` slots."""
+        size = os.path.getsize(self.index_path)
+        required = (min_slots + 1) * self.INDEX_SLOT.size
+        if size < required:
+            slots = max(min_slots + 1, size // self.INDEX_SLOT.size) + self.INDEX_GROWTH
+            if self.index_map is not None:
+                self.index_map.close()
+                self.index_map = None
+            self.index_file.truncate(slots * self.INDEX_SLOT.size)
+        if self.index_map is None:
+            self.index_map = mmap.mmap(self.index_file.fileno(), 0)
+
+    def _map_data(self, end):
+        """Make sure the data map covers the file up to `end`."""
+        if self.data_map is None or len(self.data_map) < end:
+            # The previous map is left for the garbage collector, since
+            # callers may still hold memoryviews into it.
+            self.blocks_file.flush()
+            with open(self.blocks_path, 'rb') as data_file:
+                self.data_map = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _load_indexes(self):
+        """Rebuild the hash and height lookups from the record headers."""
+        data_size = os.path.getsize(self.blocks_path)
+        if data_size:
+            self._map_data(data_size)
+            offset = 0
+            while offset + self.RECORD_HEADER.size <= data_size:
+                length, block_number, raw_hash = self.RECORD_HEADER.unpack_from(self.data_map, offset)
+                if not length:
+                    self._truncate_indexes(block_number)
+                    offset += self.RECORD_HEADER.size
+                    continue
+                self.block_numbers[raw_hash.rstrip(b'\0').decode('ascii')] = block_number
+                self._map_index(block_number)
+                self.INDEX_SLOT.pack_into(self.index_map, block_number * self.INDEX_SLOT.size, offset, length)
+                self.height = max(self.height, block_number)
+                offset += self.RECORD_HEADER.size + length
+
+        with open(self.txindex_path, 'r') as txindex:
+            for line in txindex:
+                parts = line.split()
+                if len(parts) == 2 and parts[0] == '!':
+                    self._truncate_transactions(int(parts[1]))
+                elif len(parts) == 3:
+                    self.tx_locations[parts[0]] = (int(parts[1]), int(parts[2]))
+
+    def _slot(self, block_number):
+        if block_number <= 0 or block_number > self.height:
+            return None
+        offset, length = self.INDEX_SLOT.unpack_from(self.index_map, block_number * self.INDEX_SLOT.size)
+        return (offset, length) if length else None
+
+    def get_block_raw(self, block_number):
+        """Returns a memoryview over the serialized block without copying it."""
+        with self.lock:
+            slot = self._slot(block_number)
+            if slot is None:
+                return None
+            offset, length = slot
+            start = offset + self.RECORD_HEADER.size
+            self._map_data(start + length)
+            return memoryview(self.data_map)[start:start + length]
+
+    def save_block(self, block_hash, block_data):
+        """Appends a block record and points its height slot at it."""
+        payload = json.dumps(block_data).encode('utf-8')
+        block_number = block_data['block_number']
+        with self.lock:
+            offset = self.blocks_file.tell()
+            self.blocks_file.write(self.RECORD_HEADER.pack(len(payload), block_number, block_hash.encode('ascii')))
+            self.blocks_file.write(payload)
+
+            self._map_index(block_number)
+            self.INDEX_SLOT.pack_into(self.index_map, block_number * self.INDEX_SLOT.size, offset, len(payload))
+            self.block_numbers[block_hash] = block_number
+            self.height = max(self.height, block_number)
+
+            for index, transaction in enumerate(block_data.get('transactions', [])):
+                tx_hash = transaction.get('tx_hash')
+                if tx_hash:
+                    self.tx_locations[tx_hash] = (block_number, index)
+                    self.txindex_file.write(f"{tx_hash} {block_number} {index}\n")
+            self._flush()
+
+    def truncate(self, block_number):
+        with self.lock:
+            self.blocks_file.write(self.RECORD_HEADER.pack(0, block_number, b''))
+            self.txindex_file.write(f"! {block_number}\n")
+            self.balances_file.write(f"! {block_number}\n")
+            self.transactions_file.write(f"! {block_number}\n")
+            self._truncate_indexes(block_number)
+            self._truncate_transactions(block_number)
+            self._truncate_balances(block_number)
+            self._truncate_loose_transactions(block_number)
+            self.balances_file.flush()
+            self._flush()
+
+    def _flush(self):
+        if not self.batching:
+            self.blocks_file.flush()
+            self.txindex_file.flush()
+            self.transactions_file.flush()
+
+    def begin_batch(self):
+        """Buffer appends until end_batch instead of flushing each block."""
+        with self.lock:
+            self.batching = True
+
+    def end_batch(self):
+        with self.lock:
+            self.batching = False
+            self.commit()
+
+    def commit(self):
+        with self.lock:
+            self.blocks_file.flush()
+            self.txindex_file.flush()
+            self.balances_file.flush()
+            self.transactions_file.flush()
+            os.fsync(self.blocks_file.fileno())
+            self.index_map.flush()
+
+    def get_block(self, block_hash):
+        block_number = self.block_numbers.get(block_hash)
+        if block_number is None:
+            return None
+        block = self.get_block_by_number(block_number)
+        return block if block and block.get('block_hash', block_hash) == block_hash else None
+
+    def get_block_by_number(self, block_number):
+        raw = self.get_block_raw(block_number)
+        return json.loads(bytes(raw)) if raw is not None else None
+
+    def get_last_block(self):
+        return self.get_block_by_number(self.height)
+
+    def save_transaction(self, transaction):
+        """Transactions stored inside their block record only need indexing; others go to the transaction log."""
+        with self.lock:
+            if transaction['tx_hash'] in self.tx_locations:
+                return
+            self.loose_transactions[transaction['tx_hash']] = transaction
+            self.transactions_file.write(json.dumps(transaction) + "\n")
+            self._flush()
+
+    def get_transaction(self, tx_hash):
+        location = self.tx_locations.get(tx_hash)
+        if location is None:
+            return self.loose_transactions.get(tx_hash)
+        block = self.get_block_by_number(location[0])
+        if not block or location[1] >= len(block.get('transactions', [])):
+            return None
+        return block['transactions'][location[1]]
+
+    def get_block_transactions(self, block_hash):
+        block = self.get_block(block_hash)
+        if not block:
+            return []
+        transactions = list(block.get('transactions', []))
+        transactions.extend(tx for tx in self.loose_transactions.values() if tx.get('block_hash') == block_hash)
+        return transactions
+
+    def save_balance_deltas(self, block_number, deltas):
+        with self.lock:
+            for address, delta in deltas.items():
+                previous = self.get_balance_at(address, block_number - 1) or 0
+                self._record_balance(address, block_number, previous + delta)
+                self.balances_file.write(f"{address} {block_number} {json.dumps(delta)} {json.dumps(previous + delta)}\n")
+            if not self.batching:
+                self.balances_file.flush()
+
+    def get_balance_at(self, address, block_number):
+        history = self.balance_history.get(address)
+        if not history:
+            return None
+        position = bisect.bisect_right(history[0], block_number)
+        return history[1][position - 1] if position else None
+
+    def has_balance_deltas(self):
+        return any(numbers for numbers, _ in self.balance_history.values())
+
+    def get_balances(self):
+        with self.lock:
+            return {address: balances[-1] for address, (_, balances) in self.balance_history.items() if balances}
+
+    def save_account(self, address, balance, nonce, code_hash=None, storage_root=None):
+        record = {'address': address, 'balance': balance, 'nonce': nonce,
+                  'code_hash': code_hash, 'storage_root': storage_root}
+        with self.lock:
+            self.accounts[address] = record
+            self.accounts_file.write(json.dumps(record) + "\n")
+            self.accounts_file.flush()
+
+    def get_account(self, address):
+        return self.accounts.get(address)
+
+    def save_state_node(self, state_root, account_address, storage_root=None):
+        record = {'state_root': state_root, 'account_address': account_address, 'storage_root': storage_root}
+        with self.lock:
+            self.state_nodes[state_root] = record
+            self.state_file.write(json.dumps(record) + "\n")
+            self.state_file.flush()
+
+    def get_state_node(self, state_root):
+        return self.state_nodes.get(state_root)
+
+    def close(self):
+        with self.lock:
+            for handle in (self.data_map, self.index_map):
+                if handle is not None:
+                    handle.close()
+            for handle in (self.blocks_file, self.index_file, self.txindex_file, self.accounts_file, self.state_file,
+                           self.balances_file, self.transactions_file):
+                handle.close()
+
+
+STORAGE_ENGINES = {
+    'sqlite': SQLiteStorageEngine,
+    'flatfile': FlatFileStorageEngine,
+}
+
+def create_storage_engine(name, data_directory):
+    """Instantiate the storage engine registered under `name`."""
+    if name not in STORAGE_ENGINES:
+        raise ValueError(f"Unknown storage engine: {name}")
+    return STORAGE_ENGINES[name](data_directory)
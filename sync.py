@@ -0,0 +1,376 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Headers-first chain synchronization. Headers are downloaded from each
+# peer in ranges and compared with the best header chain found so far;
+# headers it does not have are verified (linkage, recomputed hash and
+# required difficulty) across a process pool, so only the suffix after
+# the fork point is checked. Headers verified in earlier rounds or from
+# other peers are remembered and only checked for linkage. Only the best
+# header chain has its block bodies fetched. Bodies are downloaded in
+# chunks from every peer that has them, and committed in height order as
+# chunks complete.
+
+import hashlib
+import os
+import queue
+import time
+import logging
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from cryptography import Qhash3512
+from parameters import parameters
+from blocktree import header_work
+from gossip import SeenCache
+from pow import block_hash, header_data
+from protocol import ProtocolError
+
+def verify_header_chunk(headers, previous_hash, difficulties):
+    """
+    Verifies that `headers` link to each other, starting from `previous_hash`,
+    that every hash recomputes from its header, and that every header carries
+    the difficulty required of it (`difficulties`, in the same order) and
+    meets it. Runs in worker processes. Returns the offset of the first
+    invalid header, or None.
+    """
+    for offset, (header, difficulty) in enumerate(zip(headers, difficulties)):
+        if header['parent_hash'] != previous_hash or block_hash(header) != header['block_hash']:
+            return offset
+        # Genesis blocks (parent hash '1') carry no proof of work
+        if header['parent_hash'] != '1' and (header['difficulty'] != difficulty or not Qhash3512.is_valid_hash(header['block_hash'], difficulty)):
+            return offset
+        previous_hash = header['block_hash']
+    return None
+
+def header_digest(header):
+    """Cheap digest of every field a header's hash covers, to recognise a header verified before."""
+    return hashlib.blake2b(f"{header_data(header)}{header['nonce']}".encode('utf-8'), digest_size=16).digest()
+
+class SyncManager:
+    def __init__(self, blockchain, p2p_network):
+        self.blockchain = blockchain
+        self.p2p_network = p2p_network
+        self.chunk_size = parameters['verify_chunk_size']
+        self.workers = parameters['cpu_count'] or os.cpu_count()
+        self.pool = None  # Header verification processes, started when first needed and kept across rounds
+        self.verified = SeenCache(parameters['validation_cache_size'])  # block_hash -> header_digest of headers that passed verification
+
+    def verify_pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self.pool
+
+    def find_common_height(self, peer_id):
+        """
+        Returns the height of the last block we share with a peer. Steps
+        back from our tip in growing steps until a shared block is found,
+        then binary-searches the fork point between it and the last height
+        found to differ.
+        """
+        chain = self.blockchain.chain
+
+        def shared(height):
+            response = self.p2p_network.request(peer_id, {'type': 'get_headers', 'from_height': height, 'count': 1})
+            headers = response.get('headers', [])
+            return bool(headers) and headers[0]['block_hash'] == chain.get_header(height - 1)['block_hash']
+
+        low, high = 0, len(chain) + 1  # low is shared, high is not (or past our tip)
+        height = len(chain)
+        step = 1
+        while height > 0:
+            if shared(height):
+                low = height
+                break
+            high = height
+            height = max(height - step, 0)
+            step *= 2
+        while high - low > 1:
+            middle = (low + high) // 2
+            if shared(middle):
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def was_verified(self, header):
+        return self.verified.get(header['block_hash']) == header_digest(header)
+
+    def verify_chunk(self, chunk, previous_hash, difficulties):
+        """
+        Starts verifying a chunk of headers. A chunk made only of headers
+        verified before is checked for linkage here; any other chunk goes
+        to the process pool. Returns a future of verify_header_chunk's result.
+        """
+        if not all(self.was_verified(header) for header in chunk):
+            return self.verify_pool().submit(verify_header_chunk, chunk, previous_hash, difficulties)
+        result = Future()
+        for offset, header in enumerate(chunk):
+            if header['parent_hash'] != previous_hash:
+                result.set_result(offset)
+                return result
+            previous_hash = header['block_hash']
+        result.set_result(None)
+        return result
+
+    def header_at(self, best, block_number):
+        """Header at `block_number` on the best candidate chain, or on our own chain while there is none."""
+        if best is None or block_number <= best['common_height']:
+            return self.blockchain.chain.get_header(block_number - 1)
+        return best['headers'][block_number - best['common_height'] - 1]
+
+    def hash_at(self, best, block_number):
+        """Block hash at `block_number` on the best candidate chain, or None past its tip."""
+        tip = best['headers'][-1]['block_number'] if best else len(self.blockchain.chain)
+        if not 0 < block_number <= tip:
+            return None
+        return self.header_at(best, block_number)['block_hash']
+
+    def download_headers(self, peer_id, best=None):
+        """
+        Streams a peer's headers after our common block and compares them
+        with the best candidate chain so far. Headers the best candidate
+        already has are dropped as they arrive; from the first one that
+        differs, the peer's headers are kept and verified in the process
+        pool while the next range is being fetched.
+        Returns (matched_height, candidate), where matched_height is the
+        last height at which the peer agrees with `best` and candidate is
+        {'common_height', 'headers'} if the peer's chain goes beyond that,
+        or None if the peer sent invalid headers.
+        """
+        chain = self.blockchain.chain
+        common_height = self.find_common_height(peer_id)
+        # Below its common height with us, the peer agrees with `best` as far as `best` follows our chain
+        matched = min(common_height, best['common_height']) if best else common_height
+        previous_hash = chain.get_header(common_height - 1)['block_hash'] if common_height else '1'
+        last_number = common_height
+        headers = []  # The peer's headers from the first one `best` does not have
+        submitted = 0  # Headers handed to the pool so far
+        checks = []
+
+        def ancestor(block_number):
+            if headers and block_number >= headers[0]['block_number']:
+                return headers[block_number - headers[0]['block_number']]
+            if block_number <= common_height:
+                return chain.get_header(block_number - 1)
+            return self.header_at(best, block_number)
+
+        for batch in self.p2p_network.stream_range(peer_id, 'get_headers', common_height + 1):
+            for header in batch:
+                last_number += 1
+                if header['block_number'] != last_number:
+                    logging.warning(f"Peer {peer_id} sent header {header['block_number']} in place of {last_number}")
+                    return None
+                if not headers and header['parent_hash'] == previous_hash and self.hash_at(best, last_number) == header['block_hash']:
+                    matched, previous_hash = last_number, header['block_hash']
+                    continue
+                headers.append(header)
+
+            for chunk_start in range(submitted, len(headers), self.chunk_size):
+                chunk = headers[chunk_start:chunk_start + self.chunk_size]
+                difficulties = [self.blockchain.difficulty.required_at(header['block_number'], ancestor) for header in chunk]
+                chunk_previous = headers[chunk_start - 1]['block_hash'] if chunk_start else previous_hash
+                checks.append((chunk, self.verify_chunk(chunk, chunk_previous, difficulties)))
+            submitted = len(headers)
+
+        for chunk, check in checks:
+            invalid = check.result()
+            for header in chunk[:invalid]:
+                self.verified.add(header['block_hash'], header_digest(header))
+            if invalid is not None:
+                logging.warning(f"Peer {peer_id} sent an invalid header at height {chunk[invalid]['block_number']}")
+                return None
+        if not headers:
+            return matched, None
+
+        # The candidate starts with the part of `best` it shares, minus the blocks we already have
+        shared = [self.header_at(best, number) for number in range(common_height + 1, matched + 1)]
+        while shared and shared[0]['block_number'] <= len(chain) and chain.get_header(common_height)['block_hash'] == shared[0]['block_hash']:
+            shared.pop(0)
+            common_height += 1
+        return matched, {'common_height': common_height, 'headers': shared + headers}
+
+    def local_work(self, common_height):
+        """Work of our blocks above `common_height`."""
+        chain = self.blockchain.chain
+        return sum(header_work(chain.get_header(i)) for i in range(common_height, len(chain)))
+
+    def extra_work(self, candidate):
+        """Work of a candidate header chain beyond our own chain."""
+        return sum(header_work(header) for header in candidate['headers']) - self.local_work(candidate['common_height'])
+
+    def blocks_match(self, headers, offset, blocks):
+        """
+        Checks blocks received for `headers[offset:]` against those headers,
+        with the checks receive_block applies to a peer's block. The headers
+        were verified, so each block must hash to its header's hash.
+        """
+        if len(blocks) > len(headers) - offset:
+            return False
+        for index, block in enumerate(blocks):
+            header = headers[offset + index]
+            if block['block_hash'] != header['block_hash'] or not self.blockchain.check_block(block):
+                return False
+        return True
+
+    def download_bodies(self, headers, served):
+        """
+        Downloads the blocks for `headers` in chunks of max_blocks_per_request
+        from several peers at once. `served` maps each peer to the last height
+        at which its chain agrees with `headers`; a chunk is only asked from
+        peers whose chain contains it. Up to `download_window` chunks are outstanding, at
+        most `stream_window` per peer. Chunks from peers that time out or send
+        wrong blocks are reassigned and the peer is not used again this round.
+        Yields batches of blocks strictly in height order.
+        """
+        chunk_size = parameters['max_blocks_per_request']
+        first_height = headers[0]['block_number']
+        # Chunks are (start, end) offsets into `headers`
+        waiting = deque((start, min(start + chunk_size, len(headers))) for start in range(0, len(headers), chunk_size))
+        in_flight = {}  # request_id -> (chunk, peer_id, deadline)
+        completed = {}  # offset -> blocks
+        load = {peer_id: 0 for peer_id in served}
+        completions = queue.Queue()
+        next_offset = 0
+
+        def pick_peer(chunk):
+            last = headers[chunk[1] - 1]
+            eligible = [
+                peer_id for peer_id, height in served.items()
+                if peer_id in load and load[peer_id] < parameters['stream_window']
+                and height >= last['block_number']
+            ]
+            return min(eligible, key=load.get) if eligible else None
+
+        def drop_peer(peer_id, reason):
+            logging.warning(f"Not downloading from peer {peer_id} for the rest of this sync: {reason}")
+            load.pop(peer_id, None)
+
+        try:
+            while next_offset < len(headers):
+                while waiting and len(in_flight) < parameters['download_window']:
+                    peer_id = pick_peer(waiting[0])
+                    if peer_id is None:
+                        break
+                    chunk = waiting.popleft()
+                    try:
+                        pending = self.p2p_network.start_request(peer_id, {
+                            'type': 'get_blocks', 'from_height': first_height + chunk[0], 'count': chunk[1] - chunk[0]
+                        }, notify=completions)
+                    except ConnectionError as e:
+                        drop_peer(peer_id, e)
+                        waiting.appendleft(chunk)
+                        continue
+                    in_flight[pending['id']] = (chunk, peer_id, time.monotonic() + parameters['request_timeout'])
+                    load[peer_id] += 1
+                if not in_flight:
+                    raise ValueError(f"No peer left to serve blocks from height {first_height + next_offset}")
+
+                timeout = min(deadline for _, _, deadline in in_flight.values()) - time.monotonic()
+                try:
+                    pending = completions.get(timeout=max(timeout, 0))
+                except queue.Empty:
+                    pending = None
+
+                if pending is not None and pending['id'] in in_flight:
+                    (start, end), peer_id, _ = in_flight.pop(pending['id'])
+                    self.p2p_network.pending_requests.pop(pending['id'], None)
+                    if peer_id in load:
+                        load[peer_id] -= 1
+                    blocks = pending['response'].get('blocks', [])[:end - start]
+                    if blocks and self.blocks_match(headers, start, blocks):
+                        completed[start] = blocks
+                        if start + len(blocks) < end:
+                            # The peer serves smaller batches; the rest becomes a chunk of its own
+                            waiting.appendleft((start + len(blocks), end))
+                    else:
+                        drop_peer(peer_id, "sent blocks that do not match the headers")
+                        waiting.appendleft((start, end))
+
+                now = time.monotonic()
+                for request_id, (chunk, peer_id, deadline) in list(in_flight.items()):
+                    if deadline <= now:
+                        del in_flight[request_id]
+                        self.p2p_network.pending_requests.pop(request_id, None)
+                        drop_peer(peer_id, f"get_blocks from height {first_height + chunk[0]} timed out")
+                        waiting.appendleft(chunk)
+
+                while next_offset in completed:
+                    batch = completed.pop(next_offset)
+                    next_offset += len(batch)
+                    yield batch
+        finally:
+            for request_id in in_flight:
+                self.p2p_network.pending_requests.pop(request_id, None)
+
+    def sync(self):
+        """Runs one headers-first sync round against all connected peers."""
+        if not self.p2p_network.peers:
+            return 0
+
+        # Only the best header chain is kept; every other peer is remembered
+        # by how far its chain agrees with it.
+        best = None  # {'peer_id', 'common_height', 'headers', 'work'}
+        served = {}  # peer_id -> last height at which the peer's chain agrees with best
+        for peer_id in list(self.p2p_network.peers):
+            try:
+                result = self.download_headers(peer_id, best)
+            except Exception as e:
+                logging.warning(f"Header sync with peer {peer_id} failed: {e}")
+                continue
+            if result is None:
+                continue
+            matched, candidate = result
+            served[peer_id] = matched
+            if candidate is None:
+                continue
+            work = self.extra_work(candidate)
+            if work > (best['work'] if best else 0):
+                best = dict(candidate, peer_id=peer_id, work=work)
+                served = {peer: min(height, matched) for peer, height in served.items()}
+                served[peer_id] = candidate['headers'][-1]['block_number']
+
+        if best is None:
+            return 0
+
+        peer_id, common_height, headers = best['peer_id'], best['common_height'], best['headers']
+        if len(self.blockchain.chain) - common_height > parameters['max_reorg_depth']:
+            logging.warning(f"Best chain from {peer_id} forks at height {common_height}, deeper than max_reorg_depth; ignoring it.")
+            return 0
+
+        # Blocks of a fork are held back until they outweigh the blocks they
+        # replace (at most max_reorg_depth of them); after that every batch is
+        # committed as soon as it arrives. Blocks mined or received while the
+        # download runs can leave a batch no longer extending the tip; the
+        # round then stops and the next one starts from the new chain.
+        held, held_work = [], 0
+        synced = 0
+        bodies = self.download_bodies(headers, served)
+        try:
+            for batch in bodies:
+                if synced:
+                    self.blockchain.add_blocks(batch)
+                    synced += len(batch)
+                    continue
+                held.extend(batch)
+                held_work += sum(header_work(block) for block in batch)
+                with self.blockchain.lock:
+                    if held_work <= self.local_work(common_height):
+                        continue
+                    if common_height < len(self.blockchain.chain):
+                        self.blockchain.reorganize(common_height, held)
+                    else:
+                        self.blockchain.add_blocks(held)
+                synced, held = len(held), []
+        except (ValueError, ProtocolError) as e:
+            logging.warning(f"Stopping sync with {peer_id}: {e}")
+        finally:
+            bodies.close()
+
+        logging.info(f"→ Synced {synced} blocks from {len(served)} peers (Height: {len(self.blockchain.chain)})")
+        return synced
@@ -0,0 +1,105 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Shared fixtures. The node's modules live at the top of the repository,
+# so it is put on the import path before they are imported.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from parameters import parameters
+from pow import MineH, header_data
+
+SYSTEM_ACCOUNT = parameters['system_account']
+REWARD = parameters['block_reward']
+
+def make_transaction(block_number, index, sender, recipient, value, fee=0, block_hash=None):
+    return {
+        'tx_hash': f"tx-{block_number}-{index}",
+        'block_hash': block_hash or f"block-{block_number}",
+        'block_number': block_number,
+        'transaction_index': index,
+        'sender': sender,
+        'recipient': recipient,
+        'value': value,
+        'size': 0,
+        'fee': fee,
+        'nonce': 0,
+        'input': '',
+        'timestamp': float(block_number),
+        'text': '',
+        'token': None,
+        'nft': None,
+    }
+
+def make_block(block_number, transactions=(), miner='miner', difficulty=None, timestamp=None, parent_hash=None):
+    block_hash = f"block-{block_number}"
+    transactions = [dict(tx, block_hash=block_hash, block_number=block_number, transaction_index=index)
+                    for index, tx in enumerate(transactions)]
+    return {
+        'block_hash': block_hash,
+        'block_number': block_number,
+        'parent_hash': parent_hash or (f"block-{block_number - 1}" if block_number > 1 else '1'),
+        'state_root': '',
+        'tx_root': None,
+        'difficulty': difficulty or parameters['initial_difficulty'],
+        'nonce': 0,
+        'timestamp': float(timestamp if timestamp is not None else block_number * 15),
+        'miner': miner,
+        'block_size': 0,
+        'transaction_count': len(transactions),
+        'transactions': transactions,
+    }
+
+@pytest.fixture
+def data_directory(tmp_path, monkeypatch):
+    monkeypatch.setitem(parameters, 'data_directory', str(tmp_path))
+    return tmp_path
+
+@pytest.fixture
+def blockchain(data_directory, monkeypatch):
+    """A node on a fresh data directory, holding only its genesis block."""
+    import node
+    monkeypatch.setattr(node.time, 'sleep', lambda seconds: None)
+    blockchain = node.Blockchain()
+    yield blockchain
+    blockchain.db.close()
+
+def reward(blockchain, recipient, block_number):
+    transaction = {
+        'sender': parameters['system_account'], 'recipient': recipient, 'value': REWARD,
+        'size': 0, 'fee': 0, 'nonce': 0, 'input': '', 'text': '', 'token': None, 'nft': None,
+        'timestamp': float(block_number),
+    }
+    transaction['tx_hash'] = blockchain.hash_transaction(transaction)
+    return transaction
+
+def mine_child(blockchain, parent, transactions=(), miner='miner', difficulty=None, timestamp=None):
+    """Mines a block on `parent`, which need not be the chain tip."""
+    transactions = [dict(transaction) for transaction in transactions]
+    block = {
+        'block_number': parent['block_number'] + 1,
+        'parent_hash': parent['block_hash'],
+        'state_root': '',
+        'tx_root': blockchain.calculate_merkle_root(transactions),
+        'difficulty': difficulty or parameters['initial_difficulty'],
+        'nonce': 0,
+        'timestamp': timestamp if timestamp is not None else parent['timestamp'] + 15,
+        'miner': miner,
+        'block_size': 0,
+        'transaction_count': len(transactions),
+        'transactions': transactions,
+    }
+    block['nonce'], block['block_hash'] = MineH().mine(header_data(block), block['difficulty'])
+    for index, transaction in enumerate(transactions):
+        transaction.update(block_hash=block['block_hash'], block_number=block['block_number'], transaction_index=index)
+    return block
@@ -0,0 +1,81 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# REST endpoints, served by the Flask test client on a fresh node.
+
+import json
+import pytest
+from api import create_app
+from api.pagination import parse_position
+from wallet import Wallet
+
+@pytest.fixture
+def client(blockchain):
+    return create_app(blockchain, blockchain.miner).test_client()
+
+def save_wallets(addresses):
+    wallet = Wallet()
+    for address in addresses:
+        wallet.save_wallet({'public_key': address, 'private_key': 'encrypted'})
+
+def test_parse_position():
+    assert parse_position('1200,3', 2) == (1200, 3)
+    for value in ('1200', '1200,x', '1,2,3'):
+        with pytest.raises(ValueError):
+            parse_position(value, 2)
+
+def test_accounts_list_pages_without_passwords(client, blockchain):
+    addresses = [f"{prefix}{'0' * 32}" for prefix in ('cccccccc', 'aaaaaaaa', 'dddddddd', 'bbbbbbbb')]
+    save_wallets(addresses)
+    blockchain.state.apply_deltas({addresses[0]: 7})
+
+    first = client.get('/accounts/list?limit=3').get_json()
+    assert [account['address'] for account in first['accounts']] == sorted(addresses)[:3]
+    assert first['next'] == sorted(addresses)[2]
+    rest = client.get(f"/accounts/list?limit=3&after={first['next']}").get_json()
+    assert rest == {'accounts': [{'address': sorted(addresses)[3], 'balance': 0}], 'next': None}
+    assert {'address': addresses[0], 'balance': 7} in first['accounts']
+
+def test_accounts_list_streams_ndjson(client):
+    save_wallets([f"{prefix}{'0' * 32}" for prefix in ('aaaaaaaa', 'bbbbbbbb')])
+    response = client.get('/accounts/list?format=ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    assert [json.loads(line)['address'][:8] for line in response.get_data(as_text=True).splitlines()] == ['aaaaaaaa', 'bbbbbbbb']
+
+def test_list_rejects_bad_limit(client):
+    assert client.get('/accounts/list?limit=0').status_code == 400
+    assert client.get('/accounts/list?limit=x').status_code == 400
+
+def test_historical_balance_heights(client, blockchain):
+    address = 'a' * 40
+    assert client.get(f'/accounts/balance/{address}?at=1').get_json() == {'address': address, 'balance': 0, 'at': 1}
+    assert client.get(f'/accounts/balance/{address}?at=2').status_code == 404  # Above the tip
+    assert client.get(f'/accounts/balance/{address}?at=-1').status_code == 400
+    assert client.get(f'/accounts/balance/{address}?at=x').status_code == 400
+
+def test_cached_responses_revalidate_until_the_next_block(client, blockchain):
+    first = client.get('/blockchain/info')
+    etag = first.headers['ETag']
+    assert first.get_json()['number_of_blocks'] == 1
+
+    unchanged = client.get('/blockchain/info', headers={'If-None-Match': etag})
+    assert unchanged.status_code == 304
+    assert unchanged.headers['ETag'] == etag
+    assert client.get('/blockchain/info', headers={'If-None-Match': '"other"'}).status_code == 200
+
+    blockchain.new_block(proof=0)
+    moved = client.get('/blockchain/info', headers={'If-None-Match': etag})
+    assert moved.status_code == 200
+    assert moved.get_json()['number_of_blocks'] == 2
+    assert moved.headers['ETag'] != etag
+
+def test_errors_are_not_cached(client, blockchain):
+    missing = client.get('/blockchain/block/1')
+    assert missing.status_code == 404
+    assert 'ETag' not in missing.headers
@@ -0,0 +1,64 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Fork choice by cumulative work and the orphan pool.
+
+from blocktree import BlockTree, OrphanPool, header_work
+from conftest import make_block
+
+def fork(block_number, parent_hash, name, difficulty=None):
+    return dict(make_block(block_number, parent_hash=parent_hash, difficulty=difficulty), block_hash=name)
+
+def canonical_tree(length, max_depth=100):
+    tree = BlockTree(max_depth)
+    tree.reset([make_block(number) for number in range(1, length + 1)])
+    return tree
+
+def test_longest_branch_of_equal_difficulty_wins():
+    tree = canonical_tree(3)
+    assert tree.best()['block_hash'] == 'block-3'
+    assert not tree.add(fork(3, 'block-2', 'side-3'))  # Ties keep the first tip seen
+    assert tree.add(fork(4, 'side-3', 'side-4'))
+    assert tree.best()['block_hash'] == 'side-4'
+
+def test_more_work_beats_more_blocks():
+    tree = canonical_tree(3)
+    heavy = fork(2, 'block-1', 'heavy-2', difficulty=3 * 10**8)
+    assert header_work(heavy) > 2 * header_work(make_block(2))
+    assert tree.add(heavy)
+    assert tree.best()['block_hash'] == 'heavy-2'
+
+def test_heavier_is_answered_without_adding():
+    tree = canonical_tree(3)
+    assert not tree.is_heavier(fork(3, 'block-2', 'side-3'))
+    assert tree.is_heavier(fork(4, 'block-3', 'block-4'))
+    assert 'block-4' not in tree and tree.best()['block_hash'] == 'block-3'
+
+def test_branch_returns_suffix_after_fork_point():
+    tree = canonical_tree(3)
+    tree.add(fork(3, 'block-2', 'side-3'))
+    tree.add(fork(4, 'side-3', 'side-4'))
+    canonical = {'block-1', 'block-2', 'block-3'}
+    fork_height, suffix = tree.branch('side-4', lambda block: block['block_hash'] in canonical)
+    assert fork_height == 2
+    assert [block['block_hash'] for block in suffix] == ['side-3', 'side-4']
+
+def test_blocks_below_max_depth_are_pruned():
+    tree = canonical_tree(10, max_depth=3)
+    assert 'block-7' in tree and 'block-6' not in tree
+
+def test_orphans_are_released_by_parent_and_bounded():
+    pool = OrphanPool(2)
+    pool.add(fork(5, 'block-4', 'a'))
+    pool.add(fork(5, 'block-4', 'b'))
+    pool.add(fork(6, 'a', 'c'))  # Evicts the oldest orphan
+    assert len(pool) == 2 and 'a' not in pool
+    assert [block['block_hash'] for block in pool.pop_children('block-4')] == ['b']
+    assert pool.pop_children('block-4') == []
+    assert 'c' in pool
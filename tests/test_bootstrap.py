@@ -0,0 +1,96 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Bootstrap export and import, with and without proof-of-work checks.
+
+import sys
+import pytest
+from collections import deque
+import bootstrap
+from bootstrap import export_chain, import_chain, validate_blocks
+from database import BlockchainDatabase
+from parameters import parameters
+from pow import MineH, header_data
+from conftest import make_block, make_transaction
+from pow import tx_root
+
+def hashed_chain(length, difficulty=None):
+    blocks = []
+    for number in range(1, length + 1):
+        block = make_block(number, [make_transaction(number, 0, 'system', 'A', 10)], difficulty=difficulty,
+                           parent_hash=blocks[-1]['block_hash'] if blocks else '1')
+        block['tx_root'] = tx_root(block['transactions'])
+        block['nonce'], block['block_hash'] = MineH().mine(header_data(block), block['difficulty'])
+        for transaction in block['transactions']:
+            transaction['block_hash'] = block['block_hash']
+        blocks.append(block)
+    return blocks
+
+def test_export_then_import_round_trips(data_directory, tmp_path, monkeypatch):
+    source = BlockchainDatabase()
+    source.save_blocks(hashed_chain(5))
+    path = tmp_path / 'chain.bootstrap'
+    assert export_chain(source, str(path)) == 5
+    source.close()
+
+    (tmp_path / 'copy').mkdir()
+    monkeypatch.setitem(parameters, 'data_directory', str(tmp_path / 'copy'))
+    target = BlockchainDatabase()
+    assert import_chain(target, str(path), batch_size=2, verify_pow=True) == 5
+    assert target.get_last_block()['block_number'] == 5
+    target.close()
+
+def test_verify_pow_rejects_forged_hash():
+    blocks = hashed_chain(3)
+    blocks[2]['block_hash'] = '0' * 128  # Meets any difficulty, but is not the block's hash
+    validate_blocks(blocks, deque())
+    with pytest.raises(ValueError, match="does not match its hash"):
+        validate_blocks(blocks, deque(), verify_pow=True)
+
+def test_blocks_must_link():
+    blocks = hashed_chain(3)
+    blocks[2]['parent_hash'] = 'elsewhere'
+    with pytest.raises(ValueError, match="does not link"):
+        validate_blocks(blocks, deque())
+
+def test_transactions_must_match_tx_root():
+    blocks = hashed_chain(3)
+    blocks[1]['transactions'][0]['recipient'] = 'B'  # The header and its hash are untouched
+    with pytest.raises(ValueError, match="does not match its tx_root"):
+        validate_blocks(blocks, deque())
+
+def test_verify_pow_requires_the_required_difficulty():
+    blocks = hashed_chain(3, difficulty=1)
+    validate_blocks(blocks, deque())
+    with pytest.raises(ValueError, match="required difficulty"):
+        validate_blocks(blocks, deque(), verify_pow=True)
+
+def test_invalid_file_leaves_no_partial_import(data_directory, tmp_path, monkeypatch):
+    source = BlockchainDatabase()
+    blocks = hashed_chain(5)
+    blocks[3]['transactions'][0]['value'] = 10**9
+    source.save_blocks(blocks)
+    path = tmp_path / 'chain.bootstrap'
+    export_chain(source, str(path))
+    source.close()
+
+    (tmp_path / 'copy').mkdir()
+    monkeypatch.setitem(parameters, 'data_directory', str(tmp_path / 'copy'))
+    target = BlockchainDatabase()
+    with pytest.raises(ValueError, match="Block 4"):
+        import_chain(target, str(path), batch_size=2)
+    assert target.get_last_block() is None
+    assert target.get_balances() == {}
+    target.close()
+
+def test_unknown_options_are_rejected(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['bootstrap.py', 'import', str(tmp_path / 'chain.bootstrap'), '--verify_pow'])
+    with pytest.raises(SystemExit):
+        bootstrap.main()
+    assert "unrecognized arguments: --verify_pow" in capsys.readouterr().err
@@ -0,0 +1,100 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# The bounded chain view over the database and its block cache.
+
+import pytest
+from chain import ChainView, LRUBlockCache
+from conftest import make_block, make_transaction
+from storage import create_storage_engine
+
+def chain(length):
+    return [make_block(n, [make_transaction(n, 0, 'alice', 'bob', n)]) for n in range(1, length + 1)]
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_storage_engine('sqlite', str(tmp_path))
+    for block in chain(6):
+        engine.save_block(block['block_hash'], block)
+        engine.save_transactions(block['transactions'])
+    yield engine
+    engine.close()
+
+def test_cache_evicts_least_recently_used_within_budget():
+    cache = LRUBlockCache(max_bytes=250)
+    for n in (1, 2):
+        cache.put({'block_number': n, 'block_size': 100})
+    cache.get(1)  # Block 2 is now the least recently used
+    cache.put({'block_number': 3, 'block_size': 100})
+    assert list(cache.blocks) == [1, 3]
+    assert cache.size == 200
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert cache.get(2) is None and cache.misses == 1
+
+def test_cache_keeps_a_block_larger_than_the_budget():
+    cache = LRUBlockCache(max_bytes=10)
+    cache.put({'block_number': 1, 'block_size': 100})
+    assert cache.get(1) is not None
+
+def test_window_holds_only_the_latest_headers(engine):
+    view = ChainView(engine, window=3, cache_bytes=10**6)
+    view.load()
+    assert len(view) == 6
+    assert [header['block_number'] for header in view.window] == [4, 5, 6]
+    assert all('transactions' not in header for header in view.window)
+    assert not view.cache.blocks  # Full blocks are only read on demand
+    assert view[0]['block_hash'] == 'block-1'  # Older blocks come from the database
+    assert view[-1]['transactions'][0]['tx_hash'] == 'tx-6-0'
+    assert [block['block_number'] for block in view[1:3]] == [2, 3]
+    with pytest.raises(IndexError):
+        view[6]
+
+def test_append_slides_the_window(engine):
+    view = ChainView(engine, window=3, cache_bytes=10**6)
+    view.load()
+    with pytest.raises(ValueError):
+        view.append(make_block(8))
+    view.append(make_block(7))
+    assert [header['block_number'] for header in view.window] == [5, 6, 7]
+    assert view.recent_headers(2) == [view.get_header(-2), view.get_header(-1)]
+
+def test_truncate_refills_the_window_from_the_database(engine):
+    view = ChainView(engine, window=3, cache_bytes=10**6)
+    view.load()
+    view.truncate(2)
+    assert len(view) == 2
+    assert [header['block_number'] for header in view.window] == [1, 2]
+    assert 5 not in view.cache.blocks
+
+def test_hashes_in_the_window_resolve_without_the_database(engine, monkeypatch):
+    view = ChainView(engine, window=3, cache_bytes=10**6)
+    view.load()
+    view.truncate(5)
+    view.append(make_block(6, [make_transaction(6, 0, 'alice', 'bob', 6)]))
+    monkeypatch.setattr(engine, 'get_block', lambda block_hash: pytest.fail("looked up in the database"))
+    monkeypatch.setattr(engine, 'get_transaction', lambda tx_hash: pytest.fail("looked up in the database"))
+    assert view.get_block_by_hash('block-5')['block_number'] == 5
+    assert view.get_transaction_by_hash('tx-6-0')['value'] == 6
+
+def test_hashes_below_the_window_resolve_through_the_database(engine):
+    view = ChainView(engine, window=3, cache_bytes=10**6)
+    view.load()
+    assert view.get_block_by_hash('block-2')['block_number'] == 2
+    assert view.get_transaction_by_hash('tx-1-0')['value'] == 1
+    assert view.get_block_by_hash('missing') is None
+    assert view.get_transaction_by_hash('missing') is None
+
+def test_blocks_cut_off_by_a_rollback_are_not_found(engine):
+    view = ChainView(engine, window=3, cache_bytes=10**6)
+    view.load()
+    view.truncate(4)  # Blocks 5 and 6 are still in the database
+    assert view.get_block_by_hash('block-6') is None
+    assert view.get_transaction_by_hash('tx-5-0') is None
+    assert 'block-5' not in view.block_numbers
+    assert view.get_block_by_hash('block-4')['block_number'] == 4
@@ -0,0 +1,62 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Compact blocks rebuilt from a transaction pool.
+
+import pytest
+from compact import BLOCK_ANNOTATIONS, PartialBlock, compact_block, short_transaction_id
+from conftest import SYSTEM_ACCOUNT, make_block, make_transaction
+
+def pending(transaction):
+    return {key: value for key, value in transaction.items() if key not in BLOCK_ANNOTATIONS}
+
+@pytest.fixture
+def block():
+    return make_block(7, [
+        make_transaction(7, 0, SYSTEM_ACCOUNT, 'miner', 100),
+        make_transaction(7, 1, 'A', 'B', 5, fee=1),
+        dict(make_transaction(7, 2, 'B', 'C', 2, fee=1), text='hello', size=5),
+    ])
+
+def test_block_is_rebuilt_from_pool(block):
+    pool = [pending(transaction) for transaction in block['transactions'][1:]]
+    partial = PartialBlock(compact_block(block), pool)
+    assert partial.missing() == []
+    assert partial.block()['transactions'] == block['transactions']
+
+def test_short_id_covers_fields_outside_tx_hash(block):
+    transaction = block['transactions'][2]
+    altered = dict(transaction, text='other', size=5)  # Same tx_hash
+    assert short_transaction_id(block['block_hash'], transaction) != short_transaction_id(block['block_hash'], altered)
+
+    partial = PartialBlock(compact_block(block), [pending(block['transactions'][1]), pending(altered)])
+    assert partial.missing() == [2]
+    with pytest.raises(ValueError):
+        partial.fill([2], [altered])
+    partial.fill([2], [pending(transaction)])
+    assert partial.block()['transactions'] == block['transactions']
+
+def test_transaction_count_must_match(block):
+    message = compact_block(block)
+    message['short_ids'].pop()
+    with pytest.raises(ValueError):
+        PartialBlock(message, [])
+
+def test_prefilled_transactions_take_their_annotations_from_the_header(block):
+    message = compact_block(block)
+    message['prefilled'][0]['transaction'] = dict(pending(message['prefilled'][0]['transaction']), block_number=1)
+    partial = PartialBlock(message, [pending(transaction) for transaction in block['transactions'][1:]])
+    assert partial.block()['transactions'][0] == block['transactions'][0]
+
+@pytest.mark.parametrize('index', [-1, 3, '0'])
+def test_prefilled_index_must_be_in_the_block(block, index):
+    message = compact_block(block)
+    message['prefilled'][0]['index'] = index
+    with pytest.raises(ValueError):
+        PartialBlock(message, [])
@@ -0,0 +1,53 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+import pytest
+from conftest import SYSTEM_ACCOUNT, make_block, make_transaction
+from database import BlockchainDatabase
+from storage import create_storage_engine
+
+@pytest.mark.parametrize('engine_name', ['sqlite', 'flatfile'])
+def test_balances_of_a_chain_stored_before_deltas(data_directory, engine_name):
+    # A block written by a version that did not record balance deltas
+    engine = create_storage_engine(engine_name, str(data_directory))
+    genesis = make_block(1, [make_transaction(1, 0, SYSTEM_ACCOUNT, 'A', 100)])
+    engine.save_block(genesis['block_hash'], genesis)
+    engine.save_transactions(genesis['transactions'])
+    engine.close()
+
+    db = BlockchainDatabase(engine_name)
+    try:
+        block = make_block(2, [make_transaction(2, 0, 'A', 'B', 10, fee=1)])
+        db.save_blocks([block])
+        assert db.get_balance_at('A', 2) == 89
+        assert db.get_balance_at('A', 1) == 100
+        assert db.get_balance_at('B', 2) == 10
+        assert db.get_balance_at('miner', 2) == 1
+        assert db.get_balance_at('A', 0) == 0
+    finally:
+        db.close()
+
+def test_balance_reads_do_not_write(data_directory):
+    db = BlockchainDatabase('sqlite')
+    try:
+        writes = []
+        db.engine.save_balance_deltas = lambda *args: writes.append(args)
+        db.engine.begin_batch = lambda: writes.append('batch')
+        assert db.get_balance_at('nobody', 5) == 0
+        assert writes == []
+    finally:
+        db.close()
+
+def test_block_balance_deltas():
+    block = make_block(3, [
+        make_transaction(3, 0, SYSTEM_ACCOUNT, 'miner', 50),
+        make_transaction(3, 1, 'A', 'B', 10, fee=2),
+        make_transaction(3, 2, 'B', 'A', 10),
+    ])
+    assert BlockchainDatabase.block_balance_deltas(block) == {'miner': 52, 'A': -2}
@@ -0,0 +1,77 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# The difficulty ring buffer must agree with Consensus.adjust_difficulty,
+# which recomputes the difficulty from the full list of blocks.
+
+import random
+import pytest
+from chain import ChainView
+from consensus import Consensus
+from database import BlockchainDatabase
+from difficulty import DifficultyTracker
+from parameters import parameters
+from conftest import make_block
+
+@pytest.fixture
+def blocks():
+    rng = random.Random(7)
+    period = parameters['difficulty_adjustment_period']
+    baseline = Consensus(None, None, None)
+    blocks, timestamp = [], 0.0
+    for number in range(1, 6 * period):
+        timestamp += rng.uniform(1, 30)
+        blocks.append(make_block(number, difficulty=baseline.adjust_difficulty(blocks), timestamp=timestamp))
+    return blocks
+
+@pytest.fixture
+def tracker(data_directory, blocks):
+    db = BlockchainDatabase()
+    chain = ChainView(db, 8, 2**20)
+    tracker = DifficultyTracker(chain)
+    for block in blocks:
+        db.save_block(block['block_hash'], block)
+        chain.append(block)
+        tracker.append(block)
+    yield tracker
+    db.close()
+
+def test_required_difficulty_matches_baseline(tracker, blocks):
+    baseline = Consensus(None, None, None)
+    assert tracker.next_difficulty() == baseline.adjust_difficulty(blocks)
+    for block in blocks:
+        assert tracker.required_at(block['block_number']) == block['difficulty']
+
+def test_branch_ancestry_is_read_through_header_at(tracker, blocks):
+    branch = {block['block_number']: dict(block, timestamp=block['timestamp'] / 2) for block in blocks}
+    baseline = Consensus(None, None, None)
+    expected = baseline.adjust_difficulty([branch[number] for number in sorted(branch)])
+    assert tracker.required_at(len(blocks) + 1, branch.__getitem__) == expected
+
+def test_truncate_reloads_window(tracker, blocks):
+    height = len(blocks) - 3
+    tracker.chain.truncate(height)
+    tracker.truncate(height)
+    assert tracker.next_difficulty() == blocks[height]['difficulty']
+
+def test_window_is_bounded_and_read_without_the_chain(tracker, blocks, monkeypatch):
+    period = parameters['difficulty_adjustment_period']
+    assert [entry[0] for entry in tracker.window] == [block['block_number'] for block in blocks[-(period + 1):]]
+    monkeypatch.setattr(tracker.chain, 'get_header', lambda index: pytest.fail("read the chain"))
+    tracker.next_difficulty()
+    assert tracker.required_at(len(blocks) + 1) == tracker.next_difficulty()
+
+def test_blocks_must_be_appended_in_order(tracker, blocks):
+    with pytest.raises(ValueError):
+        tracker.append(make_block(len(blocks) + 2))
+
+def test_equal_timestamps_raise_difficulty_by_the_cap():
+    difficulty = 5 * 10**8
+    assert Consensus.calculate_difficulty(100.0, 100.0, difficulty) == int(difficulty * parameters['max_difficulty_increase'])
+    assert Consensus.calculate_difficulty(100.0, 90.0, difficulty) == int(difficulty * parameters['max_difficulty_increase'])
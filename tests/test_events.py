@@ -0,0 +1,85 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Topic routing of the EventHub and the Server-Sent Events stream.
+
+import json
+import socket
+import time
+import pytest
+from events import EventHub, EventServer, sse_event
+from conftest import make_block, make_transaction
+
+def decode(event):
+    name, data = event.decode('utf-8').strip().split('\n')
+    return name[len('event: '):], json.loads(data[len('data: '):])
+
+def test_events_reach_only_their_topics():
+    hub = EventHub(buffer_size=10, max_subscribers=10)
+    heads, alice = hub.subscribe({'heads'}), hub.subscribe({'address:A', 'mempool'})
+    block = make_block(3, [make_transaction(3, 0, 'A', 'B', 5), make_transaction(3, 1, 'C', 'D', 1)])
+    hub.publish_block(block)
+    hub.publish_transactions([{'tx_hash': 'pending'}])
+
+    assert [decode(event)[0] for event in heads.events] == ['head']
+    assert 'transactions' not in decode(heads.events[0])[1]
+    assert [decode(event) for event in alice.events] == [
+        ('confirmed', block['transactions'][0]), ('pending', {'tx_hash': 'pending'})
+    ]
+
+def test_slow_subscribers_lose_the_oldest_events():
+    hub = EventHub(buffer_size=2, max_subscribers=10)
+    subscription = hub.subscribe({'mempool'})
+    hub.publish_transactions([{'tx_hash': str(index)} for index in range(5)])
+    assert [decode(event)[1]['tx_hash'] for event in subscription.events] == ['3', '4']
+    assert subscription.dropped == 3
+
+def test_subscriber_limit_and_unsubscribe():
+    hub = EventHub(buffer_size=2, max_subscribers=1)
+    subscription = hub.subscribe({'heads', 'mempool'})
+    assert hub.subscribe({'heads'}) is None
+    hub.unsubscribe(subscription)
+    assert hub.subscribers == {} and hub.count == 0
+    assert hub.subscribe({'heads'}) is not None
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def server():
+    server = EventServer(EventHub(buffer_size=10, max_subscribers=10), '127.0.0.1', free_port())
+    server.start()
+    yield server
+    server.loop.call_soon_threadsafe(server.loop.stop)
+
+def read_until(sock, marker):
+    data = b''
+    while marker not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+def test_stream_delivers_published_events(server):
+    with socket.create_connection((server.host, server.port), timeout=5) as client:
+        client.sendall(b"GET /events?topics=heads HTTP/1.1\r\nHost: node\r\n\r\n")
+        assert read_until(client, b"\r\n\r\n").startswith(b"HTTP/1.1 200 OK")
+        deadline = time.monotonic() + 5
+        while not server.hub.subscribers and time.monotonic() < deadline:
+            time.sleep(0.01)
+        server.hub.publish_block(make_block(1))
+        assert sse_event('head', {key: value for key, value in make_block(1).items() if key != 'transactions'}) in read_until(client, b"\n\n")
+
+def test_stream_requires_topics(server):
+    with socket.create_connection((server.host, server.port), timeout=5) as client:
+        client.sendall(b"GET /events HTTP/1.1\r\n\r\n")
+        assert read_until(client, b"\r\n\r\n").startswith(b"HTTP/1.1 400")
@@ -0,0 +1,64 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Inventory bookkeeping for inv/getdata gossip.
+
+from gossip import Inventory, SeenCache, transaction_id
+
+def item(object_hash):
+    return {'kind': 'transaction', 'hash': object_hash}
+
+def test_seen_cache_evicts_least_recently_touched():
+    cache = SeenCache(2)
+    assert cache.add('a') and cache.add('b')
+    assert not cache.add('a')  # Touching 'a' makes 'b' the oldest
+    cache.add('c')
+    assert 'a' in cache and 'c' in cache and 'b' not in cache
+    assert len(cache) == 2
+
+def test_announced_items_are_fetched_once(monkeypatch):
+    inventory = Inventory(seen_size=10, relay_size=10, peer_known_size=10, request_timeout=5)
+    now = [100.0]
+    monkeypatch.setattr('gossip.time.time', lambda: now[0])
+
+    assert inventory.to_request('first', [item('x'), item('y')]) == [item('x'), item('y')]
+    # Already being fetched from the first peer
+    assert inventory.to_request('second', [item('x')]) == []
+    assert 'x' in inventory.known_by('second')
+
+    assert inventory.received('first', 'x') and inventory.validated('x')
+    assert not inventory.received('second', 'x')  # A duplicate delivery
+    assert inventory.to_request('second', [item('x')]) == []
+
+    # A request that was never answered is retried elsewhere after the timeout
+    now[0] += 6
+    assert inventory.to_request('second', [item('y')]) == [item('y')]
+
+def test_objects_are_seen_only_once_validated():
+    inventory = Inventory(seen_size=10, relay_size=10, peer_known_size=10, request_timeout=5)
+    inventory.to_request('forger', [item('x')])
+    assert inventory.received('forger', 'x')
+    inventory.rejected('x')
+    # The forged copy neither counts as seen nor keeps the hash in flight
+    assert 'x' not in inventory.seen
+    assert inventory.to_request('honest', [item('x')]) == [item('x')]
+    assert inventory.received('honest', 'x') and inventory.validated('x')
+    assert not inventory.validated('x')  # A copy validated concurrently
+
+def test_forgotten_peers_lose_their_known_set():
+    inventory = Inventory(seen_size=10, relay_size=10, peer_known_size=10, request_timeout=5)
+    inventory.to_request('peer', [item('x')])
+    inventory.forget_peer('peer')
+    assert 'x' not in inventory.known_by('peer')
+
+def test_legacy_transactions_are_identified_by_payload():
+    legacy = {'sender': 'A', 'recipient': 'B', 'amount': 1}
+    assert transaction_id(legacy) == transaction_id(dict(legacy))
+    assert transaction_id(dict(legacy, amount=2)) != transaction_id(legacy)
+    assert transaction_id({'tx_hash': 'abc'}) == 'abc'
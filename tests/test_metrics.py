@@ -0,0 +1,55 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Bounded metric series and their Prometheus exposition.
+
+import pytest
+from metrics import PREFIX, Metrics, Series
+
+def test_window_keeps_only_recent_samples():
+    series = Series(window=3)
+    for value in range(1, 11):
+        series.observe(value)
+    assert list(series.recent) == [8, 9, 10]
+    assert series.window_mean() == pytest.approx(9)
+    # All-time aggregates still cover every sample
+    assert (series.count, series.sum, series.min, series.max) == (10, 55, 1, 10)
+
+def test_window_sum_does_not_drift():
+    series = Series(window=4)
+    for value in [0.1] * 1000 + [1, 2, 3, 4]:
+        series.observe(value)
+    assert series.window_mean() == pytest.approx(2.5)
+
+def test_histogram_buckets_are_cumulative_in_exposition():
+    metrics = Metrics(window=10)
+    for seconds in (0.5, 3, 12, 500):
+        metrics.add_block_time(seconds)
+    lines = metrics.exposition().splitlines()
+    name = f"{PREFIX}block_interval_seconds"
+    assert f'{name}_bucket{{le="1"}} 1' in lines
+    assert f'{name}_bucket{{le="15"}} 3' in lines
+    assert f'{name}_bucket{{le="300"}} 3' in lines
+    assert f'{name}_bucket{{le="+Inf"}} 4' in lines
+    assert f"{name}_count 4" in lines
+    assert f"# TYPE {name} histogram" in lines
+
+def test_counters_gauges_and_summaries():
+    metrics = Metrics(window=10)
+    metrics.increment('p2p_messages_received_total', type='inv')
+    metrics.increment('p2p_messages_received_total', 2, type='inv')
+    metrics.set_gauge('chain_height', lambda: 42)
+    metrics.set_gauge('p2p_peers', lambda: 1 / 0)  # A broken source is skipped, not fatal
+    metrics.add_hash_rate(100)
+    lines = metrics.exposition().splitlines()
+    assert f'{PREFIX}p2p_messages_received_total{{type="inv"}} 3' in lines
+    assert f"{PREFIX}chain_height 42" in lines
+    assert not any(line.startswith(f"{PREFIX}p2p_peers ") for line in lines)
+    assert f"# TYPE {PREFIX}hash_rate summary" in lines
+    assert f"{PREFIX}hash_rate_window_mean 100.0" in lines
@@ -0,0 +1,245 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Peer connections: the event loop transport between two networks on
+# loopback sockets, send queues, bandwidth caps and batched announcements.
+
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+import network
+from network import P2PNetwork, PeerConnection, RateLimiter
+from parameters import parameters
+from protocol import KB, FrameReader, ProtocolError
+from conftest import make_transaction, mine_child, reward
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail("Timed out waiting for the peer")
+        time.sleep(0.01)
+
+@pytest.fixture
+def networks(data_directory):
+    """A listening network and a second one that dials it."""
+    listener, dialer = P2PNetwork('127.0.0.1', 0), P2PNetwork('127.0.0.1', 0)
+    listener.start_server()
+    yield listener, dialer
+    for network in (listener, dialer):
+        if network.loop is not None:
+            network.run_in_loop(shut_down(network), timeout=5)
+            network.loop.call_soon_threadsafe(network.loop.stop)
+
+async def shut_down(network):
+    if network.server is not None:
+        network.server.close()
+    for connection in list(network.peers.values()):
+        connection.transport.close()
+    await asyncio.sleep(0.05)  # Lets connection_lost cancel the writer tasks
+
+def test_messages_cross_a_connection_in_order(networks, monkeypatch):
+    listener, dialer = networks
+    received = []
+    monkeypatch.setattr(listener, 'process_message', lambda message, peer_id: received.append((peer_id, message)))
+    port = listener.server.sockets[0].getsockname()[1]
+    peer_id = f"node://listener@127.0.0.1:{port}"
+
+    dialer.connect_to_peer(peer_id)
+    wait_until(lambda: dialer.node_id in listener.peers)
+    for index in range(50):
+        dialer.send(peer_id, {'type': 'getdata', 'items': [{'kind': 'transaction', 'hash': str(index)}]})
+    wait_until(lambda: len(received) == 50)
+    assert [message['items'][0]['hash'] for _, message in received] == [str(index) for index in range(50)]
+    assert {sender for sender, _ in received} == {dialer.node_id}
+
+def test_requests_are_answered_on_the_event_loop(networks):
+    listener, dialer = networks
+    port = listener.server.sockets[0].getsockname()[1]
+    peer_id = f"node://listener@127.0.0.1:{port}"
+    dialer.connect_to_peer(peer_id)
+    wait_until(lambda: dialer.node_id in listener.peers)
+
+    # The listener answers from its bridge thread; the dialer's caller blocks until the answer arrives
+    def answer(message, sender):
+        if message['type'] == 'get_headers':
+            listener.send(sender, {'type': 'headers', 'response_to': message['request_id'], 'headers': [], 'height': 0})
+    listener.process_message = answer
+    response = dialer.request(peer_id, {'type': 'get_headers', 'from_height': 1, 'count': 1}, timeout=5)
+    assert response['type'] == 'headers' and response['height'] == 0
+    assert dialer.pending_requests == {}
+
+def test_full_queue_drops_low_priority_frames_first(monkeypatch):
+    monkeypatch.setitem(parameters, 'peer_send_queue_size', 4)
+    connection = PeerConnection(network=None)
+    high, low = connection.queues
+    connection.enqueue(b'i' * KB, low_priority=True)
+    connection.enqueue(b'b' * KB)
+    connection.enqueue(b'j' * KB, low_priority=True)
+    connection.enqueue(b'c' * KB)
+    assert connection.queued_bytes == 4 * KB
+
+    # Room is made by dropping the oldest low-priority frame
+    connection.enqueue(b'd' * KB)
+    assert [frame[:1] for frame in low] == [b'j']
+    assert [frame[:1] for frame in high] == [b'b', b'c', b'd']
+    connection.enqueue(b'e' * KB)
+    assert not low and connection.dropped_frames == 2
+
+    # With only high-priority frames left, the new frame is the one dropped
+    connection.enqueue(b'f' * KB)
+    assert [frame[:1] for frame in high] == [b'b', b'c', b'd', b'e']
+    assert connection.dropped_frames == 3
+    assert connection.queued_bytes == 4 * KB
+
+def test_oversized_frame_is_sent_once_the_queue_is_empty(monkeypatch):
+    monkeypatch.setitem(parameters, 'peer_send_queue_size', 1)
+    connection = PeerConnection(network=None)
+    connection.enqueue(b'x' * (2 * KB))
+    assert connection.queued_bytes == 2 * KB
+    connection.enqueue(b'y' * KB)
+    assert connection.dropped_frames == 1
+
+def test_rate_limiter_refills_over_time(monkeypatch):
+    now = [0.0]
+    slept = []
+    async def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+    monkeypatch.setattr(network.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(network.asyncio, 'sleep', sleep)
+
+    limiter = RateLimiter(1000)  # Bytes per second, with a one second burst
+    asyncio.run(limiter.acquire(1000))
+    assert slept == []
+    asyncio.run(limiter.acquire(500))
+    assert slept == [0.5]
+
+    # Idle time refills the bucket, but never beyond one second's worth
+    now[0] += 10
+    asyncio.run(limiter.acquire(1000))
+    assert slept == [0.5]
+    asyncio.run(limiter.acquire(250))
+    assert slept == [0.5, 0.25]
+
+def test_unlimited_rate_never_waits(monkeypatch):
+    monkeypatch.setattr(network.asyncio, 'sleep', lambda seconds: pytest.fail("An unlimited limiter waited"))
+    asyncio.run(RateLimiter(0).acquire(10**9))
+
+class ManualLoop:
+    """Runs thread-safe callbacks at once and holds timers until fired by hand."""
+
+    def __init__(self):
+        self.timers = []
+
+    def call_soon_threadsafe(self, callback, *args):
+        callback(*args)
+
+    def call_later(self, delay, callback):
+        self.timers.append((delay, callback))
+        return callback
+
+@pytest.fixture
+def announcing(data_directory, monkeypatch):
+    """A network with two peers whose sent messages are decoded and recorded."""
+    monkeypatch.setitem(parameters, 'tx_batch_size', 3)
+    monkeypatch.setitem(parameters, 'tx_batch_interval', 200)
+    network = P2PNetwork()
+    network.loop = ManualLoop()
+    network.peers = {peer_id: SimpleNamespace(compression=False) for peer_id in ('a', 'b')}
+    sent = []
+    def record(peer_id, peer, frame, low_priority=False):
+        reader = FrameReader()
+        reader.feed(frame)
+        sent.extend((peer_id, message) for message in reader.messages())
+    monkeypatch.setattr(network, 'send_frame', record)
+    return network, sent
+
+def transaction(index, size=0):
+    return {'tx_hash': f"tx{index}", 'sender': 'A', 'recipient': 'B', 'value': 1, 'size': size, 'text': 'x' * size}
+
+def test_transactions_are_announced_in_batches(announcing):
+    network, sent = announcing
+    network.relay_transactions([transaction(index) for index in range(4)], exclude_peer='b')
+    # A full batch goes out at once; the rest waits for the timer
+    assert [(peer_id, [item['hash'] for item in message['items']]) for peer_id, message in sent] == [('a', ['tx0', 'tx1', 'tx2'])]
+    assert [delay for delay, _ in network.loop.timers] == [0.2]
+
+    network.relay_transactions([transaction(4)])
+    assert len(network.loop.timers) == 1  # One timer covers everything queued meanwhile
+    network.loop.timers.pop()[1]()
+    assert sorted((peer_id, [item['hash'] for item in message['items']]) for peer_id, message in sent[1:]) == [
+        ('a', ['tx3', 'tx4']), ('b', ['tx4'])
+    ]
+
+    # Peers are not told again about what they were already sent
+    network.relay_transactions([transaction(4)])
+    assert network.announcements == {} and len(sent) == 3
+
+def test_getdata_answers_transactions_in_block_sized_batches(announcing, monkeypatch):
+    monkeypatch.setitem(parameters, 'block_size', 8)
+    network, sent = announcing
+    network.relay_transactions([transaction(index, size=KB) for index in range(4)])
+    sent.clear()
+    network.process_message({'type': 'getdata', 'items': [{'kind': 'transaction', 'hash': f"tx{index}"} for index in range(4)]}, 'a')
+    # Each transaction counts 2 * size + 1KB against the 8KB block size
+    assert [[tx['tx_hash'] for tx in message['transactions']] for _, message in sent] == [['tx0', 'tx1'], ['tx2', 'tx3']]
+
+@pytest.mark.parametrize('hello', [
+    {'type': 'hello'},
+    {'type': 'hello', 'node_id': None},
+    {'type': 'hello', 'node_id': 'listener'},
+    {'type': 'hello', 'node_id': 'node://a@b@127.0.0.1:1'},
+    {'type': 'hello', 'node_id': 'node://a@127.0.0.1:port'},
+])
+def test_hello_without_a_valid_node_id_is_a_protocol_error(data_directory, hello):
+    network = P2PNetwork('127.0.0.1', 0)
+    with pytest.raises(ProtocolError):
+        network.on_hello(SimpleNamespace(peer_id=None), hello)
+    assert not network.peers
+
+def test_hello_cannot_take_over_a_connected_peer(data_directory):
+    network = P2PNetwork('127.0.0.1', 0)
+    connected = SimpleNamespace(peer_id='node://a@127.0.0.1:1')
+    network.peers[connected.peer_id] = connected
+    for node_id in (connected.peer_id, network.node_id):
+        with pytest.raises(ProtocolError):
+            network.on_hello(SimpleNamespace(peer_id=None), {'type': 'hello', 'node_id': node_id})
+    assert network.peers == {connected.peer_id: connected}
+
+@pytest.fixture
+def gossiping(blockchain, announcing):
+    network, sent = announcing
+    blockchain.attach_network(network)
+    return blockchain, network
+
+def test_forged_transaction_does_not_censor_the_real_one(gossiping, monkeypatch):
+    blockchain, network = gossiping
+    genuine = make_transaction(0, 0, 'A', 'B', 1)
+    genuine['tx_hash'] = blockchain.hash_transaction(genuine)
+    added = []
+    monkeypatch.setattr(blockchain, 'add_transactions', lambda transactions: added.extend(transactions) or ['Rejected'] * len(transactions))
+
+    network.process_message({'type': 'transactions', 'transactions': [dict(genuine, value=1000)]}, 'a')
+    assert added == [] and genuine['tx_hash'] not in network.inventory.seen
+    network.process_message({'type': 'transactions', 'transactions': [genuine]}, 'b')
+    assert added == [genuine] and genuine['tx_hash'] in network.inventory.seen
+
+def test_forged_block_does_not_censor_the_real_one(gossiping):
+    blockchain, network = gossiping
+    tip = blockchain.chain.get_header(-1)
+    block = mine_child(blockchain, tip, [reward(blockchain, 'A', tip['block_number'] + 1)])
+    forged = dict(block, transactions=[dict(block['transactions'][0], recipient='forger')])
+
+    network.process_message({'type': 'block', 'block': forged}, 'a')
+    assert len(blockchain.chain) == 1 and block['block_hash'] not in network.inventory.seen
+    network.process_message({'type': 'block', 'block': block}, 'b')
+    assert blockchain.chain.get_header(-1)['block_hash'] == block['block_hash']
+    assert block['block_hash'] in network.inventory.seen
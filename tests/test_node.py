@@ -0,0 +1,244 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Block acceptance, fork choice and account state of a node built on a
+# temporary data directory. Blocks are mined for real at the initial
+# difficulty, which only needs a leading zero.
+
+import pytest
+from parameters import parameters
+from conftest import REWARD, reward, mine_child
+
+def genesis(blockchain):
+    return blockchain.chain.get_header(0)
+
+def test_mined_block_extends_chain(blockchain):
+    block = mine_child(blockchain, genesis(blockchain), [reward(blockchain, 'A', 2)])
+    assert blockchain.receive_block(block) == 'extended'
+    assert blockchain.chain.get_header(-1)['block_hash'] == block['block_hash']
+    assert blockchain.state.get_balance('A') == REWARD
+
+def test_forged_hash_is_rejected(blockchain):
+    block = mine_child(blockchain, genesis(blockchain), [reward(blockchain, 'A', 2)])
+    block['block_hash'] = '0' * 128  # Meets any difficulty, but is not the block's hash
+    assert blockchain.receive_block(block) == 'invalid'
+    assert len(blockchain.chain) == 1
+
+def test_changed_transactions_are_rejected(blockchain):
+    block = mine_child(blockchain, genesis(blockchain), [reward(blockchain, 'A', 2)])
+    block['transactions'][0]['recipient'] = 'B'
+    assert blockchain.receive_block(block) == 'invalid'
+
+def test_transaction_hashes_must_match_their_contents(blockchain):
+    root = genesis(blockchain)
+    paid = reward(blockchain, 'A', 2)
+    spoofed = dict(reward(blockchain, 'B', 2), tx_hash=paid['tx_hash'])  # Covered by tx_root, but not its own hash
+    assert blockchain.receive_block(mine_child(blockchain, root, [spoofed])) == 'invalid'
+    assert blockchain.receive_block(mine_child(blockchain, root, [paid, dict(paid)])) == 'invalid'
+    incomplete = {key: value for key, value in paid.items() if key != 'sender'}
+    assert blockchain.receive_block(mine_child(blockchain, root, [incomplete])) == 'invalid'
+    assert len(blockchain.chain) == 1
+
+def test_transaction_annotations_come_from_the_block(blockchain):
+    block = mine_child(blockchain, genesis(blockchain), [reward(blockchain, 'A', 2), reward(blockchain, 'B', 2)])
+    block['transactions'][0] = {key: value for key, value in block['transactions'][0].items() if key != 'block_number'}
+    block['transactions'][1].update(block_hash='other', block_number=99, transaction_index=0)
+    assert blockchain.receive_block(block) == 'extended'
+    for index, transaction in enumerate(block['transactions']):
+        stored = blockchain.db.get_transaction(transaction['tx_hash'])
+        assert (stored['block_hash'], stored['block_number'], stored['transaction_index']) == (block['block_hash'], 2, index)
+
+def test_stored_blocks_still_verify(blockchain):
+    block = mine_child(blockchain, genesis(blockchain), [reward(blockchain, 'A', 2)])
+    blockchain.receive_block(block)
+    blockchain.chain.cache.clear()  # Read the block back from the database
+    stored = blockchain.chain[1]
+    assert blockchain.check_block(stored)
+
+def test_side_branch_difficulty_is_checked(blockchain):
+    root = genesis(blockchain)
+    canonical = mine_child(blockchain, root, miner='A')
+    assert blockchain.receive_block(canonical) == 'extended'
+    side = mine_child(blockchain, root, miner='B', timestamp=root['timestamp'] + 10)
+    assert blockchain.receive_block(side) == 'side'
+
+    # A higher difficulty than the branch requires would win fork choice with fake work
+    forged = mine_child(blockchain, side, miner='B', difficulty=2 * 10**8)
+    assert blockchain.receive_block(forged) == 'invalid'
+    assert blockchain.chain.get_header(-1)['block_hash'] == canonical['block_hash']
+
+    honest = mine_child(blockchain, side, miner='B')
+    assert blockchain.receive_block(honest) == 'reorganized'
+
+def test_side_branch_difficulty_follows_branch_timestamps(blockchain):
+    period = parameters['difficulty_adjustment_period']
+    baseline = blockchain.consensus  # Consensus.adjust_difficulty walks the full block list
+    root = genesis(blockchain)
+    parent = root
+    for _ in range(period + 2):
+        parent = mine_child(blockchain, parent, miner='A')
+        assert blockchain.receive_block(parent) == 'extended'
+
+    # The side branch is mined twice as fast, so its difficulty rises
+    branch = [root]
+    for _ in range(period + 2):
+        difficulty = baseline.adjust_difficulty(branch)
+        branch.append(mine_child(blockchain, branch[-1], miner='B', difficulty=difficulty,
+                                 timestamp=branch[-1]['timestamp'] + 7))
+        assert blockchain.receive_block(branch[-1]) == 'side'
+    assert branch[-1]['difficulty'] > parameters['initial_difficulty']
+
+    stale = mine_child(blockchain, branch[-2], miner='C', timestamp=branch[-2]['timestamp'] + 7)
+    assert blockchain.receive_block(stale) == 'invalid'
+
+def test_reorganization_restores_balances(blockchain):
+    root = genesis(blockchain)
+    canonical = mine_child(blockchain, root, [reward(blockchain, 'A', 2)])
+    blockchain.receive_block(canonical)
+    first = mine_child(blockchain, root, [reward(blockchain, 'B', 2)], timestamp=root['timestamp'] + 10)
+    second = mine_child(blockchain, first, [reward(blockchain, 'B', 3)])
+    blockchain.receive_block(first)
+    assert blockchain.receive_block(second) == 'reorganized'
+
+    assert blockchain.state.get_balance('A') == 0
+    assert blockchain.state.get_balance('B') == 2 * REWARD
+    assert blockchain.db.get_balances() == {'B': 2 * REWARD}
+
+def test_reorganization_validates_only_the_new_suffix(blockchain, monkeypatch):
+    canonical = [genesis(blockchain)]
+    for _ in range(4):
+        canonical.append(mine_child(blockchain, canonical[-1], miner='A'))
+        assert blockchain.receive_block(canonical[-1]) == 'extended'
+    branch = [canonical[2]]
+    for _ in range(3):
+        branch.append(mine_child(blockchain, branch[-1], miner='B'))
+    assert [blockchain.receive_block(block) for block in branch[1:3]] == ['side', 'side']
+
+    checked = []
+    check_block = blockchain.check_block
+    monkeypatch.setattr(blockchain, 'check_block', lambda block: checked.append(block['block_number']) or check_block(block))
+    assert blockchain.receive_block(branch[3]) == 'reorganized'
+    assert checked == [6, 4, 5, 6]  # The arriving block, then only the blocks after the fork point
+    assert blockchain.chain.get_header(-1)['block_hash'] == branch[3]['block_hash']
+
+def test_invalid_suffix_leaves_the_chain_unchanged(blockchain):
+    root = genesis(blockchain)
+    canonical = mine_child(blockchain, root, [reward(blockchain, 'A', 2)])
+    blockchain.receive_block(canonical)
+    first = mine_child(blockchain, root, [reward(blockchain, 'B', 2)], miner='B')
+    second = mine_child(blockchain, first, [reward(blockchain, 'B', 3)], miner='B')
+    second['transactions'][0]['value'] *= 2  # No longer matches the header's tx_root
+
+    with pytest.raises(ValueError):
+        blockchain.reorganize(1, [first, second])
+    assert blockchain.chain.get_header(-1)['block_hash'] == canonical['block_hash']
+    assert blockchain.state.get_balance('A') == REWARD
+    assert blockchain.state.get_balance('B') == 0
+
+def test_reorganization_returns_transactions_to_the_pool(blockchain):
+    root = blockchain.chain.get_header(-1)
+    funded = mine_child(blockchain, root, [reward(blockchain, 'A', 2)])
+    blockchain.receive_block(funded)
+    blockchain.new_transaction('A', 'B', 100)
+    transfer = dict(blockchain.current_transactions[0])
+    blockchain.new_block(proof=0)
+    assert blockchain.current_transactions == []
+
+    first = mine_child(blockchain, funded, [reward(blockchain, 'C', 3)], miner='C')
+    second = mine_child(blockchain, first, [reward(blockchain, 'C', 4)], miner='C')
+    blockchain.receive_block(first)
+    assert blockchain.receive_block(second) == 'reorganized'
+
+    assert blockchain.current_transactions == [transfer]  # The block reward of the replaced block is not restored
+    assert blockchain.state.get_balance('A') == REWARD - 100 - transfer['fee']
+    assert blockchain.state.get_balance('B') == 100
+    assert blockchain.db.get_balances() == {'A': REWARD, 'C': 2 * REWARD}
+
+def test_failed_reorganization_keeps_the_tree_on_the_chain_tip(blockchain, monkeypatch):
+    root = genesis(blockchain)
+    canonical = mine_child(blockchain, root, miner='A')
+    blockchain.receive_block(canonical)
+    side = mine_child(blockchain, root, miner='B')
+    assert blockchain.receive_block(side) == 'side'
+
+    def refuse(height, blocks):
+        raise ValueError("refused")
+    monkeypatch.setattr(blockchain, 'check_extends', refuse)
+    heavier = mine_child(blockchain, side, miner='B')
+    assert blockchain.receive_block(heavier) == 'invalid'
+    assert blockchain.block_tree.best_hash == canonical['block_hash'] == blockchain.chain.get_header(-1)['block_hash']
+    assert heavier['block_hash'] not in blockchain.block_tree
+
+def test_pending_transaction_is_counted_once(blockchain):
+    blockchain.receive_block(mine_child(blockchain, genesis(blockchain), [reward(blockchain, 'A', 2)]))
+    blockchain.new_transaction('A', 'B', 100)
+    fee = blockchain.current_transactions[0]['fee']
+    assert blockchain.state.get_balance('A') == REWARD - 100 - fee
+
+    block = blockchain.new_block(proof=0)
+    assert block['transaction_count'] == 1
+    assert blockchain.current_transactions == []
+    assert blockchain.state.get_balance('A') == REWARD - 100 - fee
+    assert blockchain.state.get_balance('B') == 100
+    assert blockchain.db.get_balance_at('B', block['block_number']) == 100
+
+def test_concurrent_transactions_cannot_overspend(blockchain):
+    import threading
+    blockchain.receive_block(mine_child(blockchain, genesis(blockchain), [reward(blockchain, 'A', 2)]))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(blockchain.new_transaction('A', 'B', REWARD // 4 + 1)))
+               for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(blockchain.current_transactions) == 3
+    assert results.count("Insufficient funds") == 13
+    assert blockchain.state.get_balance('A') >= 0
+
+    block = blockchain.new_block(proof=0)
+    assert block['transaction_count'] == 3
+    assert block['transactions'] is not blockchain.current_transactions
+
+def test_block_hash_depends_on_the_network_scratchpad(blockchain, monkeypatch):
+    block = mine_child(blockchain, genesis(blockchain), [reward(blockchain, 'A', 2)])
+    assert blockchain.hash(block) == block['block_hash']
+    network_id = parameters['network_id']
+    monkeypatch.setitem(parameters, 'network_id', network_id + 1)
+    assert blockchain.hash(block) != block['block_hash']
+    monkeypatch.setitem(parameters, 'network_id', network_id)
+    monkeypatch.setitem(parameters, 'memory_usage', 1)
+    assert blockchain.hash(block) != block['block_hash']
+
+def test_node_refuses_a_chain_of_an_earlier_block_format(data_directory, monkeypatch):
+    import node
+    from database import BlockchainDatabase
+    from conftest import make_block
+    db = BlockchainDatabase()
+    db.save_blocks([make_block(1)])  # Its hash is not the hash of its header
+    db.close()
+    monkeypatch.setattr(node.time, 'sleep', lambda seconds: None)
+    with pytest.raises(ValueError, match="Upgrading"):
+        node.Blockchain()
+
+def test_orphan_asks_the_sender_for_its_parent(blockchain, monkeypatch):
+    parent = mine_child(blockchain, genesis(blockchain), [reward(blockchain, 'A', 2)])
+    child = mine_child(blockchain, parent, [reward(blockchain, 'A', 3)])
+    network = blockchain.p2p_network
+    sent = []
+    monkeypatch.setattr(network, 'send', lambda peer_id, message: sent.append((peer_id, message)))
+
+    network.process_message({'type': 'block', 'block': child}, 'peer')
+    assert len(blockchain.orphans) == 1
+    assert sent == [('peer', {'type': 'getdata', 'items': [{'kind': 'block', 'hash': parent['block_hash']}]})]
+
+    network.process_message({'type': 'block', 'block': child}, 'other')  # Known orphan, parent already requested
+    assert len(sent) == 1
+    network.process_message({'type': 'block', 'block': parent}, 'peer')
+    assert blockchain.chain.get_header(-1)['block_hash'] == child['block_hash']
@@ -0,0 +1,66 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Ranking, eviction and persistence of the peer address book.
+
+import pytest
+from peerstore import PeerStore
+
+def node(name, port):
+    return f"node://{name}@10.0.0.1:{port}"
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'peers.json')
+
+def test_peers_rank_by_round_trip_and_failures(path):
+    store = PeerStore(path, 10)
+    store.connected(node('fast', 1), 0.05)
+    store.connected(node('slow', 2), 0.4)
+    store.add(node('unreached', 3))
+    assert store.best(3) == [node('fast', 1), node('slow', 2), node('unreached', 3)]
+
+    # Each consecutive failure doubles the peer's score
+    for _ in range(4):
+        store.failed(node('fast', 1))
+    assert store.best(3) == [node('slow', 2), node('fast', 1), node('unreached', 3)]
+    store.connected(node('fast', 1), 0.05)
+    assert store.best(1) == [node('fast', 1)]
+
+def test_round_trip_is_smoothed(path):
+    store = PeerStore(path, 10)
+    store.connected(node('peer', 1), 1.0)
+    store.connected(node('peer', 1), 0.0)
+    assert store.peers['10.0.0.1:1']['rtt'] == pytest.approx(0.7)
+
+def test_peers_are_keyed_by_address(path):
+    store = PeerStore(path, 10)
+    store.connected(node('old-id', 1), 0.1)
+    store.add(node('new-id', 1))  # The same peer after a restart
+    assert len(store) == 1
+    assert store.best(1) == [node('new-id', 1)]
+    store.add('node://wildcard@0.0.0.0:5001')
+    assert len(store) == 1
+
+def test_save_keeps_the_best_peers(path):
+    store = PeerStore(path, 2)
+    for port, rtt in ((1, 0.3), (2, 0.1), (3, 0.2)):
+        store.connected(node('peer', port), rtt)
+    store.served(node('peer', 2), 120)
+    store.save()
+    assert len(store) == 2
+
+    reloaded = PeerStore(path, 2)
+    assert reloaded.best(2) == [node('peer', 2), node('peer', 3)]
+    assert reloaded.peers['10.0.0.1:2']['last_block'] == 120
+
+def test_unreadable_store_starts_empty(path):
+    with open(path, 'w') as file:
+        file.write('{not json')
+    assert len(PeerStore(path, 10)) == 0
@@ -0,0 +1,109 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Encoding P2P messages into frames, optionally compressed, and reading
+# them back from a stream.
+
+import zlib
+import pytest
+from parameters import parameters
+from protocol import COMPRESSED, FRAME_HEADER, MAGIC, MESSAGE_TYPES, PRESET_DICTIONARY, FrameReader, ProtocolError, encode_message, max_payload
+
+HELLO = {'type': 'hello', 'version': 1, 'port': 5000}
+
+def read_all(data, chunk_size=None):
+    reader = FrameReader(initial_size=16)
+    messages = []
+    for i in range(0, len(data), chunk_size or len(data)):
+        reader.feed(data[i:i + (chunk_size or len(data))])
+        messages.extend(reader.messages())
+    return messages
+
+def test_frames_survive_any_split():
+    block = {'type': 'block', 'block': {'block_number': 1, 'transactions': ['x' * 300]}}
+    data = encode_message(HELLO) + encode_message(block) + encode_message(HELLO)
+    assert read_all(data) == [HELLO, block, HELLO]
+    assert read_all(data, chunk_size=1) == [HELLO, block, HELLO]
+    assert read_all(data, chunk_size=7) == [HELLO, block, HELLO]
+
+def test_partial_frame_waits_for_the_rest():
+    data = encode_message(HELLO)
+    reader = FrameReader()
+    reader.feed(data[:-1])
+    assert list(reader.messages()) == []
+    reader.feed(data[-1:])
+    assert list(reader.messages()) == [HELLO]
+
+def test_corrupted_payload_fails_the_checksum():
+    data = bytearray(encode_message(HELLO))
+    data[-2] ^= 0x01
+    with pytest.raises(ProtocolError, match="Checksum mismatch"):
+        read_all(bytes(data))
+
+def test_bad_headers_are_rejected():
+    data = encode_message(HELLO)
+    with pytest.raises(ProtocolError, match="magic"):
+        read_all(b'XXXX' + data[4:])
+    payload = data[FRAME_HEADER.size:]
+    with pytest.raises(ProtocolError, match="Unknown message type"):
+        read_all(FRAME_HEADER.pack(MAGIC, 99, len(payload), 0) + payload)
+    # Refused from the header alone, before the payload arrives
+    with pytest.raises(ProtocolError, match="size limit"):
+        read_all(FRAME_HEADER.pack(MAGIC, 1, max_payload('hello') + 1, 0))
+
+def test_payload_must_match_its_frame_type():
+    data = encode_message(HELLO)
+    with pytest.raises(ProtocolError, match="does not match"):
+        read_all(data[:4] + bytes([2]) + data[5:])
+
+def test_encoding_checks_type_and_size():
+    with pytest.raises(ValueError):
+        encode_message({'type': 'unknown'})
+    with pytest.raises(ValueError):
+        encode_message({'type': 'hello', 'padding': 'x' * max_payload('hello')})
+
+def transactions_message(count):
+    return {'type': 'transactions', 'transactions': [
+        {'tx_hash': f"{index:0128x}", 'sender': 'a' * 40, 'recipient': 'b' * 40, 'value': index, 'size': 0,
+         'fee': 1, 'nonce': 0, 'input': '', 'timestamp': 1700000000.0 + index, 'text': '', 'token': None, 'nft': None}
+        for index in range(count)
+    ]}
+
+def json_payload(message):
+    return encode_message(message)[FRAME_HEADER.size:]
+
+def test_compressed_frames_round_trip():
+    message = transactions_message(20)
+    plain, compressed = encode_message(message), encode_message(message, compress=True)
+    assert FRAME_HEADER.unpack_from(compressed)[1] & COMPRESSED
+    assert len(compressed) < len(plain) / 2
+    assert read_all(compressed + plain, chunk_size=5) == [message, message]
+
+def test_preset_dictionary_shrinks_small_payloads(monkeypatch):
+    monkeypatch.setitem(parameters, 'compression_threshold', 0)
+    message = transactions_message(1)
+    payload = encode_message(message, compress=True)[FRAME_HEADER.size:]
+    without_dictionary = zlib.compress(json_payload(message), parameters['compression_level'])
+    assert len(payload) < len(without_dictionary)
+    # A peer inflating without the dictionary cannot read it
+    with pytest.raises(zlib.error):
+        zlib.decompress(payload)
+    inflater = zlib.decompressobj(zdict=PRESET_DICTIONARY)
+    assert inflater.decompress(payload) == json_payload(message)
+
+def test_small_or_incompressible_payloads_stay_plain():
+    assert encode_message(HELLO, compress=True) == encode_message(HELLO)
+
+def test_compressed_frame_may_not_inflate_past_its_limit(monkeypatch):
+    monkeypatch.setitem(parameters, 'max_inventory_items', 64)
+    bomb = zlib.compressobj(9, zdict=PRESET_DICTIONARY)
+    payload = bomb.compress(b'{"type": "inv", "items": ["' + b'0' * max_payload('inv') * 2 + b'"]}') + bomb.flush()
+    frame = FRAME_HEADER.pack(MAGIC, MESSAGE_TYPES['inv'][0] | COMPRESSED, len(payload), zlib.crc32(payload)) + payload
+    with pytest.raises(ProtocolError, match="exceeds its size limit"):
+        read_all(frame)
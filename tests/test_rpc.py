@@ -0,0 +1,97 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# JSON-RPC batches over the REST endpoints.
+
+import pytest
+from flask import make_response
+from api import create_app, rpc
+from api.rpc import INVALID_PARAMS, INVALID_REQUEST, METHOD_NOT_FOUND, STATE_CHANGING
+from parameters import parameters
+
+@pytest.fixture
+def client(blockchain):
+    return create_app(blockchain, blockchain.miner).test_client()
+
+def call(method, call_id=1, **params):
+    return {'jsonrpc': '2.0', 'id': call_id, 'method': method, 'params': params}
+
+def test_single_call(client, blockchain):
+    response = client.post('/rpc', json=call('accounts.balance', address='A'))
+    assert response.get_json() == {'jsonrpc': '2.0', 'id': 1, 'result': {'address': 'A', 'balance': 0}}
+    assert response.headers['X-Chain-Height'] == '1'
+    assert response.headers['X-Chain-Tip'] == blockchain.chain.get_header(-1)['block_hash']
+
+def test_batch_reports_errors_per_call(client):
+    response = client.post('/rpc', json=[
+        call('accounts.balance', 1, address='A'),
+        call('accounts.unknown', 2),
+        call('accounts.balance', 3, address='A', at='x'),
+        call('accounts.balance', 4),
+        dict(call('accounts.balance', 5, address='A'), jsonrpc='1.0'),
+        'not a call',
+    ])
+    results = response.get_json()
+    assert response.status_code == 200
+    assert 'result' in results[0]
+    assert results[1]['error']['code'] == METHOD_NOT_FOUND
+    assert results[2]['error']['data'] == {'status': 400}
+    assert results[3]['error']['code'] == INVALID_PARAMS
+    assert results[4]['error']['code'] == INVALID_REQUEST and results[4]['id'] == 5
+    assert results[5] == {'jsonrpc': '2.0', 'id': None, 'error': {'code': INVALID_REQUEST, 'message': "Each call must be an object with a method"}}
+
+def test_notifications_get_no_response(client):
+    notification = {'jsonrpc': '2.0', 'method': 'accounts.balance', 'params': {'address': 'A'}}
+    response = client.post('/rpc', json=[notification, call('accounts.balance', 7, address='A')])
+    assert [result['id'] for result in response.get_json()] == [7]
+    assert client.post('/rpc', json=notification).status_code == 204
+    assert client.post('/rpc', json=[notification, notification]).status_code == 204
+
+def test_malformed_batches_are_rejected(client, monkeypatch):
+    assert client.post('/rpc', data='{', content_type='application/json').status_code == 400
+    assert client.post('/rpc', json=[]).status_code == 400
+    monkeypatch.setitem(parameters, 'rpc_max_calls', 2)
+    response = client.post('/rpc', json=[call('blockchain.length', n) for n in range(3)])
+    assert response.status_code == 400
+    assert response.get_json()['error']['code'] == INVALID_REQUEST
+
+def test_batch_straddling_a_block_is_run_again(client, blockchain, monkeypatch):
+    runs = []
+    def dispatch(response):
+        runs.append(response)
+        if len(runs) == 1:  # A block is committed while the first run is in flight
+            blockchain.new_block(proof=0)
+        return make_response(response)
+    monkeypatch.setattr(rpc, 'make_response', dispatch)
+    response = client.post('/rpc', json=call('blockchain.length'))
+    assert len(runs) == 2
+    assert response.headers['X-Chain-Height'] == '2'
+
+def test_pool_changes_do_not_rerun_the_batch(client, blockchain, monkeypatch):
+    blockchain.state.update_balance('A', 10**12)
+    runs = []
+    def dispatch(response):
+        runs.append(response)
+        blockchain.new_transaction('A', 'B', 100)  # The pool moves during every call, the tip does not
+        return make_response(response)
+    monkeypatch.setattr(rpc, 'make_response', dispatch)
+    response = client.post('/rpc', json=[call('accounts.balance', 1, address='B'), call('blockchain.length', 2)])
+    assert response.status_code == 200
+    assert len(runs) == 2  # Both calls, run once
+    assert response.headers['X-Chain-Height'] == '1'
+
+def test_batch_that_never_sees_a_stable_chain_fails(client, blockchain, monkeypatch):
+    def dispatch(response):
+        blockchain.new_block(proof=0)
+        return make_response(response)
+    monkeypatch.setattr(rpc, 'make_response', dispatch)
+    response = client.post('/rpc', json=[call('blockchain.length', 1), call('blockchain.length', 2)])
+    assert response.status_code == 503
+    assert [result['error']['code'] for result in response.get_json()] == [STATE_CHANGING] * 2
+    assert 'X-Chain-Tip' not in response.headers
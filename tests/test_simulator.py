@@ -0,0 +1,72 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Topologies and propagation statistics of the network simulator.
+
+from types import SimpleNamespace
+import pytest
+from simulator import TOPOLOGIES, build_topology, percentiles, report
+
+def connected(edges, count):
+    reached, frontier = {0}, [0]
+    while frontier:
+        node = frontier.pop()
+        for a, b in edges:
+            for near, far in ((a, b), (b, a)):
+                if near == node and far not in reached:
+                    reached.add(far)
+                    frontier.append(far)
+    return len(reached) == count
+
+@pytest.mark.parametrize('kind', TOPOLOGIES)
+def test_topologies_connect_every_node(kind):
+    edges = build_topology(kind, 12, degree=3, seed=1)
+    assert connected(edges, 12)
+    assert all(a != b for a, b in edges)
+    assert len({frozenset(edge) for edge in edges}) == len(edges)  # Each link is dialled once
+
+def test_topology_shapes():
+    assert len(build_topology('full', 5)) == 10
+    assert build_topology('star', 4) == [(1, 0), (2, 0), (3, 0)]
+    assert len(build_topology('ring', 5)) == 5
+    assert build_topology('random', 20, seed=3) == build_topology('random', 20, seed=3)
+
+def test_percentiles():
+    assert percentiles([]) == {}
+    stats = percentiles(list(range(1, 101)))
+    assert stats == {'p50': 51, 'p90': 91, 'p99': 100, 'max': 100}
+
+def test_report_merges_processes():
+    options = SimpleNamespace(nodes=3, topology='line', processes=2, latency=50, duration=8, settle=2)
+    first = {
+        'events': {
+            'blocks_mined': {'b1': (0, 10.0), 'b2': (0, 20.0)},
+            'block_arrivals': [(0, 'b1', 10.0), (1, 'b1', 10.1), (1, 'b2', 20.3)],
+            'transactions_created': {'t1': 5.0},
+            'transaction_arrivals': [(1, 't1', 5.2)],
+        },
+        'bytes_sent': {0: 10240, 1: 20480},
+        'chains': {0: ['g', 'b1'], 1: ['g', 'b1']},
+    }
+    second = {
+        'events': {
+            'blocks_mined': {}, 'block_arrivals': [(2, 'b1', 10.2)],
+            'transactions_created': {}, 'transaction_arrivals': [(2, 't1', 5.4)],
+        },
+        'bytes_sent': {2: 0},
+        'chains': {2: ['g', 'b1']},
+    }
+    result = report(options, [first, second])
+    assert result['blocks']['mined'] == 2
+    assert result['blocks']['stale'] == 1  # b2 never made it onto the majority chain
+    assert result['blocks']['coverage'] == 3 / 4
+    assert result['blocks']['propagation_ms']['max'] == pytest.approx(300)
+    assert result['transactions']['coverage'] == 1
+    assert result['bandwidth_kbps'] == {'min': 0, 'median': 1, 'max': 2}
+    assert result['converged'] == 1
@@ -0,0 +1,133 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+import pytest
+from conftest import make_block, make_transaction
+from storage import SQLiteStorageEngine, create_storage_engine
+
+ENGINES = ['sqlite', 'flatfile']
+
+def store(engine, block):
+    engine.save_block(block['block_hash'], block)
+    engine.save_transactions(block['transactions'])
+
+def chain(length):
+    return [make_block(n, [make_transaction(n, i, 'alice', 'bob', i + 1) for i in range(2)]) for n in range(1, length + 1)]
+
+@pytest.fixture(params=ENGINES)
+def engine(request, tmp_path):
+    engine = create_storage_engine(request.param, str(tmp_path))
+    yield engine
+    engine.close()
+
+def test_unknown_engine(tmp_path):
+    with pytest.raises(ValueError):
+        create_storage_engine('nope', str(tmp_path))
+
+def test_block_lookups(engine):
+    for block in chain(3):
+        store(engine, block)
+    assert engine.get_block('block-2')['block_number'] == 2
+    assert engine.get_block_by_number(3)['block_hash'] == 'block-3'
+    assert engine.get_last_block()['block_number'] == 3
+    assert engine.get_block('missing') is None
+    assert engine.get_block_by_number(4) is None
+    assert engine.get_transaction('tx-2-1')['value'] == 2
+    assert [tx['tx_hash'] for tx in engine.get_block_transactions('block-2')] == ['tx-2-0', 'tx-2-1']
+
+def test_iteration_order(engine):
+    for block in chain(4):
+        store(engine, block)
+    assert [block['block_number'] for block in engine.iter_blocks(2)] == [2, 3, 4]
+    assert [len(block['transactions']) for block in engine.iter_blocks()] == [2, 2, 2, 2]
+    positions = [(tx['block_number'], tx['transaction_index']) for tx in engine.iter_transactions((2, 0))]
+    assert positions == [(2, 1), (3, 0), (3, 1), (4, 0), (4, 1)]
+
+@pytest.mark.parametrize('start', [-5, 0, 1])
+def test_iteration_from_below_the_first_block(engine, start):
+    for block in chain(3):
+        store(engine, block)
+    assert [block['block_number'] for block in engine.iter_blocks(start)] == [1, 2, 3]
+
+def test_truncate(engine):
+    for block in chain(4):
+        store(engine, block)
+        engine.save_balance_deltas(block['block_number'], {'bob': 10})
+    engine.truncate(2)
+    assert engine.get_last_block()['block_number'] == 2
+    assert engine.get_block('block-3') is None
+    assert engine.get_transaction('tx-3-0') is None
+    assert engine.get_balance_at('bob', 4) == 20
+    assert [block['block_number'] for block in engine.iter_blocks()] == [1, 2]
+
+def test_balance_deltas(engine):
+    engine.save_balance_deltas(1, {'alice': 100})
+    engine.save_balance_deltas(3, {'alice': -30, 'bob': 30})
+    assert engine.get_balance_at('alice', 0) is None
+    assert engine.get_balance_at('alice', 2) == 100
+    assert engine.get_balance_at('alice', 3) == 70
+    assert engine.get_balance_at('bob', 9) == 30
+
+def test_engines_agree(tmp_path):
+    engines = []
+    for name in ENGINES:
+        (tmp_path / name).mkdir()
+        engines.append(create_storage_engine(name, str(tmp_path / name)))
+    try:
+        for engine in engines:
+            for block in chain(5):
+                store(engine, block)
+            engine.truncate(3)
+
+        def snapshot(engine):
+            return (
+                [(block['block_hash'], [tx['tx_hash'] for tx in block['transactions']]) for block in engine.iter_blocks()],
+                [tx['tx_hash'] for tx in engine.iter_transactions()],
+                engine.get_last_block()['block_hash'],
+            )
+        assert snapshot(engines[0]) == snapshot(engines[1])
+    finally:
+        for engine in engines:
+            engine.close()
+
+def test_sqlite_streams_in_pages_while_writing(tmp_path, monkeypatch):
+    monkeypatch.setattr(SQLiteStorageEngine, 'ITER_PAGE_SIZE', 3)
+    engine = SQLiteStorageEngine(str(tmp_path))
+    try:
+        for block in chain(4):
+            store(engine, block)
+        streamed = []
+        for transaction in engine.iter_transactions():
+            streamed.append(transaction['tx_hash'])
+            if len(streamed) == 1:
+                store(engine, make_block(5, [make_transaction(5, 0, 'alice', 'bob', 1)]))
+        assert len(streamed) == 9 and streamed[-1] == 'tx-5-0'
+    finally:
+        engine.close()
+
+def test_flatfile_keeps_loose_transactions(tmp_path):
+    engine = create_storage_engine('flatfile', str(tmp_path))
+    block = make_block(1)
+    store(engine, block)
+    store(engine, make_block(2))
+    engine.save_transaction(make_transaction(1, 0, 'alice', 'bob', 5))
+    engine.save_transaction(make_transaction(2, 0, 'alice', 'bob', 6))
+    engine.close()
+
+    engine = create_storage_engine('flatfile', str(tmp_path))
+    assert engine.get_transaction('tx-1-0')['value'] == 5
+    assert [tx['tx_hash'] for tx in engine.get_block_transactions('block-2')] == ['tx-2-0']
+    engine.truncate(1)
+    assert engine.get_transaction('tx-2-0') is None
+    engine.close()
+
+    engine = create_storage_engine('flatfile', str(tmp_path))
+    assert engine.get_transaction('tx-2-0') is None
+    assert engine.get_transaction('tx-1-0') is not None
+    engine.close()
@@ -0,0 +1,244 @@
+# This software is provided "as is", without warranty of any kind,
+# express or implied, including but not limited to the warranties
+# of merchantability, fitness for a particular purpose and
+# noninfringement. In no event shall the authors or copyright
+# holders be liable for any claim, damages, or other liability,
+# whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or
+# other dealings in the software.
+
+# Headers-first sync between two nodes joined by an in-process link.
+
+import pytest
+from network import P2PNetwork
+from parameters import parameters
+from sync import verify_header_chunk
+from conftest import REWARD, reward, mine_child
+
+class Loopback(P2PNetwork):
+    """Delivers every message straight to the other end's process_message, whichever peer it is addressed to."""
+
+    def __init__(self, *peer_ids):
+        super().__init__()
+        self.peers = dict.fromkeys(peer_ids)
+        self.remote = None
+
+    def send(self, peer_id, message):
+        self.remote.process_message(message, 'loopback')
+
+def connect(local, remote, *peer_ids):
+    local_network, remote_network = Loopback(*(peer_ids or ['remote'])), Loopback('loopback')
+    local_network.remote, remote_network.remote = remote_network, local_network
+    local.attach_network(local_network)
+    remote.attach_network(remote_network)
+
+def extend(blockchain, count, recipient):
+    for _ in range(count):
+        tip = blockchain.chain.get_header(-1)
+        block = mine_child(blockchain, tip, [reward(blockchain, recipient, tip['block_number'] + 1)])
+        assert blockchain.receive_block(block) == 'extended'
+
+@pytest.fixture
+def peer(tmp_path, monkeypatch):
+    """A second node with its own data directory."""
+    import node
+    (tmp_path / 'peer').mkdir()
+    monkeypatch.setitem(parameters, 'data_directory', str(tmp_path / 'peer'))
+    monkeypatch.setattr(node.time, 'sleep', lambda seconds: None)
+    peer = node.Blockchain()
+    yield peer
+    peer.db.close()
+
+def headers_of(blockchain):
+    return [blockchain.chain.get_header(index) for index in range(len(blockchain.chain))]
+
+def test_header_chunk_checks_hash_and_required_difficulty(peer):
+    extend(peer, 3, 'A')
+    headers = headers_of(peer)[1:]
+    difficulties = [header['difficulty'] for header in headers]
+    previous_hash = peer.chain.get_header(0)['block_hash']
+    assert verify_header_chunk(headers, previous_hash, difficulties) is None
+
+    forged = [dict(header) for header in headers]
+    forged[1]['block_hash'] = '0' * 128
+    assert verify_header_chunk(forged, previous_hash, difficulties) == 1
+    assert verify_header_chunk(headers, previous_hash, [2 * 10**8] + difficulties[1:]) == 0
+
+def test_header_chunk_checks_linkage(peer):
+    extend(peer, 3, 'A')
+    headers = headers_of(peer)[1:]
+    difficulties = [header['difficulty'] for header in headers]
+    previous_hash = peer.chain.get_header(0)['block_hash']
+    assert verify_header_chunk(headers, 'unrelated', difficulties) == 0
+    assert verify_header_chunk([headers[0], headers[2]], previous_hash, difficulties[:2]) == 1
+
+def test_invalid_header_in_a_later_chunk_rejects_the_peer(blockchain, peer, monkeypatch):
+    extend(peer, 5, 'A')
+    connect(blockchain, peer)
+    monkeypatch.setattr(blockchain.sync_manager, 'chunk_size', 2)  # Headers 1-6 are verified as three chunks
+    get_local_range = peer.p2p_network.get_local_range
+    def forge_last_header(from_height, count, headers_only):
+        blocks = get_local_range(from_height, count, headers_only)
+        return [dict(block, timestamp=0.0) if block['block_number'] == 6 else block for block in blocks]
+    monkeypatch.setattr(peer.p2p_network, 'get_local_range', forge_last_header)
+
+    assert blockchain.sync_manager.download_headers('remote') is None
+    assert blockchain.sync_manager.sync() == 0
+    assert len(blockchain.chain) == 1
+
+def test_ranges_stream_in_bounded_batches(blockchain, peer, monkeypatch):
+    monkeypatch.setitem(parameters, 'max_headers_per_request', 3)
+    extend(peer, 7, 'A')
+    connect(blockchain, peer)
+    network = blockchain.p2p_network
+    batches = [[header['block_number'] for header in batch] for batch in network.stream_range('remote', 'get_headers', 1)]
+    assert batches == [[1, 2, 3], [4, 5, 6], [7, 8]]
+    assert [[block['block_number'] for block in batch] for batch in network.stream_range('remote', 'get_blocks', 3, count=2)] == [[3, 4]]
+
+def test_ranges_replan_when_the_peer_serves_less(blockchain, peer, monkeypatch):
+    extend(peer, 7, 'A')
+    connect(blockchain, peer)
+    get_local_range = peer.p2p_network.get_local_range
+    monkeypatch.setattr(peer.p2p_network, 'get_local_range', lambda from_height, count, headers_only: get_local_range(from_height, min(count, 3), headers_only))
+    batches = list(blockchain.p2p_network.stream_range('remote', 'get_headers', 1))
+    assert [header['block_number'] for batch in batches for header in batch] == list(range(1, 9))
+    assert max(len(batch) for batch in batches) == 3
+    assert not blockchain.p2p_network.pending_requests
+
+def test_sync_adopts_heavier_chain(blockchain, peer):
+    extend(peer, 5, 'A')
+    connect(blockchain, peer)
+    assert blockchain.sync_manager.sync() == 6  # The peer's genesis replaces ours
+    assert blockchain.chain.get_header(-1)['block_hash'] == peer.chain.get_header(-1)['block_hash']
+    assert blockchain.state.get_balance('A') == 5 * REWARD
+
+    extend(peer, 2, 'B')
+    assert blockchain.sync_manager.sync() == 2
+    assert blockchain.state.get_balance('B') == 2 * REWARD
+
+def test_sync_ignores_lighter_chain(blockchain, peer):
+    extend(blockchain, 3, 'A')
+    extend(peer, 1, 'B')
+    connect(blockchain, peer)
+    tip = blockchain.chain.get_header(-1)['block_hash']
+    assert blockchain.sync_manager.sync() == 0
+    assert blockchain.chain.get_header(-1)['block_hash'] == tip
+
+def test_bodies_must_match_verified_headers(blockchain, peer):
+    extend(peer, 2, 'A')
+    headers = headers_of(peer)
+    block = peer.chain[1]
+    assert blockchain.sync_manager.blocks_match(headers, 1, [block])
+    changed = dict(block, transactions=[dict(block['transactions'][0], recipient='B')])
+    assert not blockchain.sync_manager.blocks_match(headers, 1, [changed])
+
+def test_peers_on_the_best_chain_share_the_download(blockchain, peer, monkeypatch):
+    monkeypatch.setitem(parameters, 'max_blocks_per_request', 2)
+    extend(peer, 6, 'A')
+    connect(blockchain, peer, 'first', 'second')
+    requested = []
+    start_request = blockchain.p2p_network.start_request
+    def record(peer_id, message, notify=None):
+        if message['type'] == 'get_blocks':
+            requested.append(peer_id)
+        return start_request(peer_id, message, notify)
+    monkeypatch.setattr(blockchain.p2p_network, 'start_request', record)
+
+    assert blockchain.sync_manager.sync() == 7
+    assert set(requested) == {'first', 'second'}
+
+def test_block_mined_between_batches_stops_the_round(blockchain, peer, monkeypatch):
+    monkeypatch.setitem(parameters, 'max_blocks_per_request', 2)
+    extend(peer, 5, 'A')
+    connect(blockchain, peer)
+    assert blockchain.sync_manager.sync() == 6
+    extend(peer, 4, 'B')
+
+    download_bodies = blockchain.sync_manager.download_bodies
+    def mine_after_first_batch(headers, served):
+        for index, batch in enumerate(download_bodies(headers, served)):
+            yield batch
+            if index == 0:
+                extend(blockchain, 1, 'C')
+    monkeypatch.setattr(blockchain.sync_manager, 'download_bodies', mine_after_first_batch)
+
+    assert blockchain.sync_manager.sync() == 2
+    tip = blockchain.chain.get_header(-1)
+    assert tip['block_number'] == 9 and tip['miner'] == 'miner'
+    assert blockchain.db.get_block(peer.chain.get_header(8)['block_hash']) is None
+    assert blockchain.state.get_balance('C') == REWARD
+    assert blockchain.state.get_balance('B') == 2 * REWARD
+    assert blockchain.db.get_balances() == {address: balance for address, balance in blockchain.state.balances.items() if balance}
+
+def test_common_height_is_the_exact_fork_point(blockchain, peer):
+    extend(peer, 6, 'A')
+    connect(blockchain, peer)
+    assert blockchain.sync_manager.sync() == 7
+    extend(blockchain, 6, 'B')
+    extend(peer, 8, 'C')
+    # Stepping back from height 13 first finds a shared block at height 6
+    assert blockchain.sync_manager.find_common_height('remote') == 7
+
+def test_verified_headers_are_not_verified_again(blockchain, peer, monkeypatch):
+    extend(peer, 3, 'A')
+    connect(blockchain, peer)
+    manager = blockchain.sync_manager
+    matched, candidate = manager.download_headers('remote')
+    assert len(candidate['headers']) == 4
+
+    monkeypatch.setattr(manager, 'verify_pool', lambda: pytest.fail("Verified headers were sent to the pool again"))
+    assert manager.download_headers('remote') == (matched, candidate)
+
+    forged = dict(candidate['headers'][2], timestamp=0.0)  # Same block_hash, different header
+    assert not manager.was_verified(forged)
+
+def test_chunks_from_a_bad_peer_are_fetched_elsewhere(blockchain, peer, monkeypatch):
+    monkeypatch.setitem(parameters, 'max_blocks_per_request', 2)
+    monkeypatch.setitem(parameters, 'stream_window', 1)
+    extend(peer, 6, 'A')
+    connect(blockchain, peer, 'bad', 'good')
+    network = blockchain.p2p_network
+    send = network.send
+    asked = []
+    def forge_from_bad_peer(peer_id, message):
+        if message['type'] != 'get_blocks':
+            return send(peer_id, message)
+        asked.append(peer_id)
+        if peer_id != 'bad':
+            return send(peer_id, message)
+        blocks = peer.p2p_network.get_local_range(message['from_height'], message['count'], headers_only=False)
+        network.process_message({
+            'type': 'blocks', 'response_to': message['request_id'],
+            'blocks': [dict(block, miner='forger') for block in blocks], 'height': len(peer.chain)
+        }, 'bad')
+    monkeypatch.setattr(network, 'send', forge_from_bad_peer)
+
+    assert blockchain.sync_manager.sync() == 7
+    assert asked.count('bad') == 1
+    assert asked.count('good') == 4  # Its own chunks, then the one the bad peer failed
+    assert blockchain.chain.get_header(-1)['block_hash'] == peer.chain.get_header(-1)['block_hash']
+
+def test_download_errors_end_the_round_instead_of_escaping(blockchain, peer, monkeypatch):
+    monkeypatch.setitem(parameters, 'max_blocks_per_request', 2)
+    extend(peer, 5, 'A')
+    connect(blockchain, peer)
+    get_local_range = peer.p2p_network.get_local_range
+    def forge_bodies(from_height, count, headers_only):
+        blocks = get_local_range(from_height, count, headers_only)
+        return blocks if headers_only else [dict(block, miner='forger') for block in blocks]
+    monkeypatch.setattr(peer.p2p_network, 'get_local_range', forge_bodies)
+
+    # The only peer is dropped, so download_bodies runs out of peers and raises
+    assert blockchain.sync_manager.sync() == 0
+    assert len(blockchain.chain) == 1
+    assert not blockchain.p2p_network.pending_requests
+
+def test_protocol_errors_from_the_download_end_the_round(blockchain, peer, monkeypatch):
+    from protocol import ProtocolError
+    extend(peer, 3, 'A')
+    connect(blockchain, peer)
+    def broken_stream(headers, served):
+        raise ProtocolError("Frame too large")
+        yield
+    monkeypatch.setattr(blockchain.sync_manager, 'download_bodies', broken_stream)
+    assert blockchain.sync_manager.sync() == 0
@@ -72,6 +72,15 @@ class Wallet:
         else:
             raise FileNotFoundError(f"Wallet file not found for public key: {public_key}")
 
+    def get_wallet_address(self, name):
+        """Reads the address of the wallet stored as `name` (from list_wallets) without decrypting it."""
+        wallet_filepath = os.path.join(self.accounts_dir, f"{name}.json")
+        try:
+            with open(wallet_filepath, 'r') as wallet_file:
+                return json.load(wallet_file)['public_key']
+        except json.JSONDecodeError:
+            raise ValueError("Corrupted wallet file.")
+
     def list_wallets(self):
         """Lists all wallets stored in the accounts directory."""
         if not os.path.exists(self.accounts_dir):